@@ -4,8 +4,6 @@
 
 import argparse
 
-from configuration.scope_setup import start_capture, stop_capture
-
 
 # The main function.
 def main():
@@ -25,6 +23,10 @@ def main():
                         default="normal")
 
     config = vars(parser.parse_args())
+
+    # the scope setup (and vxi11) is only imported once the arguments are valid
+    from configuration.scope_setup import start_capture, stop_capture
+
     if config['start']:
         start_capture(config['trigger_mode'])
     elif config['stop']:
@@ -1,3 +1,7 @@
+# The name of the setup file that is saved next to the acquired data, see scope_setup.save_setup_file.
+SETUP_FILENAME = "setup.lss"
+
+
 class ValueStr:
     ACQ_TRIGGER_TYPE = "app.Acquisition.Trigger.Type"
     ACQ_TRIGGER_PATTERN = "app.Acquisition.Trigger.Pattern.TriggerPattern"
@@ -5,7 +5,7 @@ import typing
 import vxi11
 
 from pathlib import PureWindowsPath
-from configuration.constants import CmdStr, ValueStr
+from configuration.constants import CmdStr, SETUP_FILENAME, ValueStr
 from configuration.input_signal import InputSignal
 from util.py_helper import printf
 from util.units import Units
@@ -35,7 +35,6 @@ SCOPE_IP = "172.31.200.250"
 # DATA_DIR = PureWindowsPath("F:\\", "eth_shared_folder_ramdisk", "data")
 # DATA_DIR = PureWindowsPath("D:\\", "comsec-data")
 DATA_DIR = PureWindowsPath("R:\\")
-SETUP_FILENAME = "setup.lss"
 
 
 def get_param(param_str: str):
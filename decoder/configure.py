@@ -5,8 +5,7 @@
 import argparse
 import os
 
-from configuration.scope_setup import *
-from configuration.dimm import extract_dimm_id_from_directoryname, get_dimm_configuration
+from util.py_helper import printf
 
 
 # The main function.
@@ -35,6 +34,11 @@ def main():
                         help="path to the JSON data directory of pcddr5-info scripts")
 
     config = vars(parser.parse_args())
+
+    # the scope setup (and vxi11) is only imported once the arguments are valid
+    from configuration.scope_setup import configure_autosave, connect, get_scope_configuration, load_setup_file, \
+        save_setup_file, setup, setup_aux_trigger, setup_ddr_option
+
     if config['setup_file']:
         instr = connect()
 
@@ -57,6 +61,8 @@ def main():
         # if we use the TELEDYNE DDR5 decoder we need information about the DIMM's frequency and the read/write latency
         if config['setup_ddr']:
             # load DIMM-specific details
+            from configuration.dimm import extract_dimm_id_from_directoryname, get_dimm_configuration
+
             dimm_id = extract_dimm_id_from_directoryname(config) if not (d := config['dimm_id']) else int(d)
             printf(f"detected DIMM ID: ", dimm_id)
             dimm_config = get_dimm_configuration(dimm_id, config['dimm_config_dir'])
@@ -2,32 +2,92 @@
 
 # This is the main script for making decoding.
 
+# The stages and the modules they depend on (e.g., NumPy, asyncio and multiprocessing) are imported by the functions
+# that run them, so that the modes that do not decode (e.g., --help, the client and gc subcommands) start quickly;
+# see scripts/bench_startup.py.
+
 import argparse
-import multiprocessing
+import fnmatch
 import os
+import sys
 
-from stages.s0_xmldigtocsv import xmldigtocsv_all
-from stages.s2_decode import decode_all
-from stages.s3_analyze import analyze_all
-from util.dram_command import E_DRAM_TYPE
-from util.py_helper import printf
+from pathlib import Path
+from typing import TYPE_CHECKING
 
-# The main function.
-def main():
+from util.codec import E_CODEC
+from util.options import CHUNK_SIZE, E_DECODE_ENGINE, E_PROFILER, E_XMLDIG_READER, SETTLE_TIME
+from util.py_helper import checkenv, printf
+from util.retention import E_RETENTION
+
+if TYPE_CHECKING:
+    from multiprocessing.pool import Pool
+    from util.pipeline import EventLoopThread
+
+# The memory (in MiB) that a worker is expected to take at most, set by the WORKER_MEMORY env variable; the default
+# number of workers is bounded by the available memory divided by it.
+WORKER_MEMORY = 1024
+
+# The name of the profile of the main process while it runs the conversion and decoding stages as a pipeline (see
+# --pipelined and --profile); the files are profiled in the profiles of their stages.
+PIPELINE_PROFILE = "pipeline"
+
+
+# The gc subcommand: removes the trimmed CSVs of the experiments that have been decoded fully.
+def gc(args: list[str]):
     parser = argparse.ArgumentParser(
-        description="Data acquisition and analysis script for TELEDYNE SDA series scope.",
+        prog="decode.py gc",
+        description="Reclaims the disk space taken by the trimmed CSVs of experiments that have been decoded fully, "
+                    "according to their manifests.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-e", "--expname",
+                        type=str,
+                        default=None,
+                        help="the experiment name (or a dot for the experiment in DATA_DIR itself, see decode_one.sh); "
+                             "by default, all experiments with a manifest in DATA_DIR")
+    parser.add_argument("--dry-run",
+                        action="store_true",
+                        help="only print the space that would be reclaimed")
+    config = vars(parser.parse_args(args))
+
+    from stages.s2_decode import collect_garbage
+    from util.manifest import get_experiment_names
+
+    checkenv('DATA_DIR')
+    if config['expname'] is None:
+        exp_names = get_experiment_names()
+    else:
+        exp_names = ["" if config['expname'] == "." else config['expname']]
+
+    total_files, total_size = 0, 0
+    for exp_name in exp_names:
+        result = collect_garbage(exp_name, config['dry_run'])
+        if result is None:
+            printf(f"skipping experiment {exp_name or '.'} as it has not been decoded fully")
+            continue
+        num_files, size = result
+        printf(f"{'would remove' if config['dry_run'] else 'removed'} {num_files} trimmed CSV(s) "
+               f"({size / 2 ** 20:.1f} MiB) of experiment {exp_name or '.'}")
+        total_files += num_files
+        total_size += size
+    printf(f"{'would reclaim' if config['dry_run'] else 'reclaimed'} {total_size / 2 ** 20:.1f} MiB "
+           f"({total_files} file(s)) in total")
+
 
+# An argument parser that raises a ValueError rather than exiting, e.g., for the arguments of the jobs of the decode
+# server.
+class _JobArgumentParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise ValueError(message)
+
+
+# Adds the arguments that control how an experiment is decoded, see decode_experiment.
+def add_decode_arguments(parser: argparse.ArgumentParser):
     parser.add_argument("--dimm-config-dir",
                         type=str,
                         help="the path to the JSON data directory of pcddr5-info scripts")
     parser.add_argument("-id", "--dimm-id",
                         type=str,
                         help="the internal DIMM ID")
-    parser.add_argument("-e", '--expname',
-                        type=str,
-                        required=True,
-                        help='the experiment name, i.e., folder name in the XMLDIG_DIR directory; e.g.: '20220919_155000_decoder_test_newScope')
     parser.add_argument("-o", "--out-file",
                         default=None,
                         type=str,
@@ -35,6 +95,387 @@ def main():
     parser.add_argument("--ddr4",
                         action="store_true",
                         help="use DDR4 mode (default: DDR5 mode)")
+    parser.add_argument("--engine",
+                        type=str,
+                        choices=[e.value for e in E_DECODE_ENGINE],
+                        default=E_DECODE_ENGINE.regex.value,
+                        help="the implementation used to decode the DRAM commands")
+    parser.add_argument("--chunk-size",
+                        type=int,
+                        default=CHUNK_SIZE // (1024 * 1024),
+                        help="the size of the chunks (in MiB) decoded at once by the vectorized engine; "
+                             "this bounds the memory used per worker independent of the trace size")
+    parser.add_argument("--binary",
+                        action="store_true",
+                        help="also write the decoded commands in the binary columnar format (*.cmds) next to the CSV files")
+    parser.add_argument("--xmldig-reader",
+                        type=str,
+                        choices=[e.value for e in E_XMLDIG_READER],
+                        default=E_XMLDIG_READER.xmldig2csv.value,
+                        help="how the XMLdig files are read: converted to trimmed CSVs by xmldig2csv, or converted "
+                             "by xmldig2csv with its output piped into the decoder")
+    parser.add_argument("--keep-trimmed-csv",
+                        action="store_true",
+                        help="with --xmldig-reader pipe, also write the trimmed CSVs of the files converted "
+                             "by xmldig2csv to DATA_DIR/trimmedcsv")
+    parser.add_argument("--pipelined",
+                        action="store_true",
+                        help="convert and decode the files in a pipeline, i.e., decode each file as soon as it has "
+                             "been converted rather than after all files have been converted")
+    parser.add_argument("--queue-size",
+                        type=int,
+                        default=None,
+                        help="with --pipelined, the maximum number of converted files that wait to be decoded "
+                             "(default: the number of workers)")
+    parser.add_argument("--codec",
+                        type=str,
+                        choices=[e.value for e in E_CODEC],
+                        default=E_CODEC.none.value,
+                        help="the codec the trimmed and the decoded CSVs are compressed with; inputs are "
+                             "decompressed according to their extension regardless of this option")
+    parser.add_argument("--retention",
+                        type=str,
+                        choices=[e.value for e in E_RETENTION],
+                        default=E_RETENTION.keep.value,
+                        help="whether to keep the trimmed CSVs or to remove each of them as soon as it has been "
+                             "decoded")
+    parser.add_argument("--profile",
+                        type=str,
+                        choices=[e.value for e in E_PROFILER],
+                        default=E_PROFILER.off.value,
+                        help="profile each stage in the main process and each file in the workers, and write the "
+                             "merged profile of each stage to PROFILE_DIR (default: DATA_DIR/profiles); trace records "
+                             "a timeline of the stages, files and chunks across all processes instead")
+
+
+# Sets the DATA_DIR env variable to the data directory of an experiment in XMLDIG_DIR unless it is set.
+def set_default_data_dir(exp_name: str):
+    if 'DATA_DIR' not in os.environ:
+        if 'XMLDIG_DIR' in os.environ:
+            data_dir = os.path.join(os.getenv('XMLDIG_DIR'), exp_name, 'data')
+            os.environ['DATA_DIR'] = data_dir
+            printf(f"env variable DATA_DIR not found, using DATA_DIR={data_dir}")
+        else:
+            raise Exception('[-] The DATA_DIR env variable or/and XMLDIG_DIR env variable must be defined.')
+
+
+# Returns the available memory in bytes, or None if it is unknown (e.g., not on Linux).
+def get_available_memory() -> int:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+# Returns the wished number of workers. If none is specified, then one per logical core that the process may run on,
+# but at most as many as fit into the available memory (see WORKER_MEMORY).
+def get_num_workers() -> int:
+    if "NUM_WORKERS" in os.environ:
+        num_workers = int(os.getenv("NUM_WORKERS"))
+        printf(f"using {num_workers} workers")
+        return num_workers
+    num_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    worker_memory = int(os.getenv("WORKER_MEMORY", WORKER_MEMORY)) * 2 ** 20
+    available_memory = get_available_memory()
+    if available_memory is not None and available_memory // worker_memory < num_cores:
+        num_workers = max(available_memory // worker_memory, 1)
+        printf(f"using {num_workers} workers ({num_cores} cores, but {available_memory / 2 ** 20:.0f} MiB of "
+               f"memory available)")
+        return num_workers
+    printf(f"using {num_cores} workers")
+    return num_cores
+
+
+# Converts, decodes and analyzes an experiment, and writes the metrics (and the profiles, see --profile) of the run
+# (see util.metrics).
+# @param config the arguments, see add_decode_arguments
+# @param exp_name the experiment name, or a dot for the experiment in XMLDIG_DIR itself
+# @param pool a pool of num_workers workers that is shared (e.g., by the jobs of the decode server), or None to start
+#   one for each stage
+# @param loop an event loop for the xmldig2csv processes that is shared, or None to start one
+def decode_experiment(config: dict, exp_name: str, num_workers: int, pool: "Pool" = None,
+                      loop: "EventLoopThread" = None):
+    from stages.s0_xmldigtocsv import MANIFEST_STAGE as XMLDIGTOCSV_STAGE, xmldigtocsv_all
+    from stages.s2_decode import MANIFEST_STAGE as DECODE_STAGE, decode_all, decode_pipelined, get_decoded_check
+    from stages.s3_analyze import MANIFEST_STAGE as ANALYZE_STAGE, analyze_all
+    from util.dram_command import E_DRAM_TYPE
+    from util.metrics import RunMetrics
+
+    metrics = RunMetrics(exp_name, num_workers, E_PROFILER(config["profile"]))
+
+    # Experiment name
+    # the experiment name is simply a dot if we use the decode_one.sh script where we only want to decode
+    # a single experiment rather than a batch of experiments
+    if exp_name == ".":
+        exp_name = ""
+        exp_name_desc = os.path.dirname(os.getenv('XMLDIG_DIR')).replace("/mnt/scope-data/", "")
+        printf(f"decoding experiment: {exp_name_desc}")
+    else:
+        printf(f"decoding experiment: {exp_name}")
+
+    xmldig_reader = E_XMLDIG_READER(config["xmldig_reader"])
+    codec = E_CODEC(config["codec"])
+    retention = E_RETENTION(config["retention"])
+    dram_type = E_DRAM_TYPE.ddr4 if config["ddr4"] else E_DRAM_TYPE.ddr5
+    if config["pipelined"] and xmldig_reader == E_XMLDIG_READER.xmldig2csv:
+        # First and third, transform XMLdig to CSV and decode the DRAM commands of each file as soon as it is converted.
+        with metrics.profile(PIPELINE_PROFILE):
+            decode_pipelined(dram_type, exp_name, num_workers, E_DECODE_ENGINE(config["engine"]),
+                             config["chunk_size"] * 1024 * 1024, config["binary"], config["queue_size"], codec,
+                             retention, pool, loop, metrics)
+    else:
+        # First, transform XMLdig to CSV (unless the decoder reads the XMLdig files itself).
+        # The files whose trimmed CSVs have been decoded and removed before are not converted again.
+        if xmldig_reader == E_XMLDIG_READER.xmldig2csv:
+            with metrics.profile(XMLDIGTOCSV_STAGE):
+                xmldigtocsv_all(exp_name, num_workers, codec,
+                                get_decoded_check(exp_name, dram_type, config["binary"], codec), loop, metrics)
+
+        # Second, do nothing. This stage has been merged into the xmldig2csv tool.
+
+        # Third, decode the DRAM commands.
+        with metrics.profile(DECODE_STAGE):
+            decode_all(dram_type, exp_name, num_workers, E_DECODE_ENGINE(config["engine"]),
+                       config["chunk_size"] * 1024 * 1024, config["binary"], xmldig_reader, config["keep_trimmed_csv"],
+                       codec, retention, pool, metrics)
+
+    # Fourth, run an analysis (not for DDR4 mode)
+    if not config["ddr4"]:
+        with metrics.profile(ANALYZE_STAGE):
+            analyze_all(exp_name, num_workers, pool, metrics)
+    metrics.write()
+
+
+# Converts, decodes and analyzes several experiments on a single pool of workers. With the xmldig2csv reader, the files
+# of all experiments are scheduled on the workers together (see decode_batch); otherwise, the experiments are decoded
+# one after another. The metrics of all experiments are written as those of a single run.
+# @param exp_names the experiment names, see decode_experiment
+def decode_experiments(config: dict, exp_names: list[str], num_workers: int):
+    from multiprocessing import Pool
+    from stages.s2_decode import MANIFEST_STAGE as DECODE_STAGE, decode_all, decode_batch
+    from stages.s3_analyze import MANIFEST_STAGE as ANALYZE_STAGE, analyze_all
+    from util.dram_command import E_DRAM_TYPE
+    from util.metrics import RunMetrics
+
+    xmldig_reader = E_XMLDIG_READER(config["xmldig_reader"])
+    codec = E_CODEC(config["codec"])
+    retention = E_RETENTION(config["retention"])
+    dram_type = E_DRAM_TYPE.ddr4 if config["ddr4"] else E_DRAM_TYPE.ddr5
+    printf(f"decoding {len(exp_names)} experiments")
+    metrics = RunMetrics("batch", num_workers, E_PROFILER(config["profile"]))
+    with Pool(num_workers) as p:
+        if xmldig_reader == E_XMLDIG_READER.xmldig2csv:
+            with metrics.profile(PIPELINE_PROFILE):
+                decode_batch(dram_type, exp_names, num_workers, E_DECODE_ENGINE(config["engine"]),
+                             config["chunk_size"] * 1024 * 1024, config["binary"], config["queue_size"], codec,
+                             retention, p, metrics=metrics)
+        else:
+            for exp_name in exp_names:
+                printf(f"decoding experiment: {exp_name}")
+                with metrics.profile(DECODE_STAGE):
+                    decode_all(dram_type, exp_name, num_workers, E_DECODE_ENGINE(config["engine"]),
+                               config["chunk_size"] * 1024 * 1024, config["binary"], xmldig_reader,
+                               config["keep_trimmed_csv"], codec, retention, p, metrics)
+
+        # run an analysis (not for DDR4 mode)
+        if not config["ddr4"]:
+            for exp_name in exp_names:
+                with metrics.profile(ANALYZE_STAGE):
+                    analyze_all(exp_name, num_workers, p, metrics)
+    metrics.write()
+
+
+# Returns the names of the experiments in XMLDIG_DIR, i.e., its subdirectories other than DATA_DIR, that match any of
+# the given glob patterns (e.g., "it=*"), or all of them.
+def get_xmldig_experiment_names(patterns: list[str] = None) -> list[str]:
+    data_dir = Path(os.getenv('DATA_DIR')).resolve()
+    return sorted(entry.name for entry in os.scandir(os.getenv('XMLDIG_DIR'))
+                  if entry.is_dir() and not entry.name.startswith(".") and Path(entry.path).resolve() != data_dir
+                  and (patterns is None or any(fnmatch.fnmatchcase(entry.name, pattern) for pattern in patterns)))
+
+
+# Returns whether an experiment name given by -e is a glob pattern, see resolve_experiment_names.
+def is_experiment_pattern(exp_name: str) -> bool:
+    return any(c in exp_name for c in "*?[")
+
+
+# Returns the experiment names given by -e, with the glob patterns expanded to the matching experiments in XMLDIG_DIR
+# (see get_xmldig_experiment_names), without duplicates.
+def resolve_experiment_names(exp_names: list[str]) -> list[str]:
+    resolved = list()
+    for exp_name in exp_names:
+        if not is_experiment_pattern(exp_name):
+            resolved.append(exp_name)
+            continue
+        matches = get_xmldig_experiment_names([exp_name])
+        if not matches:
+            raise Exception(f"[-] no experiment in {os.getenv('XMLDIG_DIR')} matches {exp_name}")
+        resolved += matches
+    return list(dict.fromkeys(resolved))
+
+
+# The serve subcommand: runs a decode server (see util.server) whose jobs decode the experiments of XMLDIG_DIR on a
+# shared pool of workers, see the client subcommand.
+def serve(args: list[str]):
+    from util.server import DecodeServer, get_socket_path
+
+    parser = argparse.ArgumentParser(
+        prog="decode.py serve",
+        description="Runs a decode server that decodes the experiments in XMLDIG_DIR submitted by "
+                    "\"decode.py client submit\" on a pool of workers that is kept running in between.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--socket",
+                        type=str,
+                        default=get_socket_path(),
+                        help="the path of the Unix domain socket to listen on (see DECODE_SOCKET)")
+    parser.add_argument("--max-jobs",
+                        type=int,
+                        default=None,
+                        help="the maximum number of experiments decoded at once (default: the number of workers)")
+    config = vars(parser.parse_args(args))
+
+    from stages.s0_xmldigtocsv import get_num_jobs as xmldigtocsv__get_num_jobs
+    from util.dram_command import E_DRAM_TYPE, get_command_table
+    from util.pipeline import EventLoopThread, SignalSafePool, sigterm_interrupts
+
+    checkenv('XMLDIG_DIR')
+    # the experiments of a server share DATA_DIR, like with decode_parallel.sh
+    set_default_data_dir("")
+    num_workers = get_num_workers()
+
+    job_parser = _JobArgumentParser(prog="decode.py client submit", add_help=False)
+    add_decode_arguments(job_parser)
+
+    # Returns the jobs of a submit request, see util.server.DecodeServer.
+    def create_jobs(request: dict):
+        job_config = vars(job_parser.parse_args(request.get('args', [])))
+        exp_names = resolve_experiment_names(request.get('expnames') or list())
+        if request.get('all', False):
+            exp_names += get_xmldig_experiment_names()
+        if not exp_names:
+            raise ValueError("no experiment given")
+        for exp_name in exp_names:
+            if exp_name != "." and (os.sep in exp_name or exp_name in ("", "..")
+                                    or not os.path.isdir(os.path.join(os.getenv('XMLDIG_DIR'), exp_name))):
+                raise ValueError(f"no such experiment in {os.getenv('XMLDIG_DIR')}: {exp_name}")
+        return [(exp_name, lambda exp_name=exp_name: decode_experiment(job_config, exp_name, num_workers, p, loop))
+                for exp_name in dict.fromkeys(exp_names)]
+
+    # the command tables are loaded before the workers are forked, and the event loop is started after that
+    for dram_type in E_DRAM_TYPE:
+        get_command_table(dram_type)
+    # a daemon is usually stopped by SIGTERM (e.g., by systemd), which is handled like Ctrl+C; the workers ignore both and
+    # are stopped when the pool is left, see util.pipeline.SignalSafePool
+    with sigterm_interrupts(), SignalSafePool(num_workers) as p, \
+            EventLoopThread(xmldigtocsv__get_num_jobs(num_workers)) as loop:
+        DecodeServer(config['socket'], create_jobs, config['max_jobs'] or num_workers).serve()
+
+
+# The client subcommand: submits experiments to a decode server (see serve) or queries or stops it.
+def client(args: list[str]):
+    from util.server import get_socket_path, request_server
+
+    parser = argparse.ArgumentParser(
+        prog="decode.py client",
+        description="Submits experiments to the decode server, or queries or stops it.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--socket",
+                        type=str,
+                        default=get_socket_path(),
+                        help="the path of the Unix domain socket of the server (see DECODE_SOCKET)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    submit_parser = subparsers.add_parser(
+        "submit",
+        description="Decodes experiments in the XMLDIG_DIR of the server. Any further arguments are those of "
+                    "decode.py (e.g., --ddr4), and apply to each experiment.")
+    submit_parser.add_argument("-e", "--expname",
+                               type=str,
+                               action="append",
+                               default=list(),
+                               help="the experiment name (or a dot for the experiment in XMLDIG_DIR itself), or a "
+                                    "glob pattern of experiment names (e.g., 'it=*'); can be given several times")
+    submit_parser.add_argument("--all",
+                               action="store_true",
+                               help="decode all experiments in XMLDIG_DIR of the server, each as a job of its own")
+    submit_parser.add_argument("--no-wait",
+                               action="store_true",
+                               help="return as soon as the experiments are queued rather than once they are decoded")
+    subparsers.add_parser("status", description="Prints the jobs of the server that are queued or running.")
+    subparsers.add_parser("shutdown", description="Waits for the jobs of the server and stops it.")
+    config, decode_args = parser.parse_known_args(args)
+    config = vars(config)
+    if config['command'] != "submit" and decode_args:
+        parser.error(f"unrecognized arguments: {' '.join(decode_args)}")
+
+    if config['command'] == "submit":
+        request = {'command': "submit", 'expnames': config['expname'], 'all': config['all'], 'args': decode_args,
+                   'wait': not config['no_wait']}
+    else:
+        request = {'command': config['command']}
+
+    failed = False
+    for reply in request_server(config['socket'], request):
+        if 'error' in reply and 'job' not in reply:
+            printf(f"error: {reply['error']}")
+            sys.exit(2)
+        if config['command'] == "submit":
+            printf(f"job {reply['job']} ({reply['name']}): {reply['status']}"
+                   + (f" in {reply['seconds']:.3f} seconds" if reply['status'] in ("done", "failed") else "")
+                   + (f": {reply['error']}" if 'error' in reply else ""))
+            failed |= reply['status'] == "failed"
+        elif config['command'] == "status":
+            for job in reply['jobs']:
+                printf(f"job {job['job']} ({job['name']}): {job['status']}"
+                       + (f" for {job['seconds']:.3f} seconds" if 'seconds' in job else ""))
+            printf(f"{len(reply['jobs'])} job(s) queued or running, {reply['done']} done, {reply['failed']} failed"
+                   + (", shutting down" if reply['shutting_down'] else ""))
+        else:
+            printf(f"decode server {reply['status']}")
+    if failed:
+        sys.exit(1)
+
+
+# The main function.
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "gc":
+        gc(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "client":
+        client(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(
+        description="Data acquisition and analysis script for TELEDYNE SDA series scope.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("-e", '--expname',
+                        type=str,
+                        nargs="+",
+                        action="extend",
+                        help="the experiment name, i.e., folder name in the XMLDIG_DIR directory; e.g.: 20220919_155000_decoder_test_newScope"
+                             "; several names or glob patterns of names (e.g., 'it=*') decode all these experiments on "
+                             "the same workers")
+    add_decode_arguments(parser)
+    parser.add_argument("--watch",
+                        action="store_true",
+                        help="rather than decoding a single experiment, watch XMLDIG_DIR and convert and decode each "
+                             "XMLdig file as soon as it has been saved, until interrupted")
+    parser.add_argument("--poll",
+                        action="store_true",
+                        help="with --watch, poll XMLDIG_DIR for new files even if inotify is available (inotify is "
+                             "never used on network file systems)")
+    parser.add_argument("--settle-time",
+                        type=float,
+                        default=SETTLE_TIME,
+                        help="with --watch, the time (in seconds) without new files after which an experiment is "
+                             "complete and analyzed")
 
     # TODO: Maybe support, and check which ones are not used anymore
     # parser.add_argument("-csv", "--write-csv",
@@ -52,34 +493,27 @@ def main():
 
     # parse arguments and create dict of argparse's Namespace object
     config = vars(parser.parse_args())
+    if config['watch'] and config['expname'] is not None:
+        parser.error("--watch decodes all experiments in XMLDIG_DIR, so -e/--expname cannot be given")
+    if not config['watch'] and config['expname'] is None:
+        parser.error("the following arguments are required: -e/--expname")
+    if config['watch'] and config['xmldig_reader'] != E_XMLDIG_READER.xmldig2csv.value:
+        parser.error("--watch only supports --xmldig-reader xmldig2csv")
 
     ###############################
     # Set up variables for storage and parallelism
     ###############################
 
-    if 'DATA_DIR' not in os.environ:
-        if 'XMLDIG_DIR' in os.environ:
-            data_dir = os.path.join(os.getenv('XMLDIG_DIR'), config['expname'], 'data')
-            os.environ['DATA_DIR'] = data_dir
-            printf(f"env variable DATA_DIR not found, using DATA_DIR={data_dir}")
-        else:
-            raise Exception('[-] The DATA_DIR env variable or/and XMLDIG_DIR env variable must be defined.')
-
-    # Determine the wished number of workers. If none is specified, then one per logical core.
-    num_workers = int(os.getenv("NUM_WORKERS")) if "NUM_WORKERS" in os.environ else multiprocessing.cpu_count()
-    printf(f"using {num_workers} workers")
-    
-    # Experiment name
-    # the experiment name is simply a dot if we use the decode_one.sh script where we only want to decode
-    # a single experiment rather than a batch of experiments
-    exp_name = config['expname']
-    if config['expname'] == ".":
-        exp_name = ""
-        exp_name_desc = os.path.dirname(os.getenv('XMLDIG_DIR')).replace("/mnt/scope-data/", "")
-        printf(f"decoding experiment: {exp_name_desc}")
-    else:
-        printf(f"decoding experiment: {exp_name}")
-
+    # several experiments share DATA_DIR, like with --watch
+    exp_names = config['expname'] or list()
+    is_batch = len(exp_names) > 1 or any(is_experiment_pattern(exp_name) for exp_name in exp_names)
+    set_default_data_dir("" if is_batch else exp_names[0] if exp_names else "")
+    if is_batch:
+        checkenv('XMLDIG_DIR')
+        exp_names = resolve_experiment_names(exp_names)
+        if "." in exp_names:
+            parser.error("the experiment in XMLDIG_DIR itself (a dot) cannot be decoded with other experiments")
+    num_workers = get_num_workers()
 
     ###############################
     # Run the pipeline
@@ -97,18 +531,31 @@ def main():
     #                       config.get('write_csv', False),
     #                       config.get('write_pickle', False))
 
-    # First, transform XMLdig to CSV.
-    xmldigtocsv_all(exp_name, num_workers)
+    if config["watch"]:
+        from stages.s2_decode import decode_watched
+        from stages.s3_analyze import analyze_all
+        from util.dram_command import E_DRAM_TYPE
+        from util.metrics import RunMetrics
 
-    # Second, do nothing. This stage has been merged into the xmldig2csv tool.
+        # Analyzes an experiment once it is complete on the workers of the watch, and records the analysis in the metrics
+        # of the experiment.
+        def analyze(iter_name: str, metrics: RunMetrics, pool: "Pool"):
+            analyze_all(iter_name, num_workers, pool, metrics)
 
-    # Third, decode the DRAM commands.
-    dram_type = E_DRAM_TYPE.ddr4 if config["ddr4"] else E_DRAM_TYPE.ddr5
-    decode_all(dram_type, exp_name, num_workers)
+        printf(f"watching experiments in: {os.getenv('XMLDIG_DIR')}")
+        # Transform XMLdig to CSV and decode the DRAM commands of each file as soon as it appears, and run an analysis
+        # (not for DDR4 mode) of each experiment once no further files appear.
+        decode_watched(E_DRAM_TYPE.ddr4 if config["ddr4"] else E_DRAM_TYPE.ddr5, num_workers,
+                       E_DECODE_ENGINE(config["engine"]), config["chunk_size"] * 1024 * 1024, config["binary"],
+                       config["queue_size"], E_CODEC(config["codec"]), E_RETENTION(config["retention"]),
+                       config["poll"], config["settle_time"],
+                       None if config["ddr4"] else analyze, E_PROFILER(config["profile"]))
+        return
 
-    # Fourth, run an analysis (not for DDR4 mode)
-    if not config["ddr4"]:
-        analyze_all(exp_name, num_workers)
+    if is_batch:
+        decode_experiments(config, exp_names, num_workers)
+    else:
+        decode_experiment(config, exp_names[0], num_workers)
 
 
 if __name__ == "__main__":
@@ -1,53 +1,258 @@
-from multiprocessing import Pool
 from pathlib import PurePath, Path
+from typing import Callable
+import asyncio
+import contextlib
+import functools
+import threading
 import time
+from util.codec import CODEC_SUFFIXES, E_CODEC, open_file, remove_other_codecs, strip_codec_suffix
+from util.manifest import Manifest, STATUS_DONE, STATUS_FAILED, atomic_output, describe_input, get_manifest_path
+from util.metrics import MeasuredCoroutine, RunMetrics, TaskTiming
+from util.pipeline import THROTTLE_CHECK_INTERVAL, EventLoopThread, PipelineStage, run_pipeline, use_shared
+from util.profiling import span, to_thread
 from util.py_helper import checkenv, printf
+from util.retention import get_disk_budget
 import glob
-import itertools
 import os
 import shutil
+import stat
 import subprocess
 
 
+# The version of the trimmed CSV output; bump it whenever the output changes for the same input (see Manifest).
+OUTPUT_VERSION = 1
+
+# The name of this stage in the manifest of an experiment.
+MANIFEST_STAGE = "xmldig2csv"
+
+# The file extension of the files written by the scope.
+XMLDIG_SUFFIX = ".XMLdig"
+
+# The output of xmldig2csv is compressed in blocks of this many bytes.
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# The delay (in seconds) before the first retry of a failed conversion; it doubles with each further retry.
+RETRY_BACKOFF = 1.0
+
+
+# Returns the output path of this stage for a given XMLdig file.
+# @param codec the codec the output is compressed with, which determines its extension (see util.codec)
+def get_output_path(experimentname: str, xmldig_path: str, codec: E_CODEC = E_CODEC.none) -> str:
+    return os.path.join(os.getenv('DATA_DIR'), 'trimmedcsv', experimentname,
+                        '.'.join(os.path.basename(xmldig_path).split('.')[:-1]) + '.csv' + CODEC_SUFFIXES[codec])
+
+
 # Returns the output directory of this stage for a given iteration name.
 # This is required by the subsequent stage.
 def get_output_directory(iter_name: str):
     return Path(os.getenv("DATA_DIR")) / "trimmedcsv" / iter_name
 
 
-# Run xmldig2csv for a single file.
+# Returns the path of the log that the output of xmldig2csv is written to for a given XMLdig file.
+def get_log_path(experimentname: str, xmldig_path: str) -> Path:
+    return Path(os.getenv('DATA_DIR')) / 'logs' / 'xmldig2csv' / experimentname / \
+        (os.path.basename(xmldig_path).replace('.XMLdig', '') + '.log')
+
+
+# Returns the number of conversions run at once, set by the XMLDIG2CSV_JOBS env variable (default: num_workers).
+def get_num_jobs(num_workers: int) -> int:
+    return int(os.getenv('XMLDIG2CSV_JOBS')) if 'XMLDIG2CSV_JOBS' in os.environ else num_workers
+
+
+# Returns the time in seconds after which a conversion is killed and the number of times a failed conversion is
+# retried, set by the XMLDIG2CSV_TIMEOUT (default: none) and XMLDIG2CSV_RETRIES (default: 2) env variables.
+def get_timeout_and_retries() -> tuple[float, int]:
+    timeout = float(os.getenv('XMLDIG2CSV_TIMEOUT')) if 'XMLDIG2CSV_TIMEOUT' in os.environ else None
+    retries = int(os.getenv('XMLDIG2CSV_RETRIES', '2'))
+    return timeout, retries
+
+
+# Runs xmldig2csv once. Returns why it failed, or None if it succeeded.
+# @param log the file that the output of xmldig2csv is written to
+async def __run_xmldig2csv(xmldig_path: str, csv_path: str, log, timeout: float = None) -> str:
+    # the partial output of a previous attempt
+    Path(csv_path).unlink(missing_ok=True)
+    proc = await asyncio.create_subprocess_exec(os.getenv('XMLDIG2CSV_PATH'), xmldig_path, stdin=subprocess.DEVNULL,
+                                                stdout=log, stderr=subprocess.STDOUT)
+    try:
+        returncode = await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        error = f"timed out after {timeout:g} seconds"
+    except BaseException:
+        # cancelled, e.g., as another stage failed
+        proc.kill()
+        await proc.wait()
+        Path(csv_path).unlink(missing_ok=True)
+        raise
+    else:
+        if returncode != 0:
+            error = f"exited with code {returncode}"
+        elif not os.path.exists(csv_path):
+            error = "did not write the CSV"
+        else:
+            return None
+    Path(csv_path).unlink(missing_ok=True)
+    return error
+
+
+# Moves the CSV written by xmldig2csv to the output path, compressing it with a codec. The move to the output directory
+# may copy the file (if it is on another file system), so it is only renamed to the output path once it is complete.
+def __move_output(csv_path: str, outpath: str, codec: E_CODEC):
+    with atomic_output(Path(outpath)) as tmp_path:
+        if codec == E_CODEC.none:
+            shutil.move(csv_path, tmp_path)
+        else:
+            with open(csv_path, "rb") as src, open_file(tmp_path, "wb", codec) as dst:
+                shutil.copyfileobj(src, dst, COPY_BLOCK_SIZE)
+            os.unlink(csv_path)
+    # the output of a previous run with another codec would be decoded as well
+    remove_other_codecs(Path(outpath))
+
+
+# Run xmldig2csv for a single file, on an event loop (see util.pipeline.EventLoopThread). The output of xmldig2csv is
+# written to a log (see get_log_path); a conversion that fails or times out is retried with an exponential backoff.
 # @param exp_name the name of the experiment, typically a timestamp followed by a random string.
-def __xmldigtocsv_single(experimentname: str, xmldig_path: str) -> None:
+# @param codec the codec the output is compressed with
+# @param timeout the time in seconds after which xmldig2csv is killed, or None for no limit
+# @param retries the number of times a failed conversion is retried
+# Returns the XMLdig path, its description for the manifest (taken before converting it), the status, and why the
+# conversion failed (or None).
+async def __xmldigtocsv_single(experimentname: str, xmldig_path: str, codec: E_CODEC = E_CODEC.none,
+                               timeout: float = None, retries: int = 0) -> tuple[str, dict, str, str]:
     checkenv('DATA_DIR')
     checkenv('XMLDIG2CSV_PATH')
 
-    # Compute the output path and create the parent dir if necessary
-    basename = os.path.basename(xmldig_path)
-    outpath = os.path.join(os.getenv('DATA_DIR'), 'trimmedcsv', experimentname,
-                           '.'.join(os.path.basename(xmldig_path).split('.')[:-1]) + '.csv')
-    Path(os.path.dirname(outpath)).mkdir(parents=True, exist_ok=True)
-
-    # Check existence of the output path
-    if os.path.exists(outpath):
-        printf(f"skipping file {basename} as it has already been converted before")
-        return
+    # Compute the output path
+    outpath = get_output_path(experimentname, xmldig_path, codec)
+    # hashing the input (and compressing the output below) takes a while, during which other conversions may finish
+    with span("hash input", MANIFEST_STAGE, file=os.path.basename(xmldig_path)):
+        in_info = await to_thread(describe_input, Path(xmldig_path))
 
     # Do the conversion
     # printf(f"transforming file {basename} into {basename.replace('.XMLdig', '.csv')}")
-    subprocess.run([os.getenv('XMLDIG2CSV_PATH'), xmldig_path], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                   stderr=subprocess.PIPE)
+    csv_path = xmldig_path.replace(".XMLdig", ".csv")
+    log_path = get_log_path(experimentname, xmldig_path)
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "wb") as log:
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+            with span("xmldig2csv", MANIFEST_STAGE, file=os.path.basename(xmldig_path), attempt=attempt + 1):
+                error = await __run_xmldig2csv(xmldig_path, csv_path, log, timeout)
+            if error is None:
+                break
+            log.write(f"[-] attempt {attempt + 1} of {retries + 1}: xmldig2csv {error}\n".encode())
+            log.flush()
+    if error is not None:
+        return xmldig_path, in_info, STATUS_FAILED, f"{error} (after {retries + 1} attempt(s), see {log_path})"
 
-    # Move the fresh CSV files to the correct place
-    shutil.move(xmldig_path.replace(".XMLdig", ".csv"), outpath)
+    with span("move output", MANIFEST_STAGE, file=os.path.basename(xmldig_path)):
+        await to_thread(__move_output, csv_path, outpath, codec)
+    return xmldig_path, in_info, STATUS_DONE, None
 
 
-# Requires the XMLDIG_DIR and DATA_DIR env variables
-# @param exp_name the name of the experiment, typically a timestamp followed by a random string.
-def xmldigtocsv_all(experimentname: str, numworkers: int) -> None:
-    t_start = time.time()
+# Kills xmldig2csv once it ran for timeout seconds (if not None), and closes the write end of its FIFO that is held
+# open for it (see xmldigtocsv_pipe) once it exited, so that the reader then reaches the end of the FIFO.
+# @param timed_out set if xmldig2csv has been killed as it timed out
+def __close_fifo_on_exit(proc: subprocess.Popen, write_fd: int, timeout: float, timed_out: threading.Event):
+    try:
+        proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        timed_out.set()
+        proc.kill()
+        proc.wait()
+    os.close(write_fd)
+
+
+# Run xmldig2csv for a single file with its output written to a FIFO rather than a file, so that the subsequent stage
+# can decode the rows as they are converted instead of waiting for the complete CSV to be written, moved and read back.
+# The output of xmldig2csv is written to a log (see get_log_path), and it is killed after the XMLDIG2CSV_TIMEOUT (see
+# get_timeout_and_retries), which includes the time the reader takes; it is not retried, as its output has been read.
+# Yields the read end of the FIFO; raises an exception if xmldig2csv fails, or if the FIFO cannot be created next to
+# the XMLdig file (e.g., as a file of that name exists, or as the file system does not support FIFOs).
+# Requires the DATA_DIR and XMLDIG2CSV_PATH env variables.
+@contextlib.contextmanager
+def xmldigtocsv_pipe(experimentname: str, xmldig_path: str):
+    checkenv('DATA_DIR')
+    checkenv('XMLDIG2CSV_PATH')
+    timeout, _ = get_timeout_and_retries()
+
+    # xmldig2csv writes its output next to the input, so that is where the FIFO goes; only a FIFO left behind by a
+    # previous run is replaced, never a file (e.g., a CSV that xmldig2csv wrote before)
+    fifo_path = xmldig_path.replace(".XMLdig", ".csv")
+    with contextlib.suppress(FileNotFoundError):
+        if stat.S_ISFIFO(os.lstat(fifo_path).st_mode):
+            os.unlink(fifo_path)
+    try:
+        os.mkfifo(fifo_path)
+    except OSError as e:
+        raise Exception(f"[-] cannot create a FIFO for xmldig2csv at {fifo_path} ({e.strerror}); "
+                        f"convert the file with --xmldig-reader xmldig2csv instead") from e
+    log_path = get_log_path(experimentname, xmldig_path)
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        # the read end is opened before xmldig2csv is started (which does not block without a writer), and a write end
+        # is held open until xmldig2csv exited, so that the reader neither blocks forever if xmldig2csv never opens the
+        # FIFO (e.g., as it fails early) nor reaches the end of the FIFO before xmldig2csv opened it
+        with open(os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK), "rb") as f, open(log_path, "wb") as log:
+            os.set_blocking(f.fileno(), True)
+            write_fd = os.open(fifo_path, os.O_WRONLY)
+            try:
+                proc = subprocess.Popen([os.getenv('XMLDIG2CSV_PATH'), xmldig_path], stdin=subprocess.DEVNULL,
+                                        stdout=log, stderr=subprocess.STDOUT)
+            except BaseException:
+                os.close(write_fd)
+                raise
+            timed_out = threading.Event()
+            watchdog = threading.Thread(target=__close_fifo_on_exit, args=(proc, write_fd, timeout, timed_out),
+                                        daemon=True)
+            watchdog.start()
+            try:
+                yield f
+            except BaseException:
+                # xmldig2csv would block forever on the full FIFO
+                proc.kill()
+                raise
+            finally:
+                watchdog.join()
+            if proc.returncode != 0:
+                error = f"timed out after {timeout:g} seconds" if timed_out.is_set() \
+                    else f"exited with code {proc.returncode}"
+                log.write(f"[-] xmldig2csv {error}\n".encode())
+                raise Exception(f"[-] xmldig2csv {error} for file {os.path.basename(xmldig_path)} (see {log_path})")
+    finally:
+        os.unlink(fifo_path)
+
+
+# Removes a trimmed CSV once the subsequent stage has processed it, and records in the manifest that it has been
+# removed on purpose (see util.retention).
+def remove_output(manifest: Manifest, csv_path: Path):
+    xmldig_name = strip_codec_suffix(Path(csv_path).name)[:-len('.csv')] + '.XMLdig'
+    Path(csv_path).unlink(missing_ok=True)
+    manifest.prune(MANIFEST_STAGE, Path(xmldig_name))
+
+
+# Returns whether an XMLdig file has been converted before and need not be converted again, see
+# get_pending_xmldig_paths.
+def is_converted(experimentname: str, manifest: Manifest, xmldig_path: str, codec: E_CODEC = E_CODEC.none,
+                 is_consumed: Callable[[Manifest, Path], bool] = None) -> bool:
+    out_path = Path(get_output_path(experimentname, xmldig_path, codec))
+    return manifest.is_done(MANIFEST_STAGE, Path(xmldig_path), out_path, OUTPUT_VERSION,
+                            allow_pruned=is_consumed is not None and is_consumed(manifest, out_path))
+
+
+# Returns all XMLdig files of an experiment and those of them that have to be converted, i.e., whose input changed or
+# whose output is missing or incomplete (e.g., after a crash).
+# @param is_consumed returns whether the subsequent stage has processed a trimmed CSV that has been removed (see
+#   remove_output), so it need not be converted again; by default, removed trimmed CSVs are converted again
+# Requires the XMLDIG_DIR and DATA_DIR env variables.
+def get_pending_xmldig_paths(experimentname: str, manifest: Manifest, codec: E_CODEC = E_CODEC.none,
+                             is_consumed: Callable[[Manifest, Path], bool] = None) -> tuple[list[str], list[str]]:
     checkenv('DATA_DIR')
     checkenv('XMLDIG_DIR')
-    
+
     xmldigdirpath = os.path.join(os.getenv('XMLDIG_DIR'), experimentname)  # TODO Verify that the path is correct
     # Check that the input file exists.
     if not os.path.isdir(xmldigdirpath):
@@ -56,9 +261,106 @@ def xmldigtocsv_all(experimentname: str, numworkers: int) -> None:
     # Find the paths to all the single xmldigs
     all_xmldig_paths = glob.glob(str(PurePath(xmldigdirpath, "*.XMLdig")))
 
-    # Run in parallel
-    with Pool(numworkers) as p:
-        p.starmap(__xmldigtocsv_single, zip(itertools.repeat(experimentname), all_xmldig_paths))
-    
+    pending_xmldig_paths = list()
+    for xmldig_path in all_xmldig_paths:
+        if is_converted(experimentname, manifest, xmldig_path, codec, is_consumed):
+            printf(f"skipping file {os.path.basename(xmldig_path)} as it has already been converted before")
+            continue
+        pending_xmldig_paths.append(xmldig_path)
+    return all_xmldig_paths, pending_xmldig_paths
+
+
+# Records a converted file in the manifest. Returns the path of the trimmed CSV, or None if the conversion failed.
+# @param failures collects why the conversion failed for each XMLdig file
+def __record_xmldigtocsv(experimentname: str, manifest: Manifest, codec: E_CODEC, failures: dict[str, str],
+                         xmldig_path: str, in_info: dict, status: str, error: str) -> Path:
+    if status != STATUS_DONE:
+        printf(f"xmldig2csv failed for file {os.path.basename(xmldig_path)}: {error}")
+        failures[os.path.basename(xmldig_path)] = error
+    out_path = Path(get_output_path(experimentname, xmldig_path, codec))
+    manifest.record(MANIFEST_STAGE, Path(xmldig_path), in_info, out_path, OUTPUT_VERSION, status=status)
+    return out_path if status == STATUS_DONE else None
+
+
+# Prints the XMLdig files whose conversion failed (see get_pipeline_stage) for the summary of a run.
+def print_failures(failures: dict[str, str]):
+    if failures:
+        printf(f"xmldig2csv failed for {len(failures)} file(s):")
+        for name, error in sorted(failures.items()):
+            printf(f"  {name}: {error}")
+
+
+# Returns the stage of a pipeline (see util.pipeline) that converts the given XMLdig files on an event loop, i.e.,
+# without a worker of the pool for each running xmldig2csv (see get_num_jobs for how many should run at once). Each
+# converted file is recorded in the manifest and passed on to the next stage.
+# The stage is throttled while the disk budget of the data directory is exceeded (see util.retention).
+# @param get_next_item returns the item of the next stage for the path of a trimmed CSV, or None to skip the file
+# @param failures collects why the conversion failed for each XMLdig file, see print_failures
+# @param metrics records each converted file (see util.metrics), or None to not record them; the XMLdig files queued
+#   for the stage later on are to be recorded as queued there as well
+def get_pipeline_stage(experimentname: str, manifest: Manifest, xmldig_paths: list[str],
+                       get_next_item: Callable[[Path], tuple], loop: EventLoopThread, failures: dict[str, str],
+                       codec: E_CODEC = E_CODEC.none, metrics: RunMetrics = None) -> PipelineStage:
+    if metrics is None:
+        metrics = RunMetrics(experimentname, loop.max_running)
+    stage_metrics = metrics.get_stage(MANIFEST_STAGE, loop.max_running)
+    # the size of the data directory is measured again at most as often as a throttled stage is checked, rather than
+    # each time a file is to be converted; the trimmed CSVs converted in between are added to it
+    budget = get_disk_budget(THROTTLE_CHECK_INTERVAL)
+
+    def done(result: tuple[tuple[str, dict, str, str], TaskTiming]):
+        result, timing = result
+        xmldig_path, in_info, _, error = result
+        with span("record", MANIFEST_STAGE, file=os.path.basename(xmldig_path)):
+            out_path = __record_xmldigtocsv(experimentname, manifest, codec, failures, *result)
+        out_size = out_path.stat().st_size if out_path is not None else 0
+        stage_metrics.record(experimentname, os.path.basename(xmldig_path), timing, in_info['size'], out_size,
+                             error=error)
+        if budget is not None:
+            budget.add(out_size)
+        return get_next_item(out_path) if out_path is not None else None
+
+    # the options are passed by keyword, as the items (i.e., the XMLdig paths) are appended to the positional arguments
+    timeout, retries = get_timeout_and_retries()
+    stage = PipelineStage(MANIFEST_STAGE,
+                          MeasuredCoroutine(functools.partial(__xmldigtocsv_single, experimentname, codec=codec,
+                                                              timeout=timeout, retries=retries),
+                                            metrics.profiler),
+                          done, throttle=budget.check if budget is not None else None, loop=loop)
+    for xmldig_path in xmldig_paths:
+        stage_metrics.queued(experimentname, os.path.basename(xmldig_path))
+        stage.put((xmldig_path,))
+    return stage
+
+
+# Requires the XMLDIG_DIR and DATA_DIR env variables
+# @param exp_name the name of the experiment, typically a timestamp followed by a random string.
+# @param numworkers the default number of conversions run at once, see get_num_jobs
+# @param codec the codec the trimmed CSVs are compressed with (see util.codec)
+# @param is_consumed see get_pending_xmldig_paths
+# @param loop an event loop for the xmldig2csv processes that is shared (e.g., by the jobs of util.server), or None to
+#   start one
+# @param metrics records the converted and skipped files (see util.metrics), or None to not record them
+def xmldigtocsv_all(experimentname: str, numworkers: int, codec: E_CODEC = E_CODEC.none,
+                    is_consumed: Callable[[Manifest, Path], bool] = None, loop: EventLoopThread = None,
+                    metrics: RunMetrics = None) -> None:
+    t_start = time.time()
+    if metrics is None:
+        metrics = RunMetrics(experimentname, numworkers)
+
+    # Only convert files whose input changed or whose output is missing or incomplete (e.g., after a crash)
+    manifest = Manifest(get_manifest_path(experimentname))
+    all_xmldig_paths, pending_xmldig_paths = get_pending_xmldig_paths(experimentname, manifest, codec, is_consumed)
+
+    # Run concurrently, as a pipeline of a single stage so that the conversion is throttled by the disk budget; each
+    # file is recorded as soon as it is done, so that a crash does not lose the work of the others
+    failures = dict()
+    with manifest, use_shared(loop, lambda: EventLoopThread(get_num_jobs(numworkers))) as loop:
+        stage = get_pipeline_stage(experimentname, manifest, pending_xmldig_paths, lambda out_path: None, loop,
+                                   failures, codec, metrics)
+        metrics.get_stage(MANIFEST_STAGE, loop.max_running).skipped(len(all_xmldig_paths) - len(pending_xmldig_paths))
+        run_pipeline([stage], None, numworkers)
+
     t_end = time.time()
     printf(f"xmldig2csv done for all {len(all_xmldig_paths)} file(s) in {t_end - t_start:.3f} seconds.")
+    print_failures(failures)
@@ -1,29 +1,85 @@
+import contextlib
+import functools
 import itertools
 import os
 import re
 import time
 
-from collections import defaultdict
+import numpy as np
+
+from collections import Counter, defaultdict, deque
 from multiprocessing import Pool
 from pathlib import Path
+from typing import Callable, Iterable, Iterator
 
-from stages.s0_xmldigtocsv import get_output_directory as xmldigtocsv__get_output_directory
-from util.decoded_cmd import DecodedCommand
-from util.dram_command import DramCommand, DRAM_COMMANDS, E_DRAM_CMD, E_DRAM_TYPE
-from util.py_helper import print_debug, checkenv, printf
+from stages.s0_xmldigtocsv import MANIFEST_STAGE as XMLDIGTOCSV_MANIFEST_STAGE, XMLDIG_SUFFIX, \
+    get_output_directory as xmldigtocsv__get_output_directory, \
+    get_num_jobs as xmldigtocsv__get_num_jobs, get_pending_xmldig_paths as xmldigtocsv__get_pending_xmldig_paths, \
+    get_pipeline_stage as xmldigtocsv__get_pipeline_stage, is_converted as xmldigtocsv__is_converted, \
+    get_output_path as xmldigtocsv__get_output_path, print_failures as xmldigtocsv__print_failures, \
+    remove_output as xmldigtocsv__remove_output, xmldigtocsv_pipe
+from util.codec import E_CODEC, get_codec, open_file, remove_other_codecs, strip_codec_suffix, \
+    with_codec
+from util.decode_cache import DecodeCache, get_decode_cache
+from util.decoded_cmd import ADDRESS_FIELDS, DecodedCommand, DecodedCommandBatch, parse_bits
+from util.decoded_trace import BINARY_SUFFIX, DecodedTraceWriter
+from util.dram_command import DramCommand, DRAM_COMMANDS, E_DRAM_CMD, E_DRAM_TYPE, get_command_table, \
+    get_commands_fingerprint
+from util.py_helper import DEBUG, checkenv, count, is_enabled, log_counters, log_debug, printf
+from util.manifest import Manifest, atomic_open, atomic_output, describe_input, fsync_path, get_manifest_path
+from util.metrics import Measured, RunMetrics, StageMetrics, TaskTiming
+from util.profiling import profiled_starmap, span
 from util.paths import get_input_and_output_file_paths
+from util.options import CHUNK_SIZE, E_DECODE_ENGINE, E_PROFILER, E_XMLDIG_READER, SETTLE_TIME
+from util.pipeline import EventLoopThread, Pipeline, PipelineStage, SignalSafePool, sigterm_interrupts, use_shared
+from util.retention import E_RETENTION
+from util.trimmed_csv import TrimmedCsv
+from util.watch import get_watcher
 
 # 2N mode gives the system more setup and hold time on the CA bus.
 # This means we need to decode the second half of a two-cycle command 2 clocks after the first half.
 # The 2N mode is enabled by default. See the JEDEC standard for further details.
 USE_2N_MODE = True
 
+# The version of the decoded output; bump it whenever the output changes for the same input, so that the outputs of
+# previous runs are recognized as stale and decoded again.
+OUTPUT_VERSION = 1
+
+# The name of this stage in the manifest of an experiment.
+MANIFEST_STAGE = "decode"
+
+# The number of bytes after a chunk that are initially loaded to find the second cycles of two-cycle commands.
+CHUNK_OVERLAP = 4 * 1024
+
+# The number of bytes read from a stream (see __decode_csv_stream) at once.
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+# The counters of two-cycle commands that could not be paired unambiguously with their second cycle. The counters of a
+# decoded file also include the number of rows decoded ('rows').
+PAIRING_STATS = ['missing_second_cycle', 'unmatched_second_cycle', 'ambiguous_second_cycle']
+
+
+def get_column_index(csv_lines: list[str], signal_name: str) -> int:
+    return csv_lines[0].replace('\n', '').split(",").index(signal_name.strip())
+
 
 def get_value_by_name(csv_lines: list[str], line_no: int, signal_name: str) -> str:
-    col_no = csv_lines[0].replace('\n', '').split(",").index(signal_name.strip())
+    col_no = get_column_index(csv_lines, signal_name)
     res = csv_lines[line_no].split(",")[col_no]
     return res
 
+
+def __parse_int_or_none(value: str):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+# Returns the value of a cell like the regexes of DramCommand.get_regexes see it: only '0' and '1' are valid.
+def __parse_bit_or_none(value: str):
+    return 0 if value == '0' else (1 if value == '1' else None)
+
 def get_output_directory(iter_name: str):
     return Path(os.getenv("DATA_DIR")) / "decoded" / iter_name
 
@@ -35,27 +91,29 @@ def __decode_single_csv_regex(csvlines: list, dram_cmd: DramCommand) -> list[int
                                               dram_cmd.get_commands(True, False),
                                               compiled=True)
     full_matches = list()
-    for line_id in range(1, len(csvlines) - len(compiled_regexlist) + 1):
-        all_regexes_match = True
-        for regex_id, regex in enumerate(compiled_regexlist):
-            if not re.match(regex, csvlines[line_id + regex_id]):
-                all_regexes_match = False
-                break
-        if all_regexes_match:
-            full_matches.append(line_id)
+    with span(f"match {dram_cmd.identifier}", MANIFEST_STAGE, lines=len(csvlines) - 1):
+        for line_id in range(1, len(csvlines) - len(compiled_regexlist) + 1):
+            all_regexes_match = True
+            for regex_id, regex in enumerate(compiled_regexlist):
+                if not re.match(regex, csvlines[line_id + regex_id]):
+                    all_regexes_match = False
+                    break
+            if all_regexes_match:
+                full_matches.append(line_id)
 
     return full_matches
 
 
 # Decode a single CSV.
-# @param iter_name the name of the experiment, typically a timestamp followed by a random string.
-def __decode_single_csv(dram_type: E_DRAM_TYPE, csv_path: Path, pool: Pool):
-    print(f"__decode_single_csv({dram_type}, '{csv_path}', pool)")
-    with csv_path.open("r") as f:
+# @param pool if given, the regexes of the DRAM commands are matched in parallel (one task per command)
+def __decode_single_csv(dram_type: E_DRAM_TYPE, csv_path: Path, pool: Pool = None):
+    log_debug("__decode_single_csv({}, '{}', pool)", dram_type, csv_path)
+    with open_file(csv_path, "r") as f:
         csvlines = f.readlines()
     # Use one core per (CSV file, DRAM command) pair. Returns a list of matching lines for each of the commands.
-    all_full_matches: list[list[int]] \
-        = pool.starmap(__decode_single_csv_regex, zip(itertools.repeat(csvlines), DRAM_COMMANDS[dram_type]))
+    args = zip(itertools.repeat(csvlines), DRAM_COMMANDS[dram_type])
+    all_full_matches: list[list[int]] = profiled_starmap(pool, __decode_single_csv_regex, args) if pool is not None \
+        else list(itertools.starmap(__decode_single_csv_regex, args))
 
     # a dictionary: row_number -> DRAM_cmd_candidates
     # some commands need the second cycle to identify them (e.g., WR/WRA)
@@ -65,6 +123,27 @@ def __decode_single_csv(dram_type: E_DRAM_TYPE, csv_path: Path, pool: Pool):
             res[line_no].append(dram_command.identifier)
 
     decoded_commands_csv = list()
+    # all lines but the header
+    stats = Counter({'rows': max(len(csvlines) - 1, 0)})
+    if len(res) == 0:
+        return decoded_commands_csv, stats
+
+    # look up the columns once instead of splitting the header for every line
+    column_names = csvlines[0].split(',')
+    time_col = get_column_index(csvlines, "Time")
+    cycle_col = get_column_index(csvlines, "cycle_cnt")
+    ca1_col = get_column_index(csvlines, "CA1") if dram_type == E_DRAM_TYPE.ddr5 else None
+    table = get_command_table(dram_type, [s for s in get_command_table(dram_type).signals if s in column_names])
+
+    # index the cycle count of each line once: cycles[line_no - 1] is the cycle count of line line_no
+    cycles = [__parse_int_or_none(line.split(',')[cycle_col]) for line in csvlines[1:len(csvlines) - 1]]
+    # if the cycle counts are increasing, the second cycle of a two-cycle command can be looked up directly,
+    # otherwise we have to search for it
+    cycle2line = None
+    if None not in cycles and all(a <= b for a, b in zip(cycles, cycles[1:])):
+        cycle2line = dict()
+        for line_no, cycle_cnt in enumerate(cycles, start=1):
+            cycle2line.setdefault(cycle_cnt, line_no)
 
     # we take the information from simply mapping the signals to the DRAM command truth table
     # and now reiterate over all decoded commands to
@@ -74,10 +153,11 @@ def __decode_single_csv(dram_type: E_DRAM_TYPE, csv_path: Path, pool: Pool):
     for line_no in range(1, len(csvlines) - 1):
         # we did not decode any command in that CSV line (invalid or ignored)
         if line_no not in res:
-            print_debug(f"skipping line {line_no}, reason: 'inv/ign'")
+            count("skipped lines (inv/ign)")
             continue
+        fields = csvlines[line_no].split(',')
         # Get the cycle count for the matched line.
-        cur_cycle = int(get_value_by_name(csvlines, line_no, "cycle_cnt"))
+        cur_cycle = int(fields[cycle_col])
         
         # if it is a one-cycle command, then we ignore any **equal** one-cycle command in the consecutive
         # cycle; equality includes not only the command type (e.g., REFsb) but also all its metadata (e.g., targeted bk)
@@ -88,30 +168,30 @@ def __decode_single_csv(dram_type: E_DRAM_TYPE, csv_path: Path, pool: Pool):
             cycle = decoded_commands_csv[-1].cycle
             if cur_cycle == cycle+1:
                 last_cmd = DramCommand.get_command(dram_type, identifier)
-                print_debug(f"last_cmd.identifier={identifier}, last_cmd={last_cmd}")
+                log_debug("last_cmd.identifier={}, last_cmd={}", identifier, last_cmd)
 
         # Check if we have a match for a two-cycle command, i.e., if we have DDR5 and CA1 == 0 in the first cycle.
         is_two_cycle_command = False
         if dram_type == E_DRAM_TYPE.ddr5:
-            ca1_value = get_value_by_name(csvlines, line_no, "CA1")
-            print_debug(f"ca1_value={ca1_value}")
+            ca1_value = fields[ca1_col]
+            log_debug("ca1_value={}", ca1_value)
             is_two_cycle_command = (ca1_value == "0")
 
         dram_cmd_candidates: list[E_DRAM_CMD] = res[line_no]
         if not is_two_cycle_command:  # 1-cycle command
             assert len(dram_cmd_candidates) == 1, "1-cycle command with more than one CMD candidate detected!"
             cmd = DramCommand.get_command(dram_type, dram_cmd_candidates[0])
-            print_debug(f"dram_cmd_candidates={dram_cmd_candidates}")
-            regexes = cmd.get_regexes(csvlines[0].split(','), cmd.get_commands(True, False))
-            print_debug(f"regexes={regexes}")
+            log_debug("dram_cmd_candidates={}", dram_cmd_candidates)
+            regexes = cmd.get_regexes(column_names, cmd.get_commands(True, False))
+            log_debug("regexes={}", regexes)
             for rx in regexes: 
                 if re.match(rx, csvlines[line_no]):
                     # convert lines into DramCommand objects to extract cmd_metadata
-                    metadata = cmd.extract_metadata_csv(csvlines[0].split(','), [csvlines[line_no].split(',')])
+                    metadata = cmd.extract_metadata_csv(column_names, [fields])
                     # save information about these two lines and the decoded command
-                    ts = get_value_by_name(csvlines, line_no, "Time")
+                    ts = fields[time_col]
 
-                    print_debug(f"loop: last_cmd={identifier}, last_cmd={last_cmd}")
+                    log_debug("loop: last_cmd={}, last_cmd={}", identifier, last_cmd)
                     cur_command_decoded = DecodedCommand(ts, cmd.identifier, metadata, cur_cycle)
                     # last command is the exact same one-cycle command -> ignore it
                     if last_cmd != None:
@@ -120,94 +200,1065 @@ def __decode_single_csv(dram_type: E_DRAM_TYPE, csv_path: Path, pool: Pool):
                             break 
 
                     # add command to list of decoded commands
-                    print_debug("adding command to decoded_commands_csv")
+                    count("decoded commands")
                     decoded_commands_csv.append(cur_command_decoded)
 
         else:  # 2-cycle command
-            # check that cur_cycle+1 is in csv file
+            # find the line of cur_cycle+skip_n, i.e., the first line whose cycle count is not smaller than it
             skip_n = 2 if USE_2N_MODE else 1
             next_cycle = cur_cycle + skip_n
 
-            for cur_line in range(line_no, len(csvlines)-1):
-                cycle_cnt = int(get_value_by_name(csvlines, cur_line, "cycle_cnt"))
-                if cycle_cnt == next_cycle:
-                    print_debug("found next_cycle in file")
-
-                    # now check which of the dram_cmd_candidates is the right one
-                    any_match = False
-                    for candidate in dram_cmd_candidates:
-                        # compare signals of cur_cycle+1 against requirements of second cycle
-                        cmd = DramCommand.get_command(E_DRAM_TYPE.ddr5, candidate)
-                        # assert cmd.is_two_cycle_cmd, \
-                        #     "trying to decode second cycle but command detected is not a two-cycle cmd"
-                        if not cmd.is_two_cycle_cmd:
-                            continue
-
-                        for rx in cmd.get_regexes(csvlines[0].split(','), cmd.get_commands(False, True)):
-                            if re.match(rx, csvlines[cur_line]):
-                                print_debug(f"candidates {dram_cmd_candidates}: found {candidate} to be correct")
-                                # convert lines into DramCommand objects to extract cmd_metadata
-                                metadata = cmd.extract_metadata_csv(csvlines[0].split(','),
-                                                                    [csvlines[line_no].split(','),
-                                                                     csvlines[cur_line].split(',')])
-                                # save information about these two lines and the decoded command
-                                ts = get_value_by_name(csvlines, line_no, "Time")
-                                decoded_commands_csv.append(DecodedCommand(ts, cmd.identifier, metadata, cur_cycle))
-
-                                any_match = True
-                                # all other regexes should NOT match, but we skip checking this here to save time
-                                break
-
-                    if not any_match:
-                        s = str()
-                        for k, v in zip(csvlines[0].split(','), csvlines[cur_line].split(',')):
-                            s += '{}={} '.format(k.replace("\n",""), v.replace("\n", ""))
-                        print_debug(f"[-] none of the cmd candidates ({dram_cmd_candidates}) matched the second cycle:\n"
-                              f"\t{csv_path.name}:{cur_line}: {s}")
-
-                    # no need to iterate over all other candidates if we verified the first candidate meets all reqs.
-                    break
+            if cycle2line is not None:
+                cur_line = cycle2line.get(next_cycle)
+            else:
+                cur_line = None
+                for l in range(line_no, len(csvlines) - 1):
+                    cycle_cnt = cycles[l - 1] if cycles[l - 1] is not None else int(csvlines[l].split(',')[cycle_col])
+                    if cycle_cnt >= next_cycle:
+                        cur_line = l if cycle_cnt == next_cycle else None
+                        break
 
-                elif cycle_cnt > next_cycle:
-                    # we did not find the next cycle in the valid samples
-                    print_debug(f"[-] missing second cycle for cmd candidates '{dram_cmd_candidates}' in {csv_path.name}:{line_no}")
-                    # break out of while(True)
-                    break
+            if cur_line is None:
+                # we did not find the next cycle in the valid samples
+                log_debug("[-] missing second cycle for cmd candidates '{}' in {}:{}",
+                          dram_cmd_candidates, csv_path.name, line_no)
+                stats['missing_second_cycle'] += 1
+                continue
+
+            count("second cycles found")
+            second_fields = csvlines[cur_line].split(',')
+            # compare signals of cur_cycle+skip_n against the requirements of the second cycle of all candidates at once
+            second_cycle_matches = 0
+            if len(second_fields) >= len(column_names):
+                second_cycle_matches = table.lookup_signals(
+                    {s: __parse_bit_or_none(second_fields[column_names.index(s)]) for s in table.signals},
+                    second_cycle=True)
+
+            # now check which of the dram_cmd_candidates is the right one
+            num_matches = 0
+            for candidate in dram_cmd_candidates:
+                cmd = DramCommand.get_command(E_DRAM_TYPE.ddr5, candidate)
+                # assert cmd.is_two_cycle_cmd, \
+                #     "trying to decode second cycle but command detected is not a two-cycle cmd"
+                if not cmd.is_two_cycle_cmd:
+                    continue
+
+                if (second_cycle_matches >> DRAM_COMMANDS[dram_type].index(cmd)) & 1:
+                    log_debug("candidates {}: found {} to be correct", dram_cmd_candidates, candidate)
+                    # convert lines into DramCommand objects to extract cmd_metadata
+                    metadata = cmd.extract_metadata_csv(column_names, [fields, second_fields])
+                    # save information about these two lines and the decoded command
+                    ts = fields[time_col]
+                    decoded_commands_csv.append(DecodedCommand(ts, cmd.identifier, metadata, cur_cycle))
+                    num_matches += 1
+
+            if num_matches == 0:
+                # the signals are only joined if they are printed
+                if is_enabled(DEBUG):
+                    s = str()
+                    for k, v in zip(column_names, second_fields):
+                        s += '{}={} '.format(k.replace("\n",""), v.replace("\n", ""))
+                    log_debug("[-] none of the cmd candidates ({}) matched the second cycle:\n\t{}:{}: {}",
+                              dram_cmd_candidates, csv_path.name, cur_line, s)
+                stats['unmatched_second_cycle'] += 1
+            elif num_matches > 1:
+                stats['ambiguous_second_cycle'] += 1
+
+    log_counters(DEBUG, csv_path.name)
+    return decoded_commands_csv, stats
+
+
+# Raised by __decode_csv_rows if the second cycle of a two-cycle command might lie beyond the loaded rows.
+class _NeedMoreRows(Exception):
+    pass
+
+
+# Decode the loaded rows [0, num_own_rows) of a CSV using NumPy instead of regexes. The control signals of each row
+# are packed into an integer word that indexes the precompiled truth table of all DRAM commands, only the matching rows
+# are then looked at one by one. Rows beyond num_own_rows are only used to find second cycles.
+# Returns the decoded commands and, for each of them, whether it is a one-cycle command; repeated one-cycle commands
+# are NOT yet removed. Also returns the number of two-cycle commands whose second cycle was missing or matched none or
+# several of the candidates, and the number of rows decoded.
+def __decode_csv_rows(dram_type: E_DRAM_TYPE, csv: TrimmedCsv, num_own_rows: int) \
+        -> tuple[DecodedCommandBatch, np.ndarray, Counter]:
+    dram_cmds = DRAM_COMMANDS[dram_type]
+    # like the regexes, only consider requirements on columns that exist in the (raw) header
+    table = get_command_table(dram_type, [s for s in get_command_table(dram_type).signals
+                                          if s in csv.column_names])
+
+    # the last line of the file is never decoded nor searched for second cycles (see __decode_single_csv), but it is
+    # counted like the other rows
+    num_decoded_rows = min(num_own_rows, csv.num_rows)
+    num_rows = csv.num_rows - 1 if csv.loaded_until_eof() else csv.num_rows
+    num_own_rows = min(num_own_rows, num_rows)
+
+    # classify each row by a single lookup of its packed control signals
+    word, known = table.pack(csv.bits)
+    considered = csv.complete & (np.arange(csv.num_rows) < num_own_rows)
+    first_cycle_matches = np.where(considered, table.lookup_first_cycle(word, known), 0).astype(np.uint64)
+    num_candidates = table.count_commands(first_cycle_matches)
+    candidate_rows = num_candidates > 0
+    if not np.any(candidate_rows):
+        return DecodedCommandBatch(dram_type), np.zeros(0, dtype=bool), Counter({'rows': num_decoded_rows})
+
+    # these raise the same ValueError as get_value_by_name if a required column is missing
+    time_col = csv.index("Time")
+    cycles = csv.ints[csv.column_names[csv.index("cycle_cnt")]]
+    is_two_cycle = np.zeros(csv.num_rows, dtype=bool)
+    if dram_type == E_DRAM_TYPE.ddr5:
+        # DDR5 distinguishes 1-cycle from 2-cycle commands by CA1
+        is_two_cycle = (csv.bits[csv.column_names[csv.index("CA1")]] == 0)
+
+    # candidates are resolved by their identifier, exactly as __decode_single_csv does
+    resolved = [dram_cmds.index(DramCommand.get_command(dram_type, c.identifier)) for c in dram_cmds]
+
+    one_cycle_rows = candidate_rows & ~is_two_cycle
+    assert np.all(num_candidates[one_cycle_rows] == 1), "1-cycle command with more than one CMD candidate detected!"
+    one_cycle_cmd = table.first_command(first_cycle_matches)
+
+    # for each two-cycle candidate, find the row of the second cycle, i.e., the first row whose cycle count is
+    # not smaller than the expected one; the pair is only valid if the cycle count is the expected one
+    two_cycle_rows = np.flatnonzero(candidate_rows & is_two_cycle)
+    skip_n = 2 if USE_2N_MODE else 1
+    next_cycles = cycles[two_cycle_rows] + skip_n
+    searched = cycles[:num_rows]
+    if np.all(searched[1:] >= searched[:-1]):
+        second_rows = np.searchsorted(searched, next_cycles, side='left')
+    else:
+        second_rows = np.array([next((j for j in range(r, num_rows) if searched[j] >= nc), num_rows)
+                                for r, nc in zip(two_cycle_rows, next_cycles)], dtype=np.int64)
+    found = second_rows < num_rows
+    if not np.all(found) and num_rows == csv.num_rows:
+        raise _NeedMoreRows()
+    second_rows = np.where(found, second_rows, 0)
+    found &= (cycles[second_rows] == next_cycles)
+
+    # every two-cycle candidate whose both cycles match is decoded; -1 marks the second row of one-cycle commands
+    one_cycle_rows = np.flatnonzero(one_cycle_rows)
+    rows = [one_cycle_rows]
+    cmd_ids = [np.array(resolved, dtype=np.int64)[one_cycle_cmd[one_cycle_rows]]]
+    second_cycle_rows = [np.full(len(one_cycle_rows), -1, dtype=np.int64)]
+    second_cycle_matches = np.where(csv.complete, table.lookup_second_cycle(word, known), 0).astype(np.uint64)
+    num_matches = np.zeros(len(two_cycle_rows), dtype=np.int64)
+    for cmd_id in range(len(dram_cmds)):
+        if not dram_cmds[resolved[cmd_id]].is_two_cycle_cmd:
+            continue
+        matches = found & table.has_command(first_cycle_matches[two_cycle_rows], cmd_id) \
+            & table.has_command(second_cycle_matches[second_rows], resolved[cmd_id])
+        num_matches += matches
+        rows.append(two_cycle_rows[matches])
+        cmd_ids.append(np.full(int(np.sum(matches)), resolved[cmd_id], dtype=np.int64))
+        second_cycle_rows.append(second_rows[matches])
+    # the sort is stable, i.e., several commands of the same row stay in DRAM_COMMANDS order
+    rows = np.concatenate(rows)
+    order = np.argsort(rows, kind='stable')
+    rows = rows[order]
+    cmd_ids = np.concatenate(cmd_ids)[order]
+    second_cycle_rows = np.concatenate(second_cycle_rows)[order]
+
+    stats = Counter({
+        'rows': num_decoded_rows,
+        'missing_second_cycle': int(np.sum(~found)),
+        'unmatched_second_cycle': int(np.sum(found & (num_matches == 0))),
+        'ambiguous_second_cycle': int(np.sum(num_matches > 1)),
+    })
+
+    decoded = DecodedCommandBatch(dram_type)
+    cmd_codes = np.array([decoded.cmd_names.index(cmd.identifier.name) for cmd in dram_cmds], dtype=np.uint8)
+    decoded.append_arrays([csv.cell(row, time_col) for row in rows.tolist()], cmd_codes[cmd_ids], cycles[rows],
+                          __extract_metadata(dram_cmds, csv, rows, cmd_ids, second_cycle_rows))
+    return decoded, second_cycle_rows < 0, stats
+
+
+# Extracts the address fields of the decoded commands (see DecodedCommandBatch) by gathering the bits given by each
+# command's metadata plan (see DramCommand.get_csv_plan) from the bit columns, i.e., a shift-and-or over all commands
+# at once. Commands with a bit that is not exactly '0' or '1' are passed to extract_metadata_csv instead.
+# @param second_cycle_rows the row of each command's second cycle, or -1 for one-cycle commands
+def __extract_metadata(dram_cmds: list[DramCommand], csv: TrimmedCsv, rows: np.ndarray, cmd_ids: np.ndarray,
+                       second_cycle_rows: np.ndarray) -> dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    fields = {f: (np.zeros(len(rows), dtype=np.uint32), np.zeros(len(rows), dtype=np.uint32),
+                  np.zeros(len(rows), dtype=np.uint8)) for f in ADDRESS_FIELDS}
+    valid = np.ones(len(rows), dtype=bool)
+    for cmd_id in np.unique(cmd_ids):
+        selected = np.flatnonzero(cmd_ids == cmd_id)
+        for cycle, plan in enumerate(dram_cmds[cmd_id].get_csv_plan(csv.column_names)):
+            cycle_rows = rows[selected] if cycle == 0 else second_cycle_rows[selected]
+            for abbrv, columns in plan:
+                if abbrv not in fields:
+                    continue
+                value, xmask = np.zeros(len(selected), dtype=np.uint32), np.zeros(len(selected), dtype=np.uint32)
+                for col in columns:
+                    value <<= 1
+                    xmask <<= 1
+                    if col is None:
+                        xmask |= 1
+                        continue
+                    bits = csv.bits[csv.column_names[col]][cycle_rows]
+                    valid[selected] &= (bits <= 1)
+                    value |= (bits == 1)
+                # the bits of the second cycle are the more significant ones (e.g., the row bits of ACT)
+                values, xmasks, widths = fields[abbrv]
+                values[selected] |= value << widths[selected]
+                xmasks[selected] |= xmask << widths[selected]
+                widths[selected] += len(columns)
+
+    for i in np.flatnonzero(~valid):
+        cmd = dram_cmds[cmd_ids[i]]
+        lines = [csv.fields(rows[i])] + ([csv.fields(second_cycle_rows[i])] if second_cycle_rows[i] >= 0 else [])
+        metadata = cmd.extract_metadata_csv(csv.column_names, lines)
+        for f, (values, xmasks, widths) in fields.items():
+            values[i], xmasks[i], widths[i] = parse_bits(metadata.get(f, ''))
+    return fields
+
+
+# Decode the lines of a CSV that start within the byte range [begin, end), see TrimmedCsv.split.
+# The rows following the range are loaded as well (doubling the overlap as long as needed) to pair two-cycle commands
+# whose second cycle lies in the next chunk.
+def __decode_csv_chunk(dram_type: E_DRAM_TYPE, csv_path: Path, begin: int, end: int) \
+        -> tuple[DecodedCommandBatch, np.ndarray, Counter]:
+    with span("chunk", MANIFEST_STAGE, file=csv_path.name, begin=begin, end=end), TrimmedCsv(csv_path) as csv:
+        bit_columns, int_columns = __get_csv_columns(dram_type, csv)
+        overlap = CHUNK_OVERLAP
+        while True:
+            csv.load(bit_columns, int_columns, begin, csv.align(end + overlap))
+            try:
+                return __decode_csv_rows(dram_type, csv, int(np.searchsorted(csv.line_starts, end)))
+            except _NeedMoreRows:
+                overlap *= 2
+
+
+# Returns the (raw) names of the bit and integer columns of a CSV that __decode_csv_rows needs.
+def __get_csv_columns(dram_type: E_DRAM_TYPE, csv: TrimmedCsv) -> tuple[list[str], list[str]]:
+    # like the regexes, only consider requirements on columns that exist in the (raw) header
+    stripped_names = [n.strip() for n in csv.column_names]
+    signals = [s for s in get_command_table(dram_type).signals if s in csv.column_names]
+    ca1_columns = [csv.column_names[csv.index("CA1")]] \
+        if dram_type == E_DRAM_TYPE.ddr5 and "CA1" in stripped_names else []
+    cycle_columns = [csv.column_names[csv.index("cycle_cnt")]] if "cycle_cnt" in stripped_names else []
+    # the columns the metadata (e.g., bk, row) is gathered from, see __extract_metadata
+    metadata_columns = [c for c in dict.fromkeys(name for cmd in DRAM_COMMANDS[dram_type]
+                                                 for sub_cmd in cmd.get_commands() for name in sub_cmd.metadata)
+                        if c in csv.column_names and c not in signals + ca1_columns]
+    return signals + ca1_columns + metadata_columns, cycle_columns
+
+
+# Decode a CSV that is read from a stream (e.g., the output of xmldig2csv, see xmldigtocsv_pipe) as its lines arrive.
+# Like __decode_single_csv_vectorized, the lines are decoded in chunks of chunk_size bytes; a chunk is decoded once the
+# lines following it (to find the second cycles of two-cycle commands) have arrived as well. Yields the decoded chunks
+# (see __remove_repeated_commands) and adds up their counters in stats.
+# @param name the name of the CSV (e.g., the XMLdig file it is converted from)
+# @param tee if given, everything read from the stream is also written to this file
+def __decode_csv_stream(dram_type: E_DRAM_TYPE, name: str, stream, chunk_size: int, stats: Counter,
+                        tee=None) -> Iterator[tuple[DecodedCommandBatch, np.ndarray]]:
+    header = None
+    # the complete lines that have arrived but not been decoded yet
+    lines = bytearray()
+    partial_line = b""
+    eof = False
+    overlap = CHUNK_OVERLAP
+    need_more_lines = False
+    while not eof or len(lines) > 0:
+        while not eof and (header is None or need_more_lines or len(lines) < chunk_size + overlap):
+            need_more_lines = False
+            block = stream.read(STREAM_BLOCK_SIZE)
+            if tee is not None:
+                tee.write(block)
+            eof = (len(block) == 0)
+            block = partial_line + block
+            end = len(block) if eof else block.rfind(b'\n') + 1
+            partial_line = block[end:]
+            if header is None:
+                header_end = block.find(b'\n', 0, end) + 1
+                if header_end <= 0 and not eof:
+                    partial_line = block
+                    continue
+                header_end = header_end if header_end > 0 else end
+                header = block[:header_end]
+                block = block[header_end:end]
+            else:
+                block = block[:end]
+            lines += block
+        if header is None or len(lines) == 0:
+            break
+
+        csv = TrimmedCsv(Path(name), header + lines, truncated=not eof)
+        end = csv.align(len(header) + max(chunk_size, 1))
+        try:
+            with span("chunk", MANIFEST_STAGE, file=name, size=end - len(header)):
+                bit_columns, int_columns = __get_csv_columns(dram_type, csv)
+                csv.load(bit_columns, int_columns)
+                num_own_rows = int(np.searchsorted(csv.line_starts, end))
+                decoded, is_one_cycle, chunk_stats = __decode_csv_rows(dram_type, csv, num_own_rows)
+        except _NeedMoreRows:
+            overlap *= 2
+            need_more_lines = True
+            continue
+        overlap = CHUNK_OVERLAP
+        del lines[:end - len(header)]
+        stats.update(chunk_stats)
+        yield decoded, is_one_cycle
+
+
+# Returns the indices of the one-cycle commands that equal the command kept before them in the preceding cycle.
+# The command kept before a chunk is the last command of last_kept (if given).
+# Equality includes all metadata (e.g., the targeted bk) but not the timestamp, like DecodedCommand.equals.
+def __find_repeated_commands(dram_type: E_DRAM_TYPE, decoded: DecodedCommandBatch, is_one_cycle: np.ndarray,
+                             last_kept: DecodedCommandBatch = None) -> np.ndarray:
+    # only repetitions of commands that resolve to a one-cycle command (as in __decode_single_csv) are removed
+    removable = np.array([cmd is not None and not cmd.is_two_cycle_cmd
+                          for cmd in [DramCommand.get_command(dram_type, name) for name in decoded.cmd_names]])
+    cycles = decoded.array('cycle')
+    codes = decoded.array('cmd')
+    prev_cycles = np.concatenate((last_kept.array('cycle')[-1:] if last_kept is not None else [cycles[0] - 2],
+                                  cycles[:-1]))
+    prev_codes = np.concatenate((last_kept.array('cmd')[-1:] if last_kept is not None else [codes[0]], codes[:-1]))
+
+    if np.all(cycles > prev_cycles):
+        # a command equals its predecessor, but the predecessor is only kept if it did not equal its own predecessor:
+        # in a run of equal commands in consecutive cycles, every other command is removed
+        equal = is_one_cycle & removable[prev_codes] & (cycles == prev_cycles + 1) & decoded.equals_previous(last_kept)
+        idx = np.arange(len(equal))
+        run_starts = equal & ~np.concatenate(([False], equal[:-1]))
+        run_start_idx = np.maximum.accumulate(np.where(run_starts, idx, 0))
+        return np.flatnonzero(equal & ((idx - run_start_idx) % 2 == 0))
+
+    # the cycle counts are not increasing (e.g., a corrupted trace), compare to the last kept command one by one
+    repeated = list()
+    last_command_decoded = last_kept[len(last_kept) - 1] if last_kept is not None else None
+    for i, cur_command_decoded in enumerate(decoded):
+        if is_one_cycle[i] and last_command_decoded is not None \
+                and last_command_decoded.cycle + 1 == cur_command_decoded.cycle:
+            last_cmd = DramCommand.get_command(dram_type, last_command_decoded.cmd)
+            if last_cmd is not None and not last_cmd.is_two_cycle_cmd \
+                    and cur_command_decoded.equals(last_command_decoded, ignore_timestamp=True):
+                repeated.append(i)
+                continue
+        last_command_decoded = cur_command_decoded
+    return np.array(repeated, dtype=np.int64)
+
+
+# Removes one-cycle commands that equal the command decoded in the preceding cycle, exactly as __decode_single_csv
+# does. As this depends on the previously kept command, it must be done on the chunks of a file in order; the last
+# kept command is the only state carried between chunks.
+def __remove_repeated_commands(dram_type: E_DRAM_TYPE, decoded_chunks: Iterable[tuple[DecodedCommandBatch, np.ndarray]]) \
+        -> Iterator[DecodedCommandBatch]:
+    last_kept = None
+    for decoded, is_one_cycle in decoded_chunks:
+        if len(decoded) == 0:
+            continue
+        repeated = __find_repeated_commands(dram_type, decoded, is_one_cycle, last_kept)
+        if len(repeated) > 0:
+            decoded = decoded.select(np.setdiff1d(np.arange(len(decoded)), repeated))
+        if len(decoded) > 0:
+            last_kept = decoded.select([len(decoded) - 1])
+        yield decoded
+
+
+# Decodes the chunks of a CSV in order, at most num_parallel chunks at a time, and adds up their counters in stats.
+def __decode_csv_chunks(dram_type: E_DRAM_TYPE, csv_path: Path, chunks: list[tuple[int, int]], pool: Pool,
+                        num_parallel: int, stats: Counter) -> Iterator[tuple[DecodedCommandBatch, np.ndarray]]:
+    for i in range(0, len(chunks), num_parallel):
+        args = [(dram_type, csv_path, begin, end) for begin, end in chunks[i:i + num_parallel]]
+        if pool is not None and len(args) > 1:
+            decoded_chunks = profiled_starmap(pool, __decode_csv_chunk, args)
+        else:
+            decoded_chunks = [__decode_csv_chunk(*a) for a in args]
+        for decoded, is_one_cycle, chunk_stats in decoded_chunks:
+            stats.update(chunk_stats)
+            yield decoded, is_one_cycle
+
+
+# Decode a single CSV using NumPy instead of regexes. Yields the same decoded commands as __decode_single_csv.
+# The file is split into newline-aligned chunks of chunk_size bytes that are decoded one after another or, if a pool
+# is given, num_parallel at a time; each worker maps the file itself, so only the byte offsets are sent to the workers.
+# The decoded commands are streamed chunk by chunk, i.e., the memory used is bounded by the size and number of the
+# chunks in flight rather than the size of the file. The returned counters are complete once all commands were consumed.
+def __decode_single_csv_vectorized(dram_type: E_DRAM_TYPE, csv_path: Path, pool: Pool = None,
+                                   chunk_size: int = CHUNK_SIZE, num_parallel: int = 1) \
+        -> tuple[Iterator[DecodedCommandBatch], Counter]:
+    log_debug("__decode_single_csv_vectorized({}, '{}')", dram_type, csv_path)
+    if get_codec(csv_path) != E_CODEC.none:
+        return __decode_compressed_csv(dram_type, csv_path, chunk_size)
+    with TrimmedCsv(csv_path) as csv:
+        chunks = csv.split(chunk_size)
+    stats = Counter()
+    decoded = __decode_csv_chunks(dram_type, csv_path, chunks, pool, num_parallel if pool is not None else 1, stats)
+    return __remove_repeated_commands(dram_type, decoded), stats
+
+
+# Decode a single compressed CSV (see util.codec) while it is decompressed. Compressed files cannot be mapped and split
+# into chunks, so they are decoded as a stream by a single worker. The decoded commands are only complete once all of
+# them were consumed; the file is closed then.
+def __decode_compressed_csv(dram_type: E_DRAM_TYPE, csv_path: Path, chunk_size: int = CHUNK_SIZE) \
+        -> tuple[Iterator[DecodedCommandBatch], Counter]:
+    stats = Counter()
+
+    def decode():
+        with open_file(csv_path, "rb") as stream:
+            decoded = __decode_csv_stream(dram_type, csv_path.name, stream, chunk_size, stats)
+            yield from __remove_repeated_commands(dram_type, decoded)
+
+    return decode(), stats
+
+
+# Decode a single XMLdig file while xmldig2csv converts it, i.e., its output is decoded as it arrives through a pipe.
+# The decoded commands are only complete once all of them were consumed; the pipe is closed then.
+# @param keep_trimmed_csv whether to also write the trimmed CSV (to the output directory of stage 0)
+# @param codec the codec the trimmed CSV is compressed with
+def __decode_piped_xmldig(dram_type: E_DRAM_TYPE, iter_name: str, xmldig_path: Path, chunk_size: int = CHUNK_SIZE,
+                          keep_trimmed_csv: bool = False, codec: E_CODEC = E_CODEC.none) \
+        -> tuple[Iterator[DecodedCommandBatch], Counter]:
+    log_debug("__decode_piped_xmldig({}, '{}')", dram_type, xmldig_path)
+    stats = Counter()
+
+    def decode():
+        with contextlib.ExitStack() as stack:
+            trimmed_csv_path = Path(xmldigtocsv__get_output_path(iter_name, str(xmldig_path), codec))
+            tee = stack.enter_context(atomic_open(trimmed_csv_path, "wb")) if keep_trimmed_csv else None
+            with xmldigtocsv_pipe(iter_name, str(xmldig_path)) as stream:
+                decoded = __decode_csv_stream(dram_type, xmldig_path.name, stream, chunk_size, stats, tee)
+                yield from __remove_repeated_commands(dram_type, decoded)
+
+    return decode(), stats
+
+
+# Writes decoded commands to a CSV file as they come in. The file is only created if there is at least one command.
+# Returns the number of commands written of each type (by name).
+# The file is written atomically (see atomic_output), i.e., a crash never leaves a truncated output file behind. It is
+# compressed with the codec of its extension, see util.codec.
+# @param decoded_batches the decoded commands in batches (e.g., one DecodedCommandBatch per chunk)
+# @param binary_writer if given, the commands are also collected to be written in the binary format
+def __write_decoded_commands(out_path: Path, decoded_batches: Iterable[Iterable[DecodedCommand]],
+                             binary_writer: DecodedTraceWriter = None) -> Counter:
+    num_written = Counter()
+    with atomic_output(out_path) as tmp_path:
+        f = None
+        try:
+            for batch in decoded_batches:
+                for line in batch:
+                    if f is None:
+                        f = open_file(tmp_path, "w", get_codec(out_path))
+                        f.write(DecodedCommand.get_csv_header() + "\n")
+                    f.write(line.to_csv(newline=True))
+                    num_written[line.cmd] += 1
+                if binary_writer is None:
+                    continue
+                if isinstance(batch, DecodedCommandBatch):
+                    binary_writer.add_batch(batch)
+                else:
+                    for line in batch:
+                        binary_writer.add(line)
+        finally:
+            if f is not None:
+                f.close()
+        # a compressed file is only complete once it is closed
+        if f is not None:
+            fsync_path(tmp_path)
+    # remove the output of a previous run that is now stale
+    if not num_written and out_path.is_file():
+        out_path.unlink()
+    return num_written
+
+
+# Returns the path of the binary output (see util.decoded_trace) that belongs to a decoded CSV.
+def get_binary_output_path(out_path: Path) -> Path:
+    return with_codec(out_path, E_CODEC.none).with_suffix(BINARY_SUFFIX)
+
+
+# Decode a single CSV (or XMLdig file, see xmldig_reader) and write the decoded commands to out_path; all workers are
+# used if a pool is given.
+# If a cache is given, the output is taken from the cache if the same input has been decoded before.
+# Returns the input path, its description for the manifest (taken before decoding it), the counters of two-cycle
+# commands that could not be paired and of the rows decoded (see PAIRING_STATS), the number of commands written of each
+# type (both empty for cached outputs), and whether the output was taken from the cache.
+# @param binary whether to also write the decoded commands in the binary format (see get_binary_output_path)
+# @param xmldig_reader how the input is read; unless xmldig2csv, the input is an XMLdig file
+# @param keep_trimmed_csv whether to write the trimmed CSV of an XMLdig file that is converted by xmldig2csv (compressed
+#   like the output)
+def __decode_and_write_single_csv(dram_type: E_DRAM_TYPE, iter_name: str, in_path: Path, out_path: Path,
+                                  engine: E_DECODE_ENGINE, chunk_size: int, binary: bool = False,
+                                  cache: DecodeCache = None,
+                                  xmldig_reader: E_XMLDIG_READER = E_XMLDIG_READER.xmldig2csv,
+                                  keep_trimmed_csv: bool = False, pool: Pool = None,
+                                  num_workers: int = 1) -> tuple[Path, dict, Counter, Counter, bool]:
+    in_info = describe_input(in_path)
+    binary_path = get_binary_output_path(out_path)
+    # the output of a previous run with another codec would be analyzed as well
+    remove_other_codecs(out_path)
+    if cache is not None:
+        cache_key = DecodeCache.get_key(in_info['sha256'], dram_type, USE_2N_MODE, OUTPUT_VERSION,
+                                        __get_xmldig_reader_tag(xmldig_reader))
+        if cache.fetch(cache_key, out_path) and (not binary or cache.fetch(cache_key, binary_path, BINARY_SUFFIX)):
+            return in_path, in_info, Counter(), Counter(), True
+
+    if xmldig_reader == E_XMLDIG_READER.pipe:
+        decoded_batches, stats = __decode_piped_xmldig(dram_type, iter_name, in_path, chunk_size, keep_trimmed_csv,
+                                                       get_codec(out_path))
+    elif engine == E_DECODE_ENGINE.vectorized:
+        decoded_batches, stats = __decode_single_csv_vectorized(dram_type, in_path, pool, chunk_size, num_workers)
+    else:
+        decoded_commands_csv, stats = __decode_single_csv(dram_type, in_path, pool)
+        decoded_batches = [decoded_commands_csv]
+    binary_writer = DecodedTraceWriter(dram_type) if binary else None
+    commands = __write_decoded_commands(out_path, decoded_batches, binary_writer)
+    if binary_writer is not None and len(binary_writer) > 0:
+        binary_writer.write(binary_path)
+    elif binary_path.is_file():
+        # remove the output of a previous run that is now stale
+        binary_path.unlink()
+
+    if cache is not None:
+        cache.store(cache_key, out_path)
+        if binary:
+            cache.store(cache_key, binary_path, BINARY_SUFFIX)
+    return in_path, in_info, stats, commands, False
 
-    return decoded_commands_csv
+
+# Pool.imap_unordered passes a single argument.
+def __decode_and_write_single_csv_star(args: tuple) -> tuple[Path, dict, Counter, Counter, bool]:
+    return __decode_and_write_single_csv(*args)
+
+
+# Returns what identifies the way the XMLdig files are read, or None if the inputs are the trimmed CSVs of stage 0.
+def __get_xmldig_reader_tag(xmldig_reader: E_XMLDIG_READER) -> str:
+    if xmldig_reader == E_XMLDIG_READER.pipe:
+        return xmldig_reader.value
+    return None
+
+
+# Returns the parameters that the decoded output depends on besides the input file, see Manifest. Like the key of the
+# DecodeCache, they include the fingerprint of the DRAM commands, so that outputs decoded before a command definition
+# changed are decoded again.
+def __get_manifest_params(dram_type: E_DRAM_TYPE, binary: bool, xmldig_reader: E_XMLDIG_READER) -> dict:
+    params = {'dram_type': dram_type.value, 'use_2n_mode': USE_2N_MODE, 'binary': binary,
+              'commands': get_commands_fingerprint(dram_type)}
+    if xmldig_reader != E_XMLDIG_READER.xmldig2csv:
+        params['xmldig_reader'] = __get_xmldig_reader_tag(xmldig_reader)
+    return params
+
+
+# Splits the files to decode into outliers, which are decoded one after another using all workers, and the remaining
+# files, which are decoded in parallel (one file per worker). Both lists are sorted by size, largest first, so that the
+# remaining files are distributed as evenly as possible (LPT scheduling). A file is an outlier if it is larger than the
+# fair share of a worker, i.e., if decoding it in a single worker would dominate the total runtime.
+def __schedule_files(file_paths: list[tuple[Path, Path]], num_workers: int, chunk_size: int) \
+        -> tuple[list[tuple[Path, Path]], list[tuple[Path, Path]]]:
+    sizes = {in_path: in_path.stat().st_size for in_path, _ in file_paths}
+    file_paths = sorted(file_paths, key=lambda x: sizes[x[0]], reverse=True)
+    fair_share = sum(sizes.values()) / max(num_workers, 1)
+    outliers = [x for x in file_paths if num_workers > 1 and sizes[x[0]] > max(fair_share, chunk_size)]
+    return outliers, [x for x in file_paths if x not in outliers]
+
+
+# Formats the counters of two-cycle commands that could not be paired unambiguously with their second cycle.
+def __format_pairing_stats(stats: Counter) -> str:
+    return ", ".join(f"{stats[k]} {k.replace('_', ' ')}" for k in PAIRING_STATS)
+
+
+# Returns a function that records a decoded file (i.e., the result of __decode_and_write_single_csv and the timing of
+# the worker that decoded it, see util.metrics) in the manifest and the metrics of the stage, and adds its counters to
+# stats and cache_stats. The function takes the number of workers used for the file as well (by default, one).
+# @param out_paths the output path of each input path
+# @param retention whether to remove the input (a trimmed CSV of stage 0) once it has been recorded, see util.retention
+def __get_file_done(iter_name: str, manifest: Manifest, params: dict, binary: bool, out_paths: dict[Path, Path],
+                    stats: Counter, cache_stats: Counter, cache: DecodeCache, stage_metrics: StageMetrics,
+                    retention: E_RETENTION = E_RETENTION.keep):
+    def file_done(in_path: Path, in_info: dict, file_stats: Counter, commands: Counter, cache_hit: bool,
+                  timing: TaskTiming, num_slots: int = 1):
+        out_path = out_paths[in_path]
+        extra_out_paths = [get_binary_output_path(out_path)] if binary else None
+        with span("record", MANIFEST_STAGE, file=in_path.name):
+            manifest.record(MANIFEST_STAGE, in_path, in_info, out_path, OUTPUT_VERSION, params, extra_out_paths)
+            if retention == E_RETENTION.decoded:
+                xmldigtocsv__remove_output(manifest, in_path)
+        if any(file_stats[k] > 0 for k in PAIRING_STATS):
+            printf(f"{in_path.name}: {__format_pairing_stats(file_stats)}")
+        stats.update(file_stats)
+        cache_stats['hits' if cache_hit else 'misses'] += 1
+        bytes_out = sum(path.stat().st_size for path in [out_path] + (extra_out_paths or []) if path.is_file())
+        stage_metrics.record(iter_name, in_path.name, timing, in_info['size'], bytes_out,
+                             file_stats['rows'] if not cache_hit else None, commands if not cache_hit else None,
+                             cache_hit if cache is not None else None, num_slots=num_slots)
+
+    return file_done
+
+
+# Returns a function that tells whether a trimmed CSV of stage 0 has been decoded with the given parameters and the
+# decoded output is still there, even if the trimmed CSV has been removed since (see util.retention), e.g., to skip
+# converting its XMLdig file again.
+def get_decoded_check(iter_name: str, dram_type: E_DRAM_TYPE, binary: bool = False, codec: E_CODEC = E_CODEC.none):
+    output_dir = get_output_directory(iter_name)
+    params = __get_manifest_params(dram_type, binary, E_XMLDIG_READER.xmldig2csv)
+
+    def is_decoded(manifest: Manifest, csv_path: Path) -> bool:
+        out_path = with_codec(output_dir / Path(csv_path).name, codec)
+        extra_out_paths = [get_binary_output_path(out_path)] if binary else None
+        return manifest.has_current_output(MANIFEST_STAGE, csv_path, out_path, OUTPUT_VERSION, params, extra_out_paths)
+
+    return is_decoded
+
+
+# Evicts the least recently used entries of the decode cache (if any) once all files have been decoded.
+def __finish_decoding(cache: DecodeCache, cache_stats: Counter):
+    if cache is not None:
+        cache_stats['evicted'] = cache.evict()
+        printf(f"decode cache: {cache_stats['hits']} hit(s), {cache_stats['misses']} miss(es), "
+               f"{cache_stats['evicted']} entries evicted")
 
 
 # Requires the DATA_DIR env variable.
 # Convertes the raw command bus data to named DDR commands (e.g., ACT, REF).
 # @param the name of the experiment iteration
-def decode_all(dram_type: E_DRAM_TYPE, iter_name: str, num_workers: int) -> None:
+# @param chunk_size the size of the chunks (in bytes) the vectorized engine decodes at once
+# @param binary whether to also write the decoded commands in the binary format (see util.decoded_trace)
+# @param xmldig_reader unless xmldig2csv, the XMLdig files are decoded directly instead of the trimmed CSVs of stage 0
+#   (which requires the XMLDIG_DIR env variable), see E_XMLDIG_READER
+# @param keep_trimmed_csv whether to write the trimmed CSVs of the XMLdig files that are converted by xmldig2csv
+# @param codec the codec the decoded CSVs (and the trimmed CSVs written by this stage) are compressed with; the codec of
+#   each input is detected by its extension, see util.codec
+# @param retention what happens to the trimmed CSVs of stage 0 once they have been decoded, see util.retention
+# @param pool a pool of num_workers workers that is shared (e.g., by the jobs of util.server), or None to start one
+# @param metrics records the decoded and skipped files (see util.metrics), or None to not record them
+def decode_all(dram_type: E_DRAM_TYPE, iter_name: str, num_workers: int,
+               engine: E_DECODE_ENGINE = E_DECODE_ENGINE.regex, chunk_size: int = CHUNK_SIZE,
+               binary: bool = False, xmldig_reader: E_XMLDIG_READER = E_XMLDIG_READER.xmldig2csv,
+               keep_trimmed_csv: bool = False, codec: E_CODEC = E_CODEC.none,
+               retention: E_RETENTION = E_RETENTION.keep, pool: Pool = None, metrics: RunMetrics = None) -> None:
     assert (iter_name.count("/") == 0 and iter_name.count("\\") == 0), \
         "iter_name is supposed to be a folder name, not a path!"
 
     checkenv('DATA_DIR')
     data_dir = Path(os.getenv("DATA_DIR"))
-    input_dir = Path(xmldigtocsv__get_output_directory(iter_name))
     output_dir = data_dir / "decoded" / iter_name
-    file_paths = get_input_and_output_file_paths(input_dir, output_dir)
+    if xmldig_reader != E_XMLDIG_READER.xmldig2csv:
+        checkenv('XMLDIG_DIR')
+        input_dir = Path(os.getenv('XMLDIG_DIR')) / iter_name
+        file_paths = [(in_path, with_codec(output_dir / in_path.with_suffix('.csv').name, codec))
+                      for in_path in sorted(input_dir.glob(f"*{XMLDIG_SUFFIX}"))]
+    else:
+        input_dir = Path(xmldigtocsv__get_output_directory(iter_name))
+        file_paths = [(in_path, with_codec(out_path, codec))
+                      for in_path, out_path in get_input_and_output_file_paths(input_dir, output_dir)]
+
+    # only decode files whose input changed or whose output is missing or incomplete (e.g., after a crash)
+    manifest = Manifest(get_manifest_path(iter_name))
+    params = __get_manifest_params(dram_type, binary, xmldig_reader)
+    if metrics is None:
+        metrics = RunMetrics(iter_name, num_workers)
+    stage_metrics = metrics.get_stage(MANIFEST_STAGE, num_workers)
+    pending_file_paths = list()
+    for in_path, out_path in file_paths:
+        extra_out_paths = [get_binary_output_path(out_path)] if binary else None
+        if manifest.is_done(MANIFEST_STAGE, in_path, out_path, OUTPUT_VERSION, params, extra_out_paths):
+            printf(f"skipping file {in_path.name} as it has already been converted before")
+            stage_metrics.skipped()
+            continue
+        pending_file_paths.append((in_path, out_path))
+    outliers, file_paths_by_size = __schedule_files(pending_file_paths, num_workers, chunk_size)
+    if xmldig_reader != E_XMLDIG_READER.xmldig2csv:
+        # XMLdig files are not split into chunks, i.e., they are all decoded in parallel
+        outliers, file_paths_by_size = list(), outliers + file_paths_by_size
+    elif engine == E_DECODE_ENGINE.vectorized:
+        # compressed files are not split into chunks either, see __decode_compressed_csv
+        compressed = [x for x in outliers if get_codec(x[0]) != E_CODEC.none]
+        outliers = [x for x in outliers if x not in compressed]
+        file_paths_by_size = sorted(compressed + file_paths_by_size, key=lambda x: x[0].stat().st_size, reverse=True)
+    out_paths = dict(pending_file_paths)
 
     # Run in parallel
     t_start = time.time()
-    with Pool(num_workers) as p:
-        for in_path, out_path in file_paths:
-            if out_path.is_file():
-                printf(f"skipping file {in_path.name} as it has already been converted before")
-                break
-
-            decoded_commands_csv = __decode_single_csv(dram_type, in_path, p)
-            if len(decoded_commands_csv) == 0:
-                continue
-            # ensure the parent directory of the output file exists
-            # write decoded commands to output CSV file
-            out_path.parent.mkdir(parents=True, exist_ok=True)
-            with out_path.open("w") as f:
-                f.write(DecodedCommand.get_csv_header() + "\n")
-                for line in decoded_commands_csv:
-                    f.write(line.to_csv(newline=True))
+    stats = Counter()
+    cache = get_decode_cache()
+    cache_stats = Counter()
+    # only the trimmed CSVs of stage 0 are intermediate outputs, the XMLdig files are the raw inputs
+    file_done = __get_file_done(iter_name, manifest, params, binary, out_paths, stats, cache_stats, cache,
+                                stage_metrics,
+                                retention if xmldig_reader == E_XMLDIG_READER.xmldig2csv else E_RETENTION.keep)
+    for in_path, _ in pending_file_paths:
+        stage_metrics.queued(iter_name, in_path.name)
+
+    with manifest, use_shared(pool, lambda: Pool(num_workers)) as p:
+        # the few files that are too large to be balanced are decoded using all workers
+        for in_path, out_path in outliers:
+            result, timing = Measured(__decode_and_write_single_csv, metrics.profiler)(
+                dram_type, iter_name, in_path, out_path, engine, chunk_size, binary, cache, xmldig_reader,
+                keep_trimmed_csv, p, num_workers)
+            file_done(*result, timing, num_workers)
+
+        # all other files are decoded (and written) by the workers, largest first
+        args = [(dram_type, iter_name, in_path, out_path, engine, chunk_size, binary, cache, xmldig_reader,
+                 keep_trimmed_csv)
+                for in_path, out_path in file_paths_by_size]
+        for result, timing in p.imap_unordered(Measured(__decode_and_write_single_csv_star, metrics.profiler), args):
+            file_done(*result, timing)
 
+    __finish_decoding(cache, cache_stats)
     t_end = time.time()
     printf(f"decoding done for all {len(file_paths)} file(s) in {t_end - t_start:.3f} seconds.")
+    printf(f"two-cycle commands: {__format_pairing_stats(stats)}")
+
+
+# Decode a single trimmed CSV of decode_pipelined (in a worker), see __decode_and_write_single_csv.
+def __decode_and_write_converted_csv(dram_type: E_DRAM_TYPE, iter_name: str, engine: E_DECODE_ENGINE,
+                                     chunk_size: int, binary: bool, cache: DecodeCache, in_path: Path,
+                                     out_path: Path) -> tuple[Path, dict, Counter, Counter, bool]:
+    return __decode_and_write_single_csv(dram_type, iter_name, in_path, out_path, engine, chunk_size, binary, cache)
+
+
+# The chain of pipeline stages (see util.pipeline) that converts the XMLdig files of an experiment with xmldig2csv and
+# decodes the trimmed CSVs, and what they record, see __get_pipelined_experiment.
+class _PipelinedExperiment:
+    def __init__(self, iter_name: str, manifest: Manifest, convert: PipelineStage, decode: PipelineStage,
+                 put_xmldig: Callable[[str], None], put_trimmed_csv: Callable[[Path], None], stats: Counter,
+                 failures: dict[str, str], metrics: RunMetrics):
+        self.iter_name = iter_name
+        self.manifest = manifest
+        self.convert = convert
+        self.decode = decode
+        # records the converted and decoded files, see util.metrics
+        self.metrics = metrics
+        # queues an XMLdig file to be converted and decoded, unless it has been before
+        self.put_xmldig = put_xmldig
+        # queues a trimmed CSV to be decoded, unless it has been before
+        self.put_trimmed_csv = put_trimmed_csv
+        self.stats = stats
+        self.failures = failures
+        # the number of XMLdig files queued by put_xmldig (or __queue_pending_files), and the total size of those
+        # queued to be converted
+        self.num_files = 0
+        self.num_bytes = 0
+
+    def get_stages(self) -> list[PipelineStage]:
+        return [self.convert, self.decode]
+
+    # Returns whether files of the experiment are queued or being processed.
+    def is_busy(self) -> bool:
+        return any(stage.is_busy() for stage in self.get_stages())
+
+
+# Returns the chain of pipeline stages that converts and decodes the files of an experiment, see decode_pipelined. The
+# XMLdig files are converted on an event loop and the trimmed CSVs decoded by the workers of a pool.
+# @param metrics records the converted and decoded files, e.g., those of all experiments of decode_batch
+def __get_pipelined_experiment(dram_type: E_DRAM_TYPE, iter_name: str, loop: EventLoopThread, num_workers: int,
+                               engine: E_DECODE_ENGINE, chunk_size: int, binary: bool, queue_size: int, codec: E_CODEC,
+                               retention: E_RETENTION, cache: DecodeCache, cache_stats: Counter,
+                               metrics: RunMetrics) -> _PipelinedExperiment:
+    assert (iter_name.count("/") == 0 and iter_name.count("\\") == 0), \
+        "iter_name is supposed to be a folder name, not a path!"
+
+    output_dir = get_output_directory(iter_name)
+    manifest = Manifest(get_manifest_path(iter_name))
+    params = __get_manifest_params(dram_type, binary, E_XMLDIG_READER.xmldig2csv)
+    stats = Counter()
+    out_paths = dict()
+    convert_metrics = metrics.get_stage(XMLDIGTOCSV_MANIFEST_STAGE, loop.max_running)
+    decode_metrics = metrics.get_stage(MANIFEST_STAGE, num_workers)
+    file_done = __get_file_done(iter_name, manifest, params, binary, out_paths, stats, cache_stats, cache,
+                                decode_metrics, retention)
+
+    # only decode files whose input changed or whose output is missing or incomplete (e.g., after a crash)
+    def get_decode_item(in_path: Path):
+        out_path = with_codec(output_dir / in_path.name, codec)
+        extra_out_paths = [get_binary_output_path(out_path)] if binary else None
+        if manifest.is_done(MANIFEST_STAGE, in_path, out_path, OUTPUT_VERSION, params, extra_out_paths):
+            printf(f"skipping file {in_path.name} as it has already been converted before")
+            decode_metrics.skipped()
+            return None
+        out_paths[in_path] = out_path
+        decode_metrics.queued(iter_name, in_path.name)
+        return in_path, out_path
+
+    def decoded(result: tuple[tuple[Path, dict, Counter, Counter, bool], TaskTiming]):
+        result, timing = result
+        file_done(*result, timing)
+        return None
+
+    failures = dict()
+    convert = xmldigtocsv__get_pipeline_stage(iter_name, manifest, [], get_decode_item, loop, failures, codec, metrics)
+    decode = PipelineStage(MANIFEST_STAGE,
+                           Measured(functools.partial(__decode_and_write_converted_csv, dram_type, iter_name, engine,
+                                                      chunk_size, binary, cache), metrics.profiler),
+                           decoded, queue_size or num_workers)
+
+    def put_trimmed_csv(in_path: Path):
+        item = get_decode_item(in_path)
+        if item is not None:
+            decode.put(item)
+
+    # the XMLdig files whose trimmed CSVs have been decoded and removed are not converted again
+    is_consumed = get_decoded_check(iter_name, dram_type, binary, codec)
+
+    def put_xmldig(xmldig_path: str):
+        experiment.num_files += 1
+        if not xmldigtocsv__is_converted(iter_name, manifest, xmldig_path, codec, is_consumed):
+            convert_metrics.queued(iter_name, os.path.basename(xmldig_path))
+            convert.put((xmldig_path,))
+            experiment.num_bytes += os.path.getsize(xmldig_path)
+            return
+        printf(f"skipping file {os.path.basename(xmldig_path)} as it has already been converted before")
+        convert_metrics.skipped()
+        # the trimmed CSV may still have to be decoded
+        in_path = Path(xmldigtocsv__get_output_path(iter_name, xmldig_path, codec))
+        if in_path.is_file():
+            put_trimmed_csv(in_path)
+
+    experiment = _PipelinedExperiment(iter_name, manifest, convert, decode, put_xmldig, put_trimmed_csv, stats,
+                                      failures, metrics)
+    return experiment
+
+
+# Queues the XMLdig files of an experiment in XMLDIG_DIR that have not been converted and decoded before, and the
+# trimmed CSVs of previous runs that have not been decoded.
+def __queue_pending_files(experiment: _PipelinedExperiment, dram_type: E_DRAM_TYPE, binary: bool, codec: E_CODEC):
+    iter_name = experiment.iter_name
+    # the largest files first, so that the last ones to finish are small
+    all_xmldig_paths, pending_xmldig_paths = xmldigtocsv__get_pending_xmldig_paths(
+        iter_name, experiment.manifest, codec, get_decoded_check(iter_name, dram_type, binary, codec))
+    pending_xmldig_paths.sort(key=os.path.getsize, reverse=True)
+    convert_metrics = experiment.metrics.stages[XMLDIGTOCSV_MANIFEST_STAGE]
+    for xmldig_path in pending_xmldig_paths:
+        convert_metrics.queued(iter_name, os.path.basename(xmldig_path))
+        experiment.convert.put((xmldig_path,))
+    convert_metrics.skipped(len(all_xmldig_paths) - len(pending_xmldig_paths))
+    experiment.num_files = len(all_xmldig_paths)
+    experiment.num_bytes = sum(os.path.getsize(xmldig_path) for xmldig_path in pending_xmldig_paths)
+
+    # the trimmed CSVs of previous runs that are not converted again may still have to be decoded; converting a file
+    # replaces its trimmed CSV with any codec
+    input_dir = Path(xmldigtocsv__get_output_directory(iter_name))
+    output_dir = get_output_directory(iter_name)
+    converted_names = {os.path.basename(xmldigtocsv__get_output_path(iter_name, p)) for p in pending_xmldig_paths}
+    if input_dir.is_dir():
+        in_paths = [in_path for in_path, _ in get_input_and_output_file_paths(input_dir, output_dir)
+                    if strip_codec_suffix(in_path.name) not in converted_names]
+        for in_path in sorted(in_paths, key=lambda x: x.stat().st_size, reverse=True):
+            experiment.put_trimmed_csv(in_path)
+
+
+# Returns the throughput of converting and decoding files, i.e., the size of the XMLdig files converted and the number
+# of files decoded per second.
+def __format_throughput(num_bytes: int, num_decoded: int, seconds: float) -> str:
+    seconds = max(seconds, 1e-6)
+    return f"{num_bytes / 2 ** 20 / seconds:.1f} MiB/s of XMLdig files, {num_decoded / seconds:.1f} files/s"
+
+
+# Prints the summary of the files of an experiment that have been converted and decoded in a pipeline.
+def __print_pipelined_summary(experiment: _PipelinedExperiment, t_start: float):
+    t_end = time.time()
+    printf(f"xmldig2csv and decoding done for all {experiment.num_files} file(s) of experiment "
+           f"{experiment.iter_name or '.'} ({experiment.convert.num_done} converted, {experiment.decode.num_done} "
+           f"decoded) in {t_end - t_start:.3f} seconds "
+           f"({__format_throughput(experiment.num_bytes, experiment.decode.num_done, t_end - t_start)}).")
+    xmldigtocsv__print_failures(experiment.failures)
+    printf(f"two-cycle commands: {__format_pairing_stats(experiment.stats)}")
+
+
+# Requires the XMLDIG_DIR and DATA_DIR env variables.
+# Converts the XMLdig files of an experiment with xmldig2csv (see xmldigtocsv_all) and decodes the trimmed CSVs (see
+# decode_all) file by file rather than stage by stage: each file is decoded as soon as it has been converted, while
+# the next files are still being converted (see util.pipeline), so the runtime approaches that of the slower stage
+# rather than the sum of both. Each file is decoded by one of num_workers workers, while the xmldig2csv processes are
+# run from an event loop in the main process (see xmldigtocsv__get_pipeline_stage).
+# @param queue_size the maximum number of converted files that wait to be decoded (default: num_workers), which also
+#   bounds the disk space taken by trimmed CSVs that are not decoded yet
+# @param codec the codec the trimmed and the decoded CSVs are compressed with, see util.codec
+# @param retention what happens to the trimmed CSVs once they have been decoded, see util.retention; the conversion is
+#   throttled while the disk budget is exceeded either way
+# @param pool a pool of num_workers workers that is shared (e.g., by the jobs of util.server), or None to start one
+# @param loop an event loop for the xmldig2csv processes that is shared, or None to start one
+# @param metrics records the converted, decoded and skipped files (see util.metrics), or None to not record them
+def decode_pipelined(dram_type: E_DRAM_TYPE, iter_name: str, num_workers: int,
+                     engine: E_DECODE_ENGINE = E_DECODE_ENGINE.regex, chunk_size: int = CHUNK_SIZE,
+                     binary: bool = False, queue_size: int = None, codec: E_CODEC = E_CODEC.none,
+                     retention: E_RETENTION = E_RETENTION.keep, pool: Pool = None,
+                     loop: EventLoopThread = None, metrics: RunMetrics = None) -> None:
+    decode_batch(dram_type, [iter_name], num_workers, engine, chunk_size, binary, queue_size, codec, retention, pool,
+                 loop, metrics=metrics)
+
+
+# Requires the XMLDIG_DIR and DATA_DIR env variables.
+# Converts and decodes the files of several experiments like decode_pipelined, but schedules the files of all of them
+# on the same workers (and the xmldig2csv processes on the same event loop) rather than one experiment after another:
+# the experiments are chains of the same pipeline (see util.pipeline.Pipeline), and the workers are kept busy with the
+# files of the next experiments while the last files of one are still being processed. At most max_active experiments
+# are in the pipeline at once (e.g., so that thousands of small experiments do not open as many manifests); the next
+# one is added as soon as one is done. Prints a summary with the throughput of each experiment once it is done, and of
+# all experiments at the end.
+# @param queue_size the maximum number of converted files of each experiment that wait to be decoded (default:
+#   num_workers)
+# @param max_active the maximum number of experiments in the pipeline at once (default: num_workers, but at least two so
+#   that the last files of one experiment overlap with the first ones of the next)
+# @param metrics records the files of all experiments (see util.metrics), or None to not record them
+def decode_batch(dram_type: E_DRAM_TYPE, iter_names: list[str], num_workers: int,
+                 engine: E_DECODE_ENGINE = E_DECODE_ENGINE.regex, chunk_size: int = CHUNK_SIZE,
+                 binary: bool = False, queue_size: int = None, codec: E_CODEC = E_CODEC.none,
+                 retention: E_RETENTION = E_RETENTION.keep, pool: Pool = None, loop: EventLoopThread = None,
+                 max_active: int = None, metrics: RunMetrics = None) -> None:
+    t_start = time.time()
+    checkenv('DATA_DIR')
+    if metrics is None:
+        metrics = RunMetrics(",".join(iter_names), num_workers)
+    cache = get_decode_cache()
+    cache_stats = Counter()
+    shared_loop = loop
+    if loop is None:
+        loop = EventLoopThread(xmldigtocsv__get_num_jobs(num_workers))
+    pending_iter_names = deque(iter_names)
+    experiments: dict[str, _PipelinedExperiment] = dict()
+    done: list[_PipelinedExperiment] = list()
+    # the time each experiment has been added
+    t_starts: dict[str, float] = dict()
+
+    def finish(experiment: _PipelinedExperiment):
+        pipeline.remove(experiment.get_stages())
+        del experiments[experiment.iter_name]
+        experiment.manifest.close()
+        done.append(experiment)
+        __print_pipelined_summary(experiment, t_starts[experiment.iter_name])
+
+    def add_experiments():
+        while pending_iter_names and len(experiments) < (max_active or max(num_workers, 2)):
+            iter_name = pending_iter_names.popleft()
+            if len(iter_names) > 1:
+                printf(f"decoding experiment: {iter_name}")
+            t_starts[iter_name] = time.time()
+            experiments[iter_name] = experiment = __get_pipelined_experiment(
+                dram_type, iter_name, loop, num_workers, engine, chunk_size, binary, queue_size, codec, retention,
+                cache, cache_stats, metrics)
+            __queue_pending_files(experiment, dram_type, binary, codec)
+            if not experiment.is_busy():
+                finish(experiment)
+                continue
+            pipeline.add(experiment.get_stages(), functools.partial(experiment_done, experiment))
+
+    def experiment_done(experiment: _PipelinedExperiment):
+        finish(experiment)
+        add_experiments()
+
+    # the event loop is started after the workers have been forked
+    with use_shared(pool, lambda: Pool(num_workers)) as p, use_shared(shared_loop, lambda: loop):
+        pipeline = Pipeline(p, num_workers)
+        try:
+            add_experiments()
+            pipeline.run()
+        finally:
+            for experiment in experiments.values():
+                experiment.manifest.close()
+
+    __finish_decoding(cache, cache_stats)
+    if len(iter_names) > 1:
+        t_end = time.time()
+        num_files = sum(experiment.num_files for experiment in done)
+        num_bytes = sum(experiment.num_bytes for experiment in done)
+        num_converted = sum(experiment.convert.num_done for experiment in done)
+        num_decoded = sum(experiment.decode.num_done for experiment in done)
+        printf(f"xmldig2csv and decoding done for all {len(done)} experiment(s) ({num_files} file(s), {num_converted} "
+               f"converted, {num_decoded} decoded) in {t_end - t_start:.3f} seconds "
+               f"({__format_throughput(num_bytes, num_decoded, t_end - t_start)}).")
+
+
+# Requires the XMLDIG_DIR and DATA_DIR env variables.
+# Watches XMLDIG_DIR for XMLdig files (see util.watch) and converts and decodes each of them as soon as it is complete
+# (e.g., saved by the scope), like decode_pipelined, but with the workers kept running in between. The files directly in
+# XMLDIG_DIR belong to the experiment "" (see decode_one.sh), those in a subdirectory to the experiment of its name.
+# Once none of the files of an experiment are left to process and no further ones appeared for settle_time seconds, the
+# experiment is complete: its manifest is compacted and on_settled is called with its name and the pool (e.g., to
+# analyze it on the workers). Runs until interrupted (e.g., by Ctrl+C or SIGTERM).
+# The files of each experiment are recorded in metrics of its own (see util.metrics), which are passed to on_settled
+# (e.g., to record the analysis as well) and written once it returns.
+# @param poll whether to poll XMLDIG_DIR even if inotify is available, see util.watch.get_watcher
+# @param profiler the profiler the files of each experiment are profiled with, see util.metrics.RunMetrics; the main
+#   process is not profiled, as it runs until interrupted
+def decode_watched(dram_type: E_DRAM_TYPE, num_workers: int, engine: E_DECODE_ENGINE = E_DECODE_ENGINE.regex,
+                   chunk_size: int = CHUNK_SIZE, binary: bool = False, queue_size: int = None,
+                   codec: E_CODEC = E_CODEC.none, retention: E_RETENTION = E_RETENTION.keep, poll: bool = False,
+                   settle_time: float = SETTLE_TIME, on_settled: Callable[[str, RunMetrics, Pool], None] = None,
+                   profiler: E_PROFILER = E_PROFILER.off) -> None:
+    checkenv('DATA_DIR')
+    checkenv('XMLDIG_DIR')
+    root = Path(os.getenv('XMLDIG_DIR'))
+    cache = get_decode_cache()
+    cache_stats = Counter()
+    experiments: dict[str, _PipelinedExperiment] = dict()
+    # the time the first file of each experiment has been queued and the time the last one appeared
+    t_starts: dict[str, float] = dict()
+    last_seen: dict[str, float] = dict()
+
+    # the event loop is started after the workers have been forked
+    # a daemon is usually stopped by SIGTERM (e.g., by systemd), which is handled like Ctrl+C; the workers ignore both
+    # and are stopped when the pool is left, see util.pipeline.SignalSafePool
+    with sigterm_interrupts(), get_watcher(root, XMLDIG_SUFFIX, poll) as watcher, SignalSafePool(num_workers) as p, \
+            EventLoopThread(xmldigtocsv__get_num_jobs(num_workers)) as loop:
+        pipeline = Pipeline(p, num_workers)
+        printf(f"watching {root} for XMLdig files ({type(watcher).__name__})")
+
+        def watch(timeout: float) -> bool:
+            for xmldig_path in watcher.wait(timeout):
+                iter_name = "" if xmldig_path.parent == root else xmldig_path.parent.name
+                if iter_name not in experiments:
+                    printf(f"decoding experiment: {iter_name or '.'}")
+                    experiments[iter_name] = __get_pipelined_experiment(
+                        dram_type, iter_name, loop, num_workers, engine, chunk_size, binary, queue_size, codec,
+                        retention, cache, cache_stats, RunMetrics(iter_name or ".", num_workers, profiler))
+                    pipeline.add(experiments[iter_name].get_stages())
+                    t_starts[iter_name] = time.time()
+                experiments[iter_name].put_xmldig(str(xmldig_path))
+                last_seen[iter_name] = time.monotonic()
+
+            for iter_name, experiment in list(experiments.items()):
+                if experiment.is_busy() or time.monotonic() - last_seen[iter_name] < settle_time:
+                    continue
+                pipeline.remove(experiment.get_stages())
+                del experiments[iter_name]
+                experiment.manifest.close()
+                __finish_decoding(cache, cache_stats)
+                __print_pipelined_summary(experiment, t_starts[iter_name])
+                if on_settled is not None and experiment.decode.num_done > 0:
+                    on_settled(iter_name, experiment.metrics, p)
+                experiment.metrics.write()
+            return True
+
+        try:
+            pipeline.run(watch)
+        except KeyboardInterrupt:
+            printf("stopped watching")
+        finally:
+            for experiment in experiments.values():
+                experiment.manifest.close()
+
+
+# Requires the DATA_DIR env variable.
+# Removes the trimmed CSVs of an experiment if all of them have been decoded (with any parameters) and the decoded
+# outputs are still there, according to the manifest of the experiment. The removed trimmed CSVs are recorded in the
+# manifest, so that a rerun does not convert their XMLdig files again unless they have to be decoded again.
+# @param dry_run whether to only return what would be removed
+# Returns the number and the total size of the trimmed CSVs removed, or None if the experiment is not decoded fully.
+def collect_garbage(iter_name: str, dry_run: bool = False) -> tuple[int, int]:
+    checkenv('DATA_DIR')
+    input_dir = Path(xmldigtocsv__get_output_directory(iter_name))
+    output_dir = get_output_directory(iter_name)
+    if not input_dir.is_dir():
+        return 0, 0
+    in_paths = [in_path for in_path, _ in get_input_and_output_file_paths(input_dir, output_dir)]
+
+    # the decoded output may have been written with any codec and parameters, so these are taken from the record
+    def is_decoded(manifest: Manifest, in_path: Path) -> bool:
+        record = manifest.get_record(MANIFEST_STAGE, in_path)
+        # the decoded outputs of XMLdig files that have been read directly do not depend on the trimmed CSVs
+        if record is None or 'xmldig_reader' in record['params']:
+            return False
+        for codec in E_CODEC:
+            out_path = with_codec(output_dir / in_path.name, codec)
+            extra_out_paths = [get_binary_output_path(out_path)] if record['params'].get('binary') else None
+            if manifest.is_done(MANIFEST_STAGE, in_path, out_path, OUTPUT_VERSION, record['params'], extra_out_paths):
+                return True
+        return False
+
+    with Manifest(get_manifest_path(iter_name)) as manifest:
+        if not all(is_decoded(manifest, in_path) for in_path in in_paths):
+            return None
+        size = sum(in_path.stat().st_size for in_path in in_paths)
+        if not dry_run:
+            for in_path in in_paths:
+                xmldigtocsv__remove_output(manifest, in_path)
+    return len(in_paths), size
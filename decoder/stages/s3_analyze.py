@@ -1,38 +1,70 @@
 import os
 from pathlib import Path
+import shutil
 import subprocess
 import time
 
 from multiprocessing import Pool
 from stages.s2_decode import get_output_directory as decoded__get_output_directory
+from util.codec import open_file, strip_codec_suffix
 from util.decoded_cmd import DecodedCommand
 from util.dram_command import E_DDR5_DRAM_CMD
+from util.manifest import Manifest, atomic_open, describe_input, get_manifest_path
+from util.metrics import Measured, RunMetrics
+from util.pipeline import use_shared
 from util.py_helper import checkenv, printf
 from collections import defaultdict
+import hashlib
+
+
+# The version of the analysis output; bump it whenever the output changes for the same input (see Manifest).
+OUTPUT_VERSION = 1
+
+# The name of this stage in the manifest of an experiment.
+MANIFEST_STAGE = "analyze"
 
 
 def get_output_directory(experiment_name: str):
    return os.path.join(os.getenv('DATA_DIR'), 'analyzed', experiment_name)
 
+# Returns the decoded CSVs (compressed or not, see util.codec) of an experiment.
+def __get_decoded_csv_paths(exp_name: str) -> list:
+   decoded_path = decoded__get_output_directory(exp_name)
+   # ignore hidden files, e.g., the temporary files of outputs that are still being written, and the binary outputs
+   return [os.path.join(decoded_path, b) for b in os.listdir(decoded_path)
+           if not b.startswith('.') and strip_codec_suffix(b).endswith('.csv')]
+
+# Returns the output path of the analysis of a decoded CSV; the analysis is never compressed.
+def __get_analysis_output_path(exp_name: str, csv_path: str) -> str:
+   return os.path.join(get_output_directory(exp_name), strip_codec_suffix(os.path.basename(csv_path)))
+
+# Returns the output of a shell command that reads all decoded CSVs of an experiment from its stdin (i.e., like
+# "cat *.csv | cmd", but with the compressed files decompressed).
+def __run_on_decoded_csvs(exp_name: str, cmd: str) -> str:
+   proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+   # the command only writes its output once it has read all input (sort), so it cannot block on a full stdout
+   try:
+      for csv_path in sorted(__get_decoded_csv_paths(exp_name)):
+         with open_file(csv_path, "r") as f:
+            shutil.copyfileobj(f, proc.stdin)
+   finally:
+      proc.stdin.close()
+   out = proc.stdout.read()
+   if proc.wait() != 0:
+      raise subprocess.CalledProcessError(proc.returncode, cmd, out)
+   return out
+
 def __analyze_single_csv(experimentname: str, csv_path: str, pool: Pool) -> dict:
    # Compute the output path and create the parent dir if necessary
-   basename = os.path.basename(csv_path)
-   outpath = os.path.join(os.getenv('DATA_DIR'), 'analyzed', experimentname, \
-      '.'.join(os.path.basename(csv_path).split('.')[:-1]) + '.csv')
-   
-    # Check existence of the output path
-   if os.path.exists(outpath):
-      printf(f"skipping file {basename} as it has already been converted before")
-      exit(0);
+   outpath = __get_analysis_output_path(experimentname, csv_path)
    Path(os.path.dirname(outpath)).mkdir(parents=True, exist_ok=True)
 
    exp_acts_within_refsb = list()
 
    # figure out the <bg,bk,rows> we want to check for, i.e., the ones that have
    # been accessed most frequently
-   dir = decoded__get_output_directory(experimentname)
-   cmd = f'cat {dir}/*.csv | grep "act" | cut -d, -f3-5 | sort -nr | uniq -c | sort -r -t, -k1 -n | tr -s "  " " " | sed "s/ /,/g" | sed "s/^,//g"'
-   out = subprocess.check_output(cmd, shell=True, universal_newlines=True)
+   cmd = f'grep "act" | cut -d, -f3-5 | sort -nr | uniq -c | sort -r -t, -k1 -n | tr -s "  " " " | sed "s/ /,/g" | sed "s/^,//g"'
+   out = __run_on_decoded_csvs(experimentname, cmd)
 
    last_key = None
    last_count = None
@@ -72,7 +104,7 @@ def __analyze_single_csv(experimentname: str, csv_path: str, pool: Pool) -> dict
    target_bg, target_bk = last_key.split(',')
 
    line_cnt = 0
-   with open(csv_path, "r") as file:
+   with open_file(csv_path, "r") as file:
       while True:
          line = file.readline()
          # stop if we finished reading all lines
@@ -125,24 +157,47 @@ def __analyze_single_csv(experimentname: str, csv_path: str, pool: Pool) -> dict
      'num_expected_addrs': len(exp_addrs)
    }
 
-def analyze_all(exp_name: str, num_workers: int) -> None:
+# The analysis of each file depends on the addresses accessed in all decoded files, so any change of the decoded files
+# makes all analyses stale. Returns a digest of the names, sizes and modification times of the decoded files.
+def __get_decoded_files_digest(csv_paths: list) -> str:
+   h = hashlib.sha256()
+   for csv_path in sorted(csv_paths):
+      st = os.stat(csv_path)
+      h.update(f"{os.path.basename(csv_path)},{st.st_size},{st.st_mtime_ns}\n".encode())
+   return h.hexdigest()
+
+# @param pool a pool of num_workers workers that is shared (e.g., by the jobs of util.server), or None to start one
+# @param metrics records the analyzed and skipped files (see util.metrics), or None to not record them
+def analyze_all(exp_name: str, num_workers: int, pool: Pool = None, metrics: RunMetrics = None) -> None:
    t_start = time.time()
 
    checkenv('DATA_DIR')
+   if metrics is None:
+      metrics = RunMetrics(exp_name, num_workers)
+   # the files are analyzed one after another
+   stage_metrics = metrics.get_stage(MANIFEST_STAGE, 1)
 
-   decoded_path = decoded__get_output_directory(exp_name)
-   csv_paths = list(map(lambda b: os.path.join(decoded_path, b), os.listdir(decoded_path)))
+   csv_paths = __get_decoded_csv_paths(exp_name)
 
    assert (exp_name.count('/') == 0 and exp_name.count("\\") == 0), \
       "exp_name is supposed to be a folder name, not a path!"
 
+   manifest = Manifest(get_manifest_path(exp_name))
+   params = {'decoded_files': __get_decoded_files_digest(csv_paths)}
+
    # Run in parallel
-   with Pool(num_workers) as p:
+   with manifest, use_shared(pool, lambda: Pool(num_workers)) as p:
       for csv_path in csv_paths:
-         analysis_result = __analyze_single_csv(exp_name, csv_path, p)
+         outpath = __get_analysis_output_path(exp_name, csv_path)
+         # only analyze files whose input changed or whose output is missing or incomplete (e.g., after a crash)
+         if manifest.is_done(MANIFEST_STAGE, Path(csv_path), Path(outpath), OUTPUT_VERSION, params):
+            printf(f"skipping file {os.path.basename(csv_path)} as it has already been converted before")
+            stage_metrics.skipped()
+            continue
+         in_info = describe_input(Path(csv_path))
+         analysis_result, timing = Measured(__analyze_single_csv, metrics.profiler)(exp_name, csv_path, p)
          # write analysis to file
-         outpath = os.path.join(get_output_directory(exp_name), os.path.basename(csv_path))
-         with open(outpath, "w") as f:
+         with atomic_open(Path(outpath)) as f:
             for prop, value in analysis_result.items():
                if type(value) == list:
                   for v in value:
@@ -150,6 +205,8 @@ def analyze_all(exp_name: str, num_workers: int) -> None:
                      f.write(f"{prop},{v}\n")
                else:
                   f.write(f"{prop},{value}\n")
+         manifest.record(MANIFEST_STAGE, Path(csv_path), in_info, Path(outpath), OUTPUT_VERSION, params)
+         stage_metrics.record(exp_name, os.path.basename(csv_path), timing, in_info['size'], os.path.getsize(outpath))
    t_end = time.time()
 
    printf(f"analysis done for all {len(csv_paths)} file(s) in {t_end - t_start:.3f} seconds.")
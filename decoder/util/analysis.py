@@ -9,16 +9,15 @@ import time
 import pint
 import pickle
 import pint as pt
+import numpy as np
 import pandas as pd
 
 from collections import defaultdict
 from enum import Enum
-from pandarallel import pandarallel
 from typing import List, Optional
 
-from configure import SETUP_FILENAME
-from util.dram_command import E_DDR5_DRAM_CMD, DDR5_DRAM_COMMANDS, DramCommand
-from configuration.constants import ValueStr
+from util.dram_command import E_DDR5_DRAM_CMD, DDR5_DRAM_COMMANDS, DramCommand, DramCommandTable
+from configuration.constants import SETUP_FILENAME, ValueStr
 from util.py_helper import printf
 from util.units import Units
 
@@ -65,19 +64,17 @@ class BankStatus(Enum):
     WRITING_AP = 7
 
 
-def get_dram_cmd_dataframe(filter_cmds: List[E_DDR5_DRAM_CMD] = None) -> pd.DataFrame:
-    # create dataframe with collected keys
-    all_dfs = list()
+# Returns the lookup table of all (sub-)commands to be decoded, in the order of DDR5_DRAM_COMMANDS.
+# If several of them match a cycle (e.g., WR1 and WRA1), the first one is taken.
+def get_dram_cmd_table(filter_cmds: List[E_DDR5_DRAM_CMD] = None) -> DramCommandTable:
+    cmds = list()
     for k in DDR5_DRAM_COMMANDS:
         cmd_list = k.cmds if k.is_two_cycle_cmd else [k]
         for c in cmd_list:
             if filter_cmds is not None and c.identifier not in filter_cmds:
                 continue
-            signals = c.requirements
-            signals['name'] = c.identifier
-            # noinspection PyTypeChecker
-            all_dfs.append(pd.DataFrame.from_dict([signals], dtype=object))
-    return pd.concat(all_dfs)
+            cmds.append(c)
+    return DramCommandTable(cmds, check_ambiguity=False)
 
 
 def get_all_dram_cmds() -> dict:
@@ -151,14 +148,10 @@ def extract_setup_file_values(input_dir_wo_csv_filter: str, stats: dict) -> None
     print("")
 
 
-def match_dram_cmd(x: pd.Series, label_unknown: str, dram_cmds: pd.DataFrame):
-    # noinspection PyUnresolvedReferences
-    import pandas  # needed for pandarallel as function must be self-contained
-    for _, row in dram_cmds.iterrows():
-        row_wo_na_name = row.dropna().drop('name')
-        v_view = x[row_wo_na_name.index]
-        if row_wo_na_name.astype(int).equals(v_view):
-            return row['name']
+def match_dram_cmd(x: pd.Series, label_unknown: str, cmd_table: DramCommandTable):
+    cmd_id = cmd_table.match_signals(x)
+    if cmd_id >= 0:
+        return cmd_table.dram_cmds[cmd_id].identifier
     # let's keep the 'cmd' column empty for signals that might be part of a two-cycle command,
     # i.e., second cycle where CS==1
     return label_unknown if x['CS'] != 1 else ""
@@ -644,7 +637,7 @@ def create_two_cycle_cmd(cmd: DramCommand, cmd_metadata: dict, pending_cmds: lis
 
 
 def load_preprocess_write_pickle(file_path: str, file_name: str, ignore_pickle: bool, stats: dict,
-                                 u: Units, dram_cmds_decode: pd.DataFrame, write_pickle: bool):
+                                 u: Units, dram_cmds_decode: DramCommandTable, write_pickle: bool):
     file_parent_dir = os.path.dirname(file_path)
     file_pickle_name = f"{file_name.replace('.csv', '')}_{PICKLE_SUFFIX}"
     file_pickle_path = os.path.join(file_parent_dir, file_pickle_name)
@@ -682,7 +675,7 @@ def analyze_trace(input_path: str, file_filter: str, dimm_cfg: dict, out_file: s
 
     # get all DRAM commands that we want to decode
     # all commands except the second cycle of 2-cycle commands (as they are not distinguishable by their signals only)
-    dram_cmds_decode = get_dram_cmd_dataframe(
+    dram_cmds_decode = get_dram_cmd_table(
         [E_DDR5_DRAM_CMD.act1, E_DDR5_DRAM_CMD.pre_ab, E_DDR5_DRAM_CMD.pre_sb, E_DDR5_DRAM_CMD.pre_pb, E_DDR5_DRAM_CMD.ref_ab,
          E_DDR5_DRAM_CMD.ref_sb,
          E_DDR5_DRAM_CMD.rfm_sb, E_DDR5_DRAM_CMD.rfm_ab, E_DDR5_DRAM_CMD.wr, E_DDR5_DRAM_CMD.wr1, E_DDR5_DRAM_CMD.wra, E_DDR5_DRAM_CMD.wra1,
@@ -953,9 +946,7 @@ def initialize_bank_status(bank_status: dict, dimm_cfg: dict):
         }
 
 
-def preprocess_decode(dram_cmds: pd.DataFrame, parsed: pd.DataFrame) -> (pd.DataFrame, float, float):
-    pandarallel.initialize(nb_workers=os.cpu_count() - 2, verbose=False)
-
+def preprocess_decode(cmd_table: DramCommandTable, parsed: pd.DataFrame) -> (pd.DataFrame, float, float):
     # update the timestamp to make it always increasing and start by 0
     # as we still use the original timestamp to check for tRFC, we do not overwrite it but add another column
     smallest = abs(parsed['Time'].min(axis=0))
@@ -963,13 +954,15 @@ def preprocess_decode(dram_cmds: pd.DataFrame, parsed: pd.DataFrame) -> (pd.Data
 
     printf(f"decoding signals to DRAM commands")
 
-    # create a new column that we compute with apply/apply_parallel to determine the decoded command for each row
-    # this ignores tRFC constraints, i.e., some commands must later be discarded
-
-    # columns to consider for command decoding
-    cols = ['CS', 'CA0', 'CA1', 'CA2', 'CA3', 'CA4', 'CA6', 'CA7', 'CA8', 'CA9', 'CA10', 'CA11', 'CA12']
+    # create a new column with the decoded command of each row, looked up in the command table for all rows at once
+    # (same result as match_dram_cmd); this ignores tRFC constraints, i.e., some commands must later be discarded
+    word, known = cmd_table.pack(parsed)
+    cmd_ids = cmd_table.first_command(cmd_table.lookup_first_cycle(word, known))
+    identifiers = np.array([c.identifier for c in cmd_table.dram_cmds] + [None], dtype=object)
+    # let's keep the 'cmd' column empty for signals that might be part of a two-cycle command (see match_dram_cmd)
+    not_matched = np.where(parsed['CS'].to_numpy() != 1, lbl_dram_cmd_unknown, "").astype(object)
     pd.options.mode.chained_assignment = None  # default='warn'
-    parsed.loc[:, 'cmd'] = parsed[cols].parallel_apply(match_dram_cmd, axis=1, args=(lbl_dram_cmd_unknown, dram_cmds,))
+    parsed.loc[:, 'cmd'] = np.where(cmd_ids >= 0, identifiers[cmd_ids], not_matched)
     pd.options.mode.chained_assignment = 'warn'
 
     # FIXME add this again
@@ -0,0 +1,97 @@
+import bz2
+import gzip
+import io
+import lzma
+
+from enum import Enum
+from pathlib import Path
+
+# The compression level of gzip; the trimmed CSVs compress well already at lower levels, which are much faster.
+GZIP_COMPRESS_LEVEL = 6
+
+
+# The codecs that the outputs of the stages (i.e., the trimmed and the decoded CSVs) can be compressed with. Readers
+# detect the codec of a file by its extension (see CODEC_SUFFIXES), so compressed and uncompressed files can be mixed.
+class E_CODEC(Enum):
+    none = "none"
+    gzip = "gzip"
+    lzma = "lzma"
+    bz2 = "bz2"
+
+
+# The extension that is appended to the name of a file compressed with a codec, e.g., trace--00000.csv.gz.
+CODEC_SUFFIXES = {
+    E_CODEC.none: "",
+    E_CODEC.gzip: ".gz",
+    E_CODEC.lzma: ".xz",
+    E_CODEC.bz2: ".bz2",
+}
+
+
+# Returns the codec of a file by its extension.
+def get_codec(path) -> E_CODEC:
+    name = Path(path).name
+    for codec, suffix in CODEC_SUFFIXES.items():
+        if suffix and name.endswith(suffix):
+            return codec
+    return E_CODEC.none
+
+
+# Returns the name of a file without the extension of its codec, e.g., trace--00000.csv for trace--00000.csv.gz.
+def strip_codec_suffix(name: str) -> str:
+    suffix = CODEC_SUFFIXES[get_codec(name)]
+    return name[:len(name) - len(suffix)]
+
+
+# Returns the path of a file compressed with a codec, e.g., trace--00000.csv.gz for trace--00000.csv and gzip. The path
+# may have the extension of another codec, which is replaced.
+def with_codec(path: Path, codec: E_CODEC) -> Path:
+    path = Path(path)
+    return path.with_name(strip_codec_suffix(path.name) + CODEC_SUFFIXES[codec])
+
+
+# Removes the files that hold the same content as a path but are compressed with another codec (e.g., the output of a
+# previous run with another codec), so that readers do not find the same file twice.
+def remove_other_codecs(path: Path):
+    path = Path(path)
+    for codec in E_CODEC:
+        other_path = with_codec(path, codec)
+        if other_path != path:
+            other_path.unlink(missing_ok=True)
+
+
+# gzip.GzipFile writes the name and modification time of the file into its header. This one does not, so the same
+# content is always compressed to the same bytes (e.g., for the hashes of the manifest and the decode cache).
+class _GzipFile(gzip.GzipFile):
+    def __init__(self, path: Path, mode: str):
+        self.__file = open(path, mode)
+        try:
+            super().__init__(filename="", mode=mode, compresslevel=GZIP_COMPRESS_LEVEL, fileobj=self.__file, mtime=0)
+        except BaseException:
+            self.__file.close()
+            raise
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.__file.close()
+
+
+# Opens a file like open(), but (de)compresses it with its codec, i.e., the content is streamed through the codec
+# rather than decompressed at once.
+# @param codec the codec of the file; by default, it is detected by the extension of the path
+def open_file(path: Path, mode: str = "r", codec: E_CODEC = None):
+    if codec is None:
+        codec = get_codec(path)
+    if codec == E_CODEC.none:
+        return open(path, mode)
+
+    binary_mode = mode.replace("t", "").replace("b", "") + "b"
+    if codec == E_CODEC.gzip:
+        f = _GzipFile(path, binary_mode)
+    elif codec == E_CODEC.lzma:
+        f = lzma.LZMAFile(path, binary_mode)
+    else:
+        f = bz2.BZ2File(path, binary_mode)
+    return f if "b" in mode else io.TextIOWrapper(f)
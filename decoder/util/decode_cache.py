@@ -0,0 +1,116 @@
+import hashlib
+import os
+import shutil
+
+from pathlib import Path
+
+from util.codec import CODEC_SUFFIXES, get_codec
+from util.dram_command import E_DRAM_TYPE, get_commands_fingerprint
+from util.manifest import atomic_output
+
+# The default size limit of the cache (in MiB), see DECODE_CACHE_MAX_SIZE.
+DEFAULT_MAX_SIZE_MB = 10 * 1024
+
+# Suffix of cache entries that hold a decoded CSV (other outputs use their own suffix). Compressed CSVs are stored as
+# they are, i.e., with the extension of their codec appended (see util.codec).
+ENTRY_SUFFIX = ".csv"
+
+# Suffix of cache entries for inputs in which no command was decoded (i.e., no output file is written).
+EMPTY_ENTRY_SUFFIX = ".empty"
+
+
+# A content-addressed cache of decoded CSV files that can be shared between experiments and hosts (e.g., on a network
+# file system). An entry is stored under a key derived from the hash of the trimmed CSV and everything else the
+# decoded output depends on, so it can be reused no matter where the input came from.
+# Each entry's modification time is its last use; once the cache exceeds its size limit, the least recently used
+# entries are evicted.
+class DecodeCache:
+    def __init__(self, cache_dir: Path, max_size: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+
+    # Returns the key of a decoded output.
+    # @param input_sha256 the hash of the trimmed CSV (see describe_input)
+    # @param output_version the version of the decoded output format
+    # @param reader_version the version of the reader of the input if it is not a trimmed CSV (see E_XMLDIG_READER)
+    @staticmethod
+    def get_key(input_sha256: str, dram_type: E_DRAM_TYPE, use_2n_mode: bool, output_version: int,
+                reader_version: int = None) -> str:
+        key = f"{input_sha256},{dram_type.value},{use_2n_mode},{get_commands_fingerprint(dram_type)},{output_version}"
+        if reader_version is not None:
+            key += f",{reader_version}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def __get_entry_path(self, key: str, suffix: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{suffix}"
+
+    # Copies the cached output of a key to out_path (or removes out_path if no command was decoded).
+    # Returns whether the key was found.
+    # @param suffix distinguishes several outputs of the same input (e.g., the binary format); by default, that of a
+    #   decoded CSV compressed like out_path
+    def fetch(self, key: str, out_path: Path, suffix: str = None) -> bool:
+        suffix = suffix or _get_csv_entry_suffix(out_path)
+        for entry_suffix in [suffix, EMPTY_ENTRY_SUFFIX]:
+            entry_path = self.__get_entry_path(key, entry_suffix)
+            try:
+                if entry_suffix == suffix:
+                    with atomic_output(out_path) as tmp_path:
+                        shutil.copyfile(entry_path, tmp_path)
+                else:
+                    entry_path.stat()
+                    # remove the output of a previous run that is now stale
+                    out_path.unlink(missing_ok=True)
+                # mark the entry as recently used
+                os.utime(entry_path)
+                return True
+            except FileNotFoundError:
+                # the entry does not exist (or was just evicted)
+                continue
+        return False
+
+    # Stores out_path (or, if it does not exist, the fact that no command was decoded) under a key.
+    def store(self, key: str, out_path: Path, suffix: str = None):
+        out_path = Path(out_path)
+        suffix = suffix or _get_csv_entry_suffix(out_path)
+        if out_path.is_file():
+            with atomic_output(self.__get_entry_path(key, suffix)) as tmp_path:
+                shutil.copyfile(out_path, tmp_path)
+        else:
+            with atomic_output(self.__get_entry_path(key, EMPTY_ENTRY_SUFFIX)) as tmp_path:
+                tmp_path.touch()
+
+    # Removes the least recently used entries until the cache fits its size limit.
+    # Returns the number of removed entries.
+    def evict(self) -> int:
+        entries = list()
+        for entry_path in self.cache_dir.glob("*/*"):
+            if entry_path.name.startswith('.'):
+                continue
+            try:
+                st = entry_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry_path))
+        total_size = sum(size for _, size, _ in entries)
+        num_evicted = 0
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            entry_path.unlink(missing_ok=True)
+            total_size -= size
+            num_evicted += 1
+        return num_evicted
+
+
+# Returns the suffix of the cache entry that holds a decoded CSV, see ENTRY_SUFFIX.
+def _get_csv_entry_suffix(out_path: Path) -> str:
+    return ENTRY_SUFFIX + CODEC_SUFFIXES[get_codec(out_path)]
+
+
+# Returns the decode cache configured by the DECODE_CACHE_DIR env variable (and, optionally, its size limit in MiB by
+# DECODE_CACHE_MAX_SIZE), or None if no cache is configured.
+def get_decode_cache():
+    if 'DECODE_CACHE_DIR' not in os.environ:
+        return None
+    max_size_mb = int(os.getenv('DECODE_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE_MB))
+    return DecodeCache(Path(os.getenv('DECODE_CACHE_DIR')), max_size_mb * 1024 * 1024)
@@ -1,6 +1,20 @@
+import numpy as np
+
+from array import array
 from dataclasses import dataclass
+from typing import Iterator
+
+from util.dram_command import DRAM_COMMANDS, E_DRAM_CMD, E_DRAM_TYPE
+
+# The address fields of a DecodedCommand; each is a bit string (MSB first) in which unknown bits are 'X'.
+ADDRESS_FIELDS = ['bg', 'bk', 'row', 'col']
 
-from util.dram_command import E_DRAM_CMD
+# The typecode of the value and unknown-bit mask of each address field in a DecodedCommandBatch.
+ADDRESS_FIELD_TYPECODES = {'bg': 'B', 'bk': 'B', 'row': 'I', 'col': 'I'}
+
+# The format of the timestamps in the trimmed CSV files (see xmldig2csv). Timestamps that are not reproduced by this
+# format are kept as strings by DecodedCommandBatch.
+TIMESTAMP_FORMAT = "{:.12e}"
 
 
 @dataclass
@@ -47,11 +61,162 @@ class DecodedCommand:
         return False
 
     def equals(self, other, ignore_timestamp: bool = True) -> bool:
-        other_ts_bak = other.timestamp_sec
-        if ignore_timestamp:
-            other.timestamp_sec = self.timestamp_sec
-        result = (self == other)
-        other.timestamp_sec = other_ts_bak
+        if not ignore_timestamp:
+            return self == other
+        return isinstance(other, DecodedCommand) \
+            and self.cmd == other.cmd \
+            and self.bg == other.bg \
+            and self.bk == other.bk \
+            and self.row == other.row \
+            and self.col == other.col
+
+
+# Returns the names of the commands of a DRAM type; a command's code is its index in this list.
+def get_command_names(dram_type: E_DRAM_TYPE) -> list[str]:
+    return [e.name for e in type(DRAM_COMMANDS[dram_type][0].identifier)]
+
+
+# Parses a bit string like '01X1' into its value, the mask of its unknown bits, and its width.
+def parse_bits(bits: str) -> tuple[int, int, int]:
+    assert len(bits) <= 32, f"address field '{bits}' does not fit into 32 bits"
+    value, xmask = 0, 0
+    for c in bits:
+        value <<= 1
+        xmask <<= 1
+        if c == '1':
+            value |= 1
+        elif c != '0':
+            xmask |= 1
+    return value, xmask, len(bits)
+
+
+# Formats an address field like DecodedCommand does, i.e., as a bit string (MSB first) with 'X' for unknown bits.
+def format_bits(value: int, xmask: int, width: int) -> str:
+    return ''.join('X' if (xmask >> i) & 1 else str((value >> i) & 1) for i in reversed(range(width)))
+
+
+# The decoded commands of a file (or a chunk of it) stored in parallel typed arrays rather than one DecodedCommand per
+# command, i.e., about 40 bytes per command:
+#   timestamp_sec    the timestamp as a float (see TIMESTAMP_FORMAT)
+#   cycle            the cycle count since the start of the CSV file
+#   cmd              the command code, see get_command_names
+#   <field>          the value of an address field (see ADDRESS_FIELDS); unknown bits are 0
+#   <field>_xmask    the mask of the unknown bits of an address field
+#   <field>_width    the number of bits of an address field (0 if the command has no such field)
+# Indexing or iterating a batch returns DecodedCommand objects, so code that works on those keeps working.
+class DecodedCommandBatch:
+    def __init__(self, dram_type: E_DRAM_TYPE):
+        self.dram_type = dram_type
+        self.cmd_names = get_command_names(dram_type)
+        self.__cmd_enum = type(DRAM_COMMANDS[dram_type][0].identifier)
+        self.__cmd_codes = {name: code for code, name in enumerate(self.cmd_names)}
+        self.columns: dict[str, array] = {'timestamp_sec': array('d'), 'cycle': array('q'), 'cmd': array('B')}
+        for f, typecode in ADDRESS_FIELD_TYPECODES.items():
+            self.columns[f] = array(typecode)
+            self.columns[f"{f}_xmask"] = array(typecode)
+            self.columns[f"{f}_width"] = array('B')
+        # the timestamps (by index) that are not reproduced by TIMESTAMP_FORMAT
+        self.timestamp_strs: dict[int, str] = dict()
+
+    def __len__(self):
+        return len(self.columns['cmd'])
+
+    def __append_timestamp(self, timestamp_sec: str):
+        try:
+            ts = float(timestamp_sec)
+        except (TypeError, ValueError):
+            ts = float('nan')
+        if TIMESTAMP_FORMAT.format(ts) != timestamp_sec:
+            self.timestamp_strs[len(self.columns['timestamp_sec'])] = timestamp_sec
+        self.columns['timestamp_sec'].append(ts)
+
+    def append(self, timestamp_sec: str, cmd: E_DRAM_CMD, metadata: dict, cycle: int):
+        columns = self.columns
+        self.__append_timestamp(timestamp_sec)
+        columns['cycle'].append(cycle)
+        columns['cmd'].append(self.__cmd_codes[cmd.name])
+        for f in ADDRESS_FIELDS:
+            value, xmask, width = parse_bits(metadata.get(f, ''))
+            columns[f].append(value)
+            columns[f"{f}_xmask"].append(xmask)
+            columns[f"{f}_width"].append(width)
+
+    # Appends commands whose metadata is given as arrays, i.e., without a metadata dict per command.
+    # @param cmd_codes the command codes, see get_command_names
+    # @param fields for each address field, the values, unknown-bit masks and widths of the commands
+    def append_arrays(self, timestamp_secs: list[str], cmd_codes: np.ndarray, cycles: np.ndarray,
+                      fields: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]]):
+        for timestamp_sec in timestamp_secs:
+            self.__append_timestamp(timestamp_sec)
+        self.columns['cycle'].extend(np.asarray(cycles, dtype=np.int64).tolist())
+        self.columns['cmd'].extend(np.asarray(cmd_codes, dtype=np.uint8).tolist())
+        for f in ADDRESS_FIELDS:
+            for name, values in zip([f, f"{f}_xmask", f"{f}_width"], fields[f]):
+                self.columns[name].extend(values.tolist())
+
+    def append_command(self, cmd: DecodedCommand):
+        self.append(cmd.timestamp_sec, self.__cmd_enum[cmd.cmd], {f: getattr(cmd, f) for f in ADDRESS_FIELDS},
+                    cmd.cycle)
+
+    # Appends all commands of another batch.
+    def extend(self, other: "DecodedCommandBatch"):
+        offset = len(self)
+        for name, values in self.columns.items():
+            values.extend(other.columns[name])
+        self.timestamp_strs.update({offset + i: ts for i, ts in other.timestamp_strs.items()})
+
+    # Returns a new batch with the commands at the given indices (in the given order).
+    def select(self, indices) -> "DecodedCommandBatch":
+        indices = np.asarray(indices, dtype=np.int64)
+        batch = DecodedCommandBatch(self.dram_type)
+        for name, values in self.columns.items():
+            batch.columns[name] = array(values.typecode, self.array(name)[indices].tobytes())
+        positions = {int(i): j for j, i in enumerate(indices)}
+        batch.timestamp_strs = {positions[i]: ts for i, ts in self.timestamp_strs.items() if i in positions}
+        return batch
+
+    # Returns a column as a NumPy array (without copying it).
+    def array(self, name: str) -> np.ndarray:
+        values = self.columns[name]
+        if len(values) == 0:
+            return np.zeros(0, dtype=values.typecode)
+        return np.frombuffer(values, dtype=values.typecode)
+
+    # Returns the timestamps in (integer) picoseconds.
+    def timestamp_ps(self) -> np.ndarray:
+        return np.round(self.array('timestamp_sec') * 1e12).astype(np.int64)
+
+    # Returns, for each command, whether it equals the preceding one like DecodedCommand.equals does (i.e., ignoring
+    # the timestamp). The first command is compared to the last command of prev, or never equal if prev is None.
+    def equals_previous(self, prev: "DecodedCommandBatch" = None) -> np.ndarray:
+        result = np.ones(len(self), dtype=bool)
+        if len(self) == 0:
+            return result
+        for name in self.columns:
+            if name in ['timestamp_sec', 'cycle']:
+                continue
+            values = self.array(name)
+            result[1:] &= (values[1:] == values[:-1])
+            if prev is not None:
+                result[0] &= bool(values[0] == prev.array(name)[-1])
+        if prev is None:
+            result[0] = False
         return result
 
+    def __getitem__(self, i: int) -> DecodedCommand:
+        columns = self.columns
+        metadata = dict()
+        for f in ADDRESS_FIELDS:
+            width = columns[f"{f}_width"][i]
+            if width > 0:
+                metadata[f] = format_bits(columns[f][i], columns[f"{f}_xmask"][i], width)
+        timestamp_sec = self.timestamp_strs[i] if i in self.timestamp_strs \
+            else TIMESTAMP_FORMAT.format(columns['timestamp_sec'][i])
+        return DecodedCommand(timestamp_sec, self.__cmd_enum[self.cmd_names[columns['cmd'][i]]], metadata,
+                              columns['cycle'][i])
+
+    def __iter__(self) -> Iterator[DecodedCommand]:
+        for i in range(len(self)):
+            yield self[i]
+
 
@@ -0,0 +1,189 @@
+import json
+import mmap
+import struct
+
+import numpy as np
+
+from array import array
+from pathlib import Path
+from typing import Iterable
+
+from util.decoded_cmd import ADDRESS_FIELDS, DecodedCommand, DecodedCommandBatch, format_bits, get_command_names, \
+    parse_bits
+from util.dram_command import DRAM_COMMANDS, E_DRAM_TYPE
+from util.manifest import atomic_open
+
+# The file extension of decoded traces in the binary format.
+BINARY_SUFFIX = ".cmds"
+
+# The first bytes of every file in the binary format.
+MAGIC = b"DRAMCMDS"
+
+# Version of the binary format; readers refuse files of other versions.
+FORMAT_VERSION = 1
+
+# Columns are aligned to this many bytes (relative to the start of the file).
+ALIGNMENT = 8
+
+# Stored as the timestamp of commands whose timestamp could not be parsed.
+TIMESTAMP_UNKNOWN = np.iinfo(np.int64).min
+
+# The columns of the format (name, array typecode, NumPy dtype):
+#   timestamp_ps       the timestamp in picoseconds (see TIMESTAMP_UNKNOWN)
+#   cycle              the cycle count since the start of the trimmed CSV
+#   cmd                the command code, i.e., the index of the command in the header's cmds list
+#   <field>            the value of an address field; unknown bits are 0
+#   <field>_xmask      the mask of the unknown bits of an address field
+#   <field>_width      the number of bits of an address field (0 if the command has no such field)
+COLUMNS = [('timestamp_ps', 'q', np.int64), ('cycle', 'q', np.int64), ('cmd', 'B', np.uint8)] \
+    + [c for f in ADDRESS_FIELDS for c in [(f, 'I', np.uint32), (f"{f}_xmask", 'I', np.uint32),
+                                           (f"{f}_width", 'B', np.uint8)]]
+
+
+# Returns the timestamp of a DecodedCommand in picoseconds.
+def _parse_timestamp_ps(timestamp_sec: str) -> int:
+    try:
+        return round(float(timestamp_sec) * 1e12)
+    except (TypeError, ValueError):
+        return int(TIMESTAMP_UNKNOWN)
+
+
+# Collects decoded commands in typed arrays and writes them in the binary columnar format:
+#   MAGIC | header length (uint32, little endian) | JSON header | columns
+# The JSON header holds the format version, the DRAM type, the command names, the number of commands, and the offset
+# and dtype of each column. Each column is a contiguous little-endian array of one value per command.
+class DecodedTraceWriter:
+    def __init__(self, dram_type: E_DRAM_TYPE):
+        self.dram_type = dram_type
+        self.cmd_names = get_command_names(dram_type)
+        self.__cmd_codes = {name: code for code, name in enumerate(self.cmd_names)}
+        self.__columns = {name: array(typecode) for name, typecode, _ in COLUMNS}
+
+    def __len__(self):
+        return len(self.__columns['cmd'])
+
+    def add(self, cmd: DecodedCommand):
+        columns = self.__columns
+        columns['timestamp_ps'].append(_parse_timestamp_ps(cmd.timestamp_sec))
+        columns['cycle'].append(int(cmd.cycle))
+        columns['cmd'].append(self.__cmd_codes[cmd.cmd])
+        for f in ADDRESS_FIELDS:
+            value, xmask, width = parse_bits(getattr(cmd, f))
+            columns[f].append(value)
+            columns[f"{f}_xmask"].append(xmask)
+            columns[f"{f}_width"].append(width)
+
+    def add_batch(self, batch: DecodedCommandBatch):
+        columns = self.__columns
+        timestamp_ps = batch.timestamp_ps()
+        for i, timestamp_sec in batch.timestamp_strs.items():
+            timestamp_ps[i] = _parse_timestamp_ps(timestamp_sec)
+        columns['timestamp_ps'].extend(timestamp_ps.tolist())
+        columns['cycle'].extend(batch.columns['cycle'])
+        columns['cmd'].extend(batch.columns['cmd'])
+        for f in ADDRESS_FIELDS:
+            for name in [f, f"{f}_xmask", f"{f}_width"]:
+                columns[name].extend(batch.array(name).tolist())
+
+    # Writes the collected commands to a file (atomically, see atomic_open).
+    def write(self, path: Path):
+        columns = [(name, np.dtype(dtype).newbyteorder('<'), self.__columns[name]) for name, _, dtype in COLUMNS]
+
+        # the offsets depend on the header length, which depends on the offsets; reserve enough digits for them
+        def get_header(offsets: list[int]) -> bytes:
+            header = {
+                'version': FORMAT_VERSION,
+                'dram_type': self.dram_type.value,
+                'cmds': self.cmd_names,
+                'num_commands': len(self),
+                'columns': [{'name': name, 'dtype': dtype.str, 'offset': offset}
+                            for (name, dtype, _), offset in zip(columns, offsets)],
+            }
+            return json.dumps(header).encode()
+
+        header_len = len(get_header([2 ** 63] * len(columns)))
+        offset = _align(len(MAGIC) + 4 + header_len)
+        offsets = list()
+        for _, dtype, values in columns:
+            offsets.append(offset)
+            offset = _align(offset + len(values) * dtype.itemsize)
+        header = get_header(offsets).ljust(header_len)
+
+        with atomic_open(path, "wb") as f:
+            f.write(MAGIC + struct.pack('<I', len(header)) + header)
+            for (_, dtype, values), offset in zip(columns, offsets):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(np.asarray(values, dtype=dtype).tobytes())
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+# Writes decoded commands to a file in the binary columnar format. Returns the number of commands written.
+def write_decoded_trace(path: Path, dram_type: E_DRAM_TYPE, decoded_commands: Iterable[DecodedCommand]) -> int:
+    writer = DecodedTraceWriter(dram_type)
+    for cmd in decoded_commands:
+        writer.add(cmd)
+    writer.write(path)
+    return len(writer)
+
+
+# A decoded trace in the binary columnar format. The file is memory-mapped and each column is a read-only NumPy view
+# of it, i.e., nothing is parsed or copied until the data is accessed. For example, all ACTs of bank group 1:
+#   with DecodedTrace(path) as trace:
+#       acts = (trace['cmd'] == trace.get_command_code('act')) & (trace['bg'] == 1) & (trace['bg_xmask'] == 0)
+class DecodedTrace:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self.path.open("rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} is not a decoded trace in the binary format")
+        header_len, = struct.unpack_from('<I', self.data, len(MAGIC))
+        header = json.loads(self.data[len(MAGIC) + 4:len(MAGIC) + 4 + header_len])
+        if header['version'] != FORMAT_VERSION:
+            raise ValueError(f"{self.path} has format version {header['version']}, expected {FORMAT_VERSION}")
+        self.dram_type = E_DRAM_TYPE(header['dram_type'])
+        self.cmd_names: list[str] = header['cmds']
+        self.num_commands: int = header['num_commands']
+        self.columns: dict[str, np.ndarray] = {
+            c['name']: np.frombuffer(self.data, dtype=np.dtype(c['dtype']), count=self.num_commands,
+                                     offset=c['offset'])
+            for c in header['columns']
+        }
+
+    def close(self):
+        # the views must be released before the map can be closed
+        self.columns = dict()
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.num_commands
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.columns[column]
+
+    # Returns the code of a command (e.g., 'act'), see get_command_names.
+    def get_command_code(self, cmd_name: str) -> int:
+        return self.cmd_names.index(cmd_name)
+
+    # Returns a single command as a DecodedCommand (e.g., to write it as CSV). Note that the timestamp is formatted
+    # from picoseconds and thus need not be the same string as in the trimmed CSV.
+    def get_command(self, i: int) -> DecodedCommand:
+        ts = int(self.columns['timestamp_ps'][i])
+        timestamp_sec = '' if ts == TIMESTAMP_UNKNOWN else f"{ts * 1e-12:.12e}"
+        metadata = dict()
+        for f in ADDRESS_FIELDS:
+            width = int(self.columns[f"{f}_width"][i])
+            if width > 0:
+                metadata[f] = format_bits(int(self.columns[f][i]), int(self.columns[f"{f}_xmask"][i]), width)
+        cmd_enum = type(DRAM_COMMANDS[self.dram_type][0].identifier)
+        return DecodedCommand(timestamp_sec, cmd_enum[self.cmd_names[int(self.columns['cmd'][i])]], metadata,
+                              int(self.columns['cycle'][i]))
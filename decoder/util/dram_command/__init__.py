@@ -1,8 +1,12 @@
-from .dram_command import DramCommand, E_DRAM_TYPE, DRAM_COMMANDS
+from .dram_command import DramCommand, E_DRAM_TYPE, DRAM_COMMANDS, get_commands_fingerprint
 from .enums import E_DRAM_CMD, E_DRAM_TYPE
 from .ddr4 import DDR4_DRAM_COMMANDS, E_DDR4_DRAM_CMD
 from .ddr5 import DDR5_DRAM_COMMANDS, E_DDR5_DRAM_CMD
+from .lookup_table import DramCommandTable, DRAM_COMMAND_TABLES, get_command_table, load_command_table
 
 
 DRAM_COMMANDS[E_DRAM_TYPE.ddr4] = DDR4_DRAM_COMMANDS
 DRAM_COMMANDS[E_DRAM_TYPE.ddr5] = DDR5_DRAM_COMMANDS
+
+# The truth tables are compiled on first use rather than at import time, and cached across processes; see
+# get_command_table.
@@ -1,3 +1,4 @@
+import hashlib
 import os
 import re
 
@@ -19,6 +20,9 @@ class DramCommand:
         self.extracted_signals = False
         self.requirements = signal_reqs
         self.cmds = sub_cmds  # This and get_commands are a bit confusing
+        # compiled lazily from the metadata, see get_metadata_plan and get_csv_plan
+        self.__metadata_plan = None
+        self.__csv_plans = dict()
 
     def __eq__(self, other):
         if isinstance(other, DramCommand):
@@ -82,6 +86,8 @@ class DramCommand:
             'abbreviation': abbreviation,
             'format_str': format_str
         }
+        self.__metadata_plan = None
+        self.__csv_plans = dict()
         return self
 
     def has_metadata(self):
@@ -124,28 +130,43 @@ class DramCommand:
             out_str += f"{k}: {v}, "
         return out_str
 
+    # Returns, for each abbreviation (e.g., 'bk'), the names of the signals that hold its bits, sorted by their bit
+    # position (taken from the description) in descending order s.t. lsb is rightmost (e.g., bit_N|...|bit_1|bit_0).
+    # The plan is compiled once from the add_metadata declarations.
+    def get_metadata_plan(self) -> dict[str, list[str]]:
+        if self.__metadata_plan is None:
+            plan = dict()
+            for abbrv in dict.fromkeys(v['abbreviation'] for v in self.metadata.values()):
+                bitpos_signal = dict()
+                for signal_name, data in self.metadata.items():
+                    if abbrv in data['abbreviation']:
+                        bitpos_signal[int(re.search(r'\d+', data['description']).group())] = signal_name
+                plan[abbrv] = [bitpos_signal[k] for k in sorted(bitpos_signal, reverse=True)]
+            self.__metadata_plan = plan
+        return self.__metadata_plan
+
+    # Returns the metadata plan of each cycle (see get_metadata_plan) with the signal names resolved to the column
+    # indices of a CSV header (None if the header lacks a signal). The plans are compiled once per header.
+    def get_csv_plan(self, column_names: list[str]) -> list[list[tuple[str, list]]]:
+        key = tuple(column_names)
+        if key not in self.__csv_plans:
+            # like the dict built from a CSV row, a name that appears twice refers to its last column
+            column_index = {name: i for i, name in enumerate(column_names)}
+            self.__csv_plans[key] = [[(abbrv, [column_index.get(name) for name in names])
+                                      for abbrv, names in cmd.get_metadata_plan().items()]
+                                     for cmd in self.get_commands()]
+        return self.__csv_plans[key]
+
     def get_metadata(self) -> dict[str]:
         all_cmds = self.get_commands()
         self.check_signals_extracted(all_cmds)
 
         out_data = defaultdict(str)
         for cmd in all_cmds:
-            # get all abbreviations
-            all_abbrvs = set([v['abbreviation'] for k,v in cmd.metadata.items()])
-
-            # for each abbreviation, get all collected metadata entries to build a map: bit no -> value
-            for abbrv in all_abbrvs:
-                bitpos_value = dict()
-                for _, data in cmd.metadata.items():
-                    if abbrv in data['abbreviation']:
-                        bit_pos = int(str(re.findall(r'\d+', data['description'])[0]))
-                        # Convert to string. 0 -> "0", 1 -> "1", None -> "X" (invalid/unkown).
-                        bitpos_value[bit_pos] = 'X' if data['value'] is None else str(data['value'])
-
-                # sort metadata entries based on the bit position (descending), then concat them
-                # in order s.t. lsb is rightmost (e.g., bit_N|bit_N-1|...|bit_1|bit_0)
-                print(bitpos_value)
-                out_data[abbrv] = ''.join([bitpos_value[k] for k in sorted(bitpos_value, reverse=True)])
+            for abbrv, signal_names in cmd.get_metadata_plan().items():
+                # Convert to string. 0 -> "0", 1 -> "1", None -> "X" (invalid/unkown).
+                values = [cmd.metadata[name]['value'] for name in signal_names]
+                out_data[abbrv] = ''.join(['X' if v is None else str(v) for v in values])
 
         return out_data
 
@@ -156,17 +177,28 @@ class DramCommand:
                 self.metadata[signal_name]['value'] = int(signals[signal_name])
         return self.get_metadata()
 
+    # Like extract_metadata for the split lines of a CSV (one per cycle), but the bits are gathered directly from the
+    # columns given by get_csv_plan; the values are not stored in self.metadata.
     def extract_metadata_csv(self, column_names: list[str], csvfile_line: list):
         self.extracted_signals = True
         all_metadata = dict()
-        cmds = self.cmds if self.is_two_cycle_cmd else [self]
-        for line, dram_sub_cmd in zip(csvfile_line, cmds):
-            md = dram_sub_cmd.extract_metadata({name: value for name, value in zip(column_names, line)})
-            # merge dictionaries by 'name'
-            for k, v in md.items():
-                if k not in all_metadata:
-                    all_metadata[k] = v
-                else:
-                    # e.g., to combine the row bits collected in the first and second cycle of ACT
-                    all_metadata[k] = v + all_metadata[k]
+        for line, plan in zip(csvfile_line, self.get_csv_plan(column_names)):
+            for abbrv, columns in plan:
+                v = ''.join(['X' if col is None or col >= len(line) else str(int(line[col])) for col in columns])
+                # e.g., to combine the row bits collected in the first and second cycle of ACT
+                all_metadata[abbrv] = v + all_metadata.get(abbrv, '')
         return all_metadata
+
+
+# Returns a fingerprint of the DRAM commands of a DRAM type, i.e., a hash over everything that determines how a trace
+# is decoded: the identifiers, the signal requirements of each cycle, and the metadata extracted from each cycle.
+def get_commands_fingerprint(dram_type: E_DRAM_TYPE) -> str:
+    h = hashlib.sha256()
+    for cmd in DRAM_COMMANDS[dram_type]:
+        h.update(f"{cmd.identifier.value},{cmd.is_two_cycle_cmd}\n".encode())
+        for sub_cmd in cmd.get_commands():
+            h.update(f"{sorted(sub_cmd.requirements.items())}\n".encode())
+            metadata = sorted((k, v['description'], v['abbreviation'], v['format_str'])
+                              for k, v in sub_cmd.metadata.items())
+            h.update(f"{metadata}\n".encode())
+    return h.hexdigest()
@@ -0,0 +1,263 @@
+import os
+
+import numpy as np
+
+from pathlib import Path
+
+from .dram_command import DramCommand, DRAM_COMMANDS, get_commands_fingerprint
+from .enums import E_DRAM_TYPE
+
+# Dense tables have 2**len(signals) entries; this keeps them small enough to build quickly.
+MAX_TABLE_SIGNALS = 20
+
+# Bitmasks of matching commands are stored in 64-bit words.
+MAX_TABLE_COMMANDS = 64
+
+# The version of the cached tables, see get_table_cache_path; bump it whenever DramCommandTable compiles the tables
+# differently for the same commands.
+TABLE_CACHE_VERSION = 1
+
+# The table of each DRAM type, compiled (or loaded from the cache) on first use, see get_command_table.
+DRAM_COMMAND_TABLES = {}
+
+# Tables built for traces that lack some of the signals, see get_command_table.
+__partial_tables = {}
+
+
+class AmbiguousTruthTableException(Exception):
+    pass
+
+
+# Returns all signals that a list of DRAM commands puts requirements on, in order of first appearance.
+def get_required_signals(dram_cmds: list[DramCommand]) -> list[str]:
+    signals = list()
+    for dram_cmd in dram_cmds:
+        for sub_cmd in dram_cmd.get_commands():
+            signals += [s for s in sub_cmd.requirements if s not in signals]
+    return signals
+
+
+# Returns the (mask, value) pair of a command's signal requirements on a word packed from signals.
+# Requirements on signals that are not in the list are ignored (i.e., treated as "don't care").
+def get_mask_and_value(cmd: DramCommand, signals: list[str]) -> tuple[int, int]:
+    mask, value = 0, 0
+    for bit, signal_name in enumerate(signals):
+        if signal_name in cmd.requirements:
+            if cmd.requirements[signal_name] not in [0, 1]:
+                raise Exception(
+                    f"I do not understand requirement `{cmd.requirements[signal_name]}`for DRAM command `{cmd.identifier}`")
+            mask |= (1 << bit)
+            value |= (cmd.requirements[signal_name] << bit)
+    return mask, value
+
+
+# The truth table of a list of DRAM commands compiled into dense lookup tables. Bit i of a (packed) word is the value
+# of signals[i]; each table maps a word to a bitmask of the commands (bit j = dram_cmds[j]) whose requirements it
+# satisfies:
+#   first_cycle[word]  -> commands whose (first) cycle matches; several bits are set for two-cycle commands that can
+#                         only be told apart in their second cycle (e.g., WR/WRA)
+#   second_cycle[word] -> two-cycle commands whose second cycle matches
+#   first_match[word]  -> the index of the first command in first_cycle[word], or -1 if there is none
+# @param tables the tables compiled before (see to_array), e.g., loaded from the cache, or None to compile them
+class DramCommandTable:
+    def __init__(self, dram_cmds: list[DramCommand], signals: list[str] = None, check_ambiguity: bool = True,
+                 tables: np.ndarray = None):
+        assert len(dram_cmds) <= MAX_TABLE_COMMANDS, f"cannot build a table for more than {MAX_TABLE_COMMANDS} commands"
+        self.dram_cmds = dram_cmds
+        self.signals = get_required_signals(dram_cmds) if signals is None else list(signals)
+        assert len(self.signals) <= MAX_TABLE_SIGNALS, f"cannot build a table over more than {MAX_TABLE_SIGNALS} signals"
+        self.full_mask = (1 << len(self.signals)) - 1
+
+        self.first_cycle_masks = [get_mask_and_value(c.get_commands(True, False)[0], self.signals) for c in dram_cmds]
+        self.second_cycle_masks = [get_mask_and_value(c.get_commands(False, True)[0], self.signals)
+                                   if c.is_two_cycle_cmd else None for c in dram_cmds]
+
+        if tables is not None:
+            if tables.shape != (3, 1 << len(self.signals)) or tables.dtype != np.uint64:
+                raise ValueError(f"the tables do not match the signals {self.signals}")
+            self.first_cycle, self.second_cycle = tables[0], tables[1]
+            self.first_match = tables[2].view(np.int64).astype(np.int8)
+            return
+
+        words = np.arange(1 << len(self.signals), dtype=np.uint64)
+        self.first_cycle = self.__build(words, self.first_cycle_masks)
+        self.second_cycle = self.__build(words, self.second_cycle_masks)
+        self.first_match = np.full(len(words), -1, dtype=np.int8)
+        for cmd_id in reversed(range(len(dram_cmds))):
+            self.first_match[self.has_command(self.first_cycle, cmd_id)] = cmd_id
+
+        if check_ambiguity:
+            self.__check_ambiguity(words)
+
+    @staticmethod
+    def __build(values: np.ndarray, masks: list) -> np.ndarray:
+        table = np.zeros(len(values), dtype=np.uint64)
+        for cmd_id, mask_value in enumerate(masks):
+            if mask_value is None:
+                continue
+            mask, value = mask_value
+            table[(values & np.uint64(mask)) == value] |= np.uint64(1 << cmd_id)
+        return table
+
+    # Only the first cycle of two-cycle commands may be shared by several commands (they are resolved by their second
+    # cycle), any other overlap of truth-table entries means we cannot decide which command was sent.
+    def __check_ambiguity(self, words: np.ndarray):
+        one_cycle_cmds = [i for i, c in enumerate(self.dram_cmds) if not c.is_two_cycle_cmd]
+        num_one_cycle = sum(self.has_command(self.first_cycle, i).astype(np.int64) for i in one_cycle_cmds)
+        ambiguous = np.flatnonzero((num_one_cycle > 0) & (self.count_commands(self.first_cycle) > 1))
+        if len(ambiguous) > 0:
+            word = int(words[ambiguous[0]])
+            cmd_ids = self.get_command_ids(self.first_cycle[word])
+            raise AmbiguousTruthTableException(
+                f"truth-table entries {[str(self.dram_cmds[i]) for i in cmd_ids]} overlap for "
+                f"{self.describe_word(word)}")
+
+    # Returns, for each bitmask, whether the command with the given index is set.
+    @staticmethod
+    def has_command(bitmasks: np.ndarray, cmd_id: int) -> np.ndarray:
+        return ((bitmasks >> np.uint64(cmd_id)) & np.uint64(1)) == 1
+
+    # Returns, for each bitmask, the number of commands set.
+    def count_commands(self, bitmasks: np.ndarray) -> np.ndarray:
+        return sum((self.has_command(bitmasks, i).astype(np.int64) for i in range(len(self.dram_cmds))),
+                   np.zeros(len(bitmasks), dtype=np.int64))
+
+    # Returns, for each bitmask, the index of the first command set, or -1 if there is none.
+    def first_command(self, bitmasks: np.ndarray) -> np.ndarray:
+        result = np.full(len(bitmasks), -1, dtype=np.int64)
+        for cmd_id in reversed(range(len(self.dram_cmds))):
+            result[self.has_command(bitmasks, cmd_id)] = cmd_id
+        return result
+
+    # Returns the indices of the commands set in a bitmask.
+    def get_command_ids(self, bitmask) -> list[int]:
+        bitmask = int(bitmask)
+        return [i for i in range(len(self.dram_cmds)) if (bitmask >> i) & 1]
+
+    def describe_word(self, word: int) -> str:
+        return ' '.join(f"{s}={(word >> i) & 1}" for i, s in enumerate(self.signals))
+
+    # Packs the signal values of a single cycle (e.g., a dict or a pandas row) into a word and a mask of known bits.
+    def pack_signals(self, signals) -> tuple[int, int]:
+        word, known = 0, 0
+        for bit, signal_name in enumerate(self.signals):
+            value = signals[signal_name]
+            if value == 0 or value == 1:
+                word |= (int(value) << bit)
+                known |= (1 << bit)
+        return word, known
+
+    # Returns the index of the first command whose (first) cycle matches the signal values of a single cycle, or -1 if
+    # there is none.
+    def match_signals(self, signals) -> int:
+        word, known = self.pack_signals(signals)
+        if known == self.full_mask:
+            return int(self.first_match[word])
+        return int(self.first_command(np.array([self.lookup_signals(signals)], dtype=np.uint64))[0])
+
+    # Returns the bitmask of the commands whose first (or second) cycle matches the signal values of a single cycle.
+    def lookup_signals(self, signals, second_cycle: bool = False) -> int:
+        word, known = self.pack_signals(signals)
+        table = self.second_cycle if second_cycle else self.first_cycle
+        if known == self.full_mask:
+            return int(table[word])
+        return int(self.lookup(table, np.array([word], dtype=np.uint32), np.array([known], dtype=np.uint32),
+                               second_cycle)[0])
+
+    # Packs arrays of signal values (e.g., TrimmedCsv.bits or the columns of a DataFrame) into words.
+    # Returns the words and, for each word, a mask of the bits that are known (i.e., 0 or 1).
+    def pack(self, bits) -> tuple[np.ndarray, np.ndarray]:
+        word, known = None, None
+        for bit, signal_name in enumerate(self.signals):
+            values = np.asarray(bits[signal_name])
+            if word is None:
+                word = np.zeros(len(values), dtype=np.uint32)
+                known = np.zeros(len(values), dtype=np.uint32)
+            word |= (values == 1).astype(np.uint32) << bit
+            known |= ((values == 0) | (values == 1)).astype(np.uint32) << bit
+        return word, known
+
+    # Looks up the bitmasks of matching commands for packed words. Words with unknown bits cannot be used as an index;
+    # for those, the (mask, value) pairs of the commands are compared directly.
+    def lookup(self, table: np.ndarray, word: np.ndarray, known: np.ndarray, second_cycle: bool = False) -> np.ndarray:
+        all_known = (known == self.full_mask)
+        result = table[np.where(all_known, word, 0)]
+        unknown_rows = np.flatnonzero(~all_known)
+        if len(unknown_rows) > 0:
+            result[unknown_rows] = 0
+            masks = self.second_cycle_masks if second_cycle else self.first_cycle_masks
+            for cmd_id, mask_value in enumerate(masks):
+                if mask_value is None:
+                    continue
+                mask, value = mask_value
+                w, k = word[unknown_rows], known[unknown_rows]
+                matches = ((k & mask) == mask) & ((w & mask) == value)
+                result[unknown_rows[matches]] |= np.uint64(1 << cmd_id)
+        return result
+
+    def lookup_first_cycle(self, word: np.ndarray, known: np.ndarray) -> np.ndarray:
+        return self.lookup(self.first_cycle, word, known)
+
+    def lookup_second_cycle(self, word: np.ndarray, known: np.ndarray) -> np.ndarray:
+        return self.lookup(self.second_cycle, word, known, second_cycle=True)
+
+    # Returns the compiled tables as a single array, see the tables parameter of the constructor.
+    def to_array(self) -> np.ndarray:
+        return np.stack([self.first_cycle, self.second_cycle, self.first_match.astype(np.int64).view(np.uint64)])
+
+
+# Returns the path of the cached table of a DRAM type in the directory set by the COMMAND_TABLE_CACHE_DIR env variable
+# (default: decoder in XDG_CACHE_HOME or ~/.cache), or None if the cache is disabled by setting it to an empty string.
+# The path contains the fingerprint of the commands (see get_commands_fingerprint), so a table is compiled again
+# whenever the commands change.
+def get_table_cache_path(dram_type: E_DRAM_TYPE) -> Path:
+    if 'COMMAND_TABLE_CACHE_DIR' in os.environ:
+        if not os.getenv('COMMAND_TABLE_CACHE_DIR'):
+            return None
+        cache_dir = Path(os.getenv('COMMAND_TABLE_CACHE_DIR'))
+    else:
+        cache_dir = Path(os.getenv('XDG_CACHE_HOME') or Path.home() / ".cache") / "decoder"
+    fingerprint = get_commands_fingerprint(dram_type)
+    return cache_dir / f"command-table-{dram_type.value}-v{TABLE_CACHE_VERSION}-{fingerprint[:16]}.npy"
+
+
+# Returns the table of a DRAM type loaded from the cache, or compiles it and writes it to the cache if it has not been
+# compiled before (by any process). A cached table has been checked for ambiguity when it was compiled.
+def load_command_table(dram_type: E_DRAM_TYPE) -> DramCommandTable:
+    cache_path = get_table_cache_path(dram_type)
+    if cache_path is not None:
+        try:
+            return DramCommandTable(DRAM_COMMANDS[dram_type], tables=np.load(cache_path))
+        except (OSError, ValueError):
+            # not cached yet, or an invalid file (e.g., written by another version)
+            pass
+    table = DramCommandTable(DRAM_COMMANDS[dram_type])
+    if cache_path is not None:
+        # the file is written under a temporary name and renamed, so that processes that start at the same time never
+        # read a partially written one
+        tmp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                np.save(f, table.to_array())
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # e.g., a read-only home directory; the table is compiled again by the next process
+            tmp_path.unlink(missing_ok=True)
+    return table
+
+
+# Returns the lookup table of a DRAM type, which is loaded (see load_command_table) on first use. If only a subset of
+# its signals is available (e.g., a trace without some CA pins), the requirements on the missing signals are ignored
+# and a table over the given signals is returned. Such a table may contain overlapping entries; it is up to the caller
+# to handle them.
+def get_command_table(dram_type: E_DRAM_TYPE, signals: list[str] = None) -> DramCommandTable:
+    if dram_type not in DRAM_COMMAND_TABLES:
+        DRAM_COMMAND_TABLES[dram_type] = load_command_table(dram_type)
+    table = DRAM_COMMAND_TABLES[dram_type]
+    if signals is None or list(signals) == table.signals:
+        return table
+    key = (dram_type, tuple(signals))
+    if key not in __partial_tables:
+        __partial_tables[key] = DramCommandTable(table.dram_cmds, signals, check_ambiguity=False)
+    return __partial_tables[key]
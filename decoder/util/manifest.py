@@ -0,0 +1,229 @@
+import contextlib
+import hashlib
+import json
+import os
+
+from pathlib import Path
+
+from util.codec import get_codec, open_file
+
+# Version of the manifest format itself.
+MANIFEST_VERSION = 1
+
+# The inputs are hashed in blocks of this many bytes.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Status of a file that has been processed completely by a stage.
+STATUS_DONE = "done"
+
+# Status of a file that a stage failed to process (e.g., the external tool returned an error).
+STATUS_FAILED = "failed"
+
+
+# Returns the path of the manifest of an experiment, i.e., the record of which files have been processed by which
+# stage. Requires the DATA_DIR env variable.
+def get_manifest_path(iter_name: str) -> Path:
+    if iter_name == "":
+        # decode_one.sh: the DATA_DIR belongs to a single experiment
+        return Path(os.getenv("DATA_DIR")) / "manifest.jsonl"
+    return Path(os.getenv("DATA_DIR")) / "manifest" / f"{iter_name}.jsonl"
+
+
+# Returns the names of the experiments that have a manifest (see get_manifest_path), e.g., to collect their garbage.
+# Requires the DATA_DIR env variable.
+def get_experiment_names() -> list[str]:
+    data_dir = Path(os.getenv("DATA_DIR"))
+    names = [""] if (data_dir / "manifest.jsonl").is_file() else []
+    if (data_dir / "manifest").is_dir():
+        names += sorted(path.stem for path in (data_dir / "manifest").glob("*.jsonl"))
+    return names
+
+
+# Returns the SHA-256 hash of a file.
+def hash_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+# Returns what identifies the content of an input file: its size, modification time, and hash.
+def describe_input(path: Path) -> dict:
+    st = Path(path).stat()
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': hash_file(path)}
+
+
+# Returns the size of an output file, or None if the stage did not write one (e.g., no commands were decoded).
+def describe_output(path: Path):
+    path = Path(path)
+    return {'size': path.stat().st_size} if path.is_file() else None
+
+
+# Writes a file atomically: the content is written to a temporary file in the same directory that replaces the actual
+# file only once it has been written completely. If writing fails, the temporary file is removed and an existing file
+# is left untouched. Yields the temporary path.
+@contextlib.contextmanager
+def atomic_output(path: Path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.parent / f".{path.name}.tmp-{os.getpid()}"
+    try:
+        yield tmp_path
+        if tmp_path.exists():
+            os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+# Flushes a file that has been written and closed to the disk.
+def fsync_path(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Opens a file for writing atomically, see atomic_output. Files whose extension is that of a codec (e.g., .gz) are
+# compressed with it, see util.codec.
+@contextlib.contextmanager
+def atomic_open(path: Path, mode: str = "w"):
+    with atomic_output(path) as tmp_path:
+        # the codec is that of the actual path, the temporary path has another extension
+        with open_file(tmp_path, mode, get_codec(path)) as f:
+            yield f
+        fsync_path(tmp_path)
+
+
+# The manifest of an experiment records, for each stage and input file, the input's size, modification time and hash,
+# the version and parameters of the stage, the output written, and whether processing completed. A rerun of a stage
+# only redoes the files whose record is missing or stale.
+# The manifest is an append-only journal of JSON lines (the last record of a file wins), so that a crash can at most
+# lose the record being written; it is compacted when closed.
+class Manifest:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.records: dict[tuple[str, str], dict] = dict()
+        if self.path.is_file():
+            with self.path.open("r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a record that was being written when we crashed
+                        continue
+                    if record.get('manifest_version') != MANIFEST_VERSION:
+                        continue
+                    self.records[(record['stage'], record['input'])] = record
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.__journal = self.path.open("a")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Rewrites the journal with only the latest record of each file.
+    def close(self):
+        if self.__journal is None:
+            return
+        self.__journal.close()
+        self.__journal = None
+        with atomic_open(self.path) as f:
+            for record in self.records.values():
+                f.write(json.dumps(record) + "\n")
+
+    # Returns the record of an input of a stage, or None if there is none.
+    def get_record(self, stage: str, in_path: Path) -> dict:
+        return self.records.get((stage, Path(in_path).name))
+
+    # Returns the record of an input that has been processed completely by a stage with the given version and
+    # parameters, or None if there is no such record.
+    def __get_done_record(self, stage: str, in_path: Path, version: int, params: dict) -> dict:
+        record = self.get_record(stage, in_path)
+        if record is None or record['status'] != STATUS_DONE or record['version'] != version \
+                or record['params'] != json.loads(json.dumps(params or {})):
+            return None
+        return record
+
+    # Returns whether the outputs of a record are still there.
+    @staticmethod
+    def __has_outputs(record: dict, out_path: Path, extra_out_paths: list) -> bool:
+        outputs = [(out_path, record['out'])]
+        for path in extra_out_paths or []:
+            if Path(path).name not in record.get('extra_out', {}):
+                return False
+            outputs.append((path, record['extra_out'][Path(path).name]))
+        return all(describe_output(path) == out for path, out in outputs)
+
+    # Returns whether the given input has been processed completely by a stage with the same version and parameters,
+    # its content did not change since, and the outputs are still there.
+    # @param extra_out_paths further outputs written besides out_path
+    # @param allow_pruned whether an output that has been removed on purpose (see prune) counts as still there
+    def is_done(self, stage: str, in_path: Path, out_path: Path, version: int, params: dict = None,
+                extra_out_paths: list = None, allow_pruned: bool = False) -> bool:
+        in_path = Path(in_path)
+        record = self.__get_done_record(stage, in_path, version, params)
+        if record is None:
+            return False
+        if not in_path.is_file():
+            return False
+        st = in_path.stat()
+        if st.st_size != record['in']['size']:
+            return False
+        # only hash the input again if it has been touched
+        if st.st_mtime_ns != record['in']['mtime_ns'] and hash_file(in_path) != record['in']['sha256']:
+            return False
+        if record.get('pruned', False):
+            return allow_pruned
+        return self.__has_outputs(record, out_path, extra_out_paths)
+
+    # Returns whether the given input has been processed completely by a stage with the same version and parameters
+    # and the outputs are still there, no matter whether the input is (e.g., an intermediate output of a previous stage
+    # that has been pruned since).
+    def has_current_output(self, stage: str, in_path: Path, out_path: Path, version: int, params: dict = None,
+                           extra_out_paths: list = None) -> bool:
+        record = self.__get_done_record(stage, in_path, version, params)
+        return record is not None and self.__has_outputs(record, out_path, extra_out_paths)
+
+    # Records that the output of an input of a stage has been removed on purpose, e.g., an intermediate output once
+    # the next stage has processed it (see util.retention). The record is kept otherwise, so that is_done can tell
+    # that the input need not be processed again.
+    def prune(self, stage: str, in_path: Path):
+        record = self.get_record(stage, in_path)
+        if record is None or record.get('pruned', False):
+            return
+        record = dict(record, pruned=True)
+        self.records[(stage, record['input'])] = record
+        self.__write(record)
+
+    # Records that an input has been processed by a stage.
+    # @param in_info the description of the input (see describe_input) at the time it was processed
+    def record(self, stage: str, in_path: Path, in_info: dict, out_path: Path, version: int, params: dict = None,
+               extra_out_paths: list = None, status: str = STATUS_DONE):
+        record = {
+            'manifest_version': MANIFEST_VERSION,
+            'stage': stage,
+            'input': Path(in_path).name,
+            'in': in_info,
+            'out': describe_output(out_path),
+            'extra_out': {Path(path).name: describe_output(path) for path in extra_out_paths or []},
+            'version': version,
+            'params': params or {},
+            'status': status,
+        }
+        record = json.loads(json.dumps(record))
+        self.records[(stage, record['input'])] = record
+        self.__write(record)
+
+    # Appends a record to the journal.
+    def __write(self, record: dict):
+        self.__journal.write(json.dumps(record) + "\n")
+        self.__journal.flush()
+        os.fsync(self.__journal.fileno())
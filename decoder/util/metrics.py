@@ -0,0 +1,393 @@
+import contextlib
+import fcntl
+import json
+import os
+import socket
+import time
+
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Iterable
+
+from util.manifest import atomic_open
+from util.options import E_PROFILER
+from util.profiling import Profile, coroutine_profiling, get_coroutine_track, get_profile_dir, get_span, get_track, \
+    profiling, span
+from util.py_helper import printf
+
+# The version of the metrics summary format, see RunMetrics.summarize.
+METRICS_VERSION = 1
+
+# The number of slowest files listed in the summary of each stage.
+NUM_SLOWEST_FILES = 5
+
+# The name of the trace of a run with the trace profiler, which holds the spans of all stages, see
+# RunMetrics.write_profiles.
+TRACE_NAME = "trace"
+
+# The prefix of the metrics in the Prometheus textfile, see write_textfile.
+PROMETHEUS_PREFIX = "decoder_"
+
+# The counters in the Prometheus textfile, which add up the stage summaries (see StageMetrics.summarize) of all runs:
+# the metric name (without PROMETHEUS_PREFIX and the _total suffix), the key in the stage summary, and the help text.
+PROMETHEUS_COUNTERS = [
+    ("files", 'files', "Files processed by the stage."),
+    ("failed_files", 'failed', "Files the stage failed to process."),
+    ("skipped_files", 'skipped', "Files skipped as they have been processed before (see the manifest)."),
+    ("input_bytes", 'bytes_in', "Bytes read by the stage."),
+    ("output_bytes", 'bytes_out', "Bytes written by the stage."),
+    ("rows", 'rows', "Rows (i.e., lines of the trimmed CSVs) decoded by the stage."),
+    ("busy_seconds", 'busy_seconds', "Seconds the workers (or event loop slots) of the stage were busy."),
+    ("cpu_seconds", 'cpu_seconds', "CPU seconds the workers of the stage took (not for xmldig2csv processes)."),
+    ("queue_wait_seconds", 'queue_wait_seconds', "Seconds the files waited for a worker of the stage."),
+    ("cache_hits", 'cache_hits', "Files whose output has been taken from the decode cache."),
+    ("cache_misses", 'cache_misses', "Files that have been looked up in the decode cache but not found."),
+]
+
+# The gauges in the Prometheus textfile, which are those of the last run that ran the stage: the metric name (without
+# PROMETHEUS_PREFIX), the key in the stage summary, and the help text.
+PROMETHEUS_GAUGES = [
+    ("last_run_seconds", 'seconds', "Seconds from queueing the first file of the stage to finishing the last one."),
+    ("last_run_utilization", 'utilization', "Fraction of the time the workers (or slots) of the stage were busy."),
+    ("last_run_input_bytes_per_second", 'input_bytes_per_second', "Bytes read by the stage per second."),
+    ("last_run_rows_per_second", 'rows_per_second', "Rows decoded by the stage per second."),
+    ("last_run_queue_wait_max_seconds", 'queue_wait_max_seconds', "Longest time a file waited for a worker."),
+    ("last_run_slots", 'slots', "Workers (or event loop slots) of the stage."),
+]
+
+
+# Returns the directory the metrics summary of each run is written to, set by the METRICS_DIR env variable (default:
+# $DATA_DIR/metrics), or None if it is set to an empty value.
+def get_metrics_dir() -> Path:
+    if 'METRICS_DIR' in os.environ:
+        return Path(os.getenv('METRICS_DIR')) if os.getenv('METRICS_DIR') else None
+    return Path(os.getenv('DATA_DIR')) / 'metrics'
+
+
+# Returns the Prometheus textfile (e.g., in the directory of the textfile collector of node_exporter) that the metrics
+# of all runs are added up in, set by the METRICS_TEXTFILE env variable, or None if it is not set.
+def get_textfile_path() -> Path:
+    return Path(os.getenv('METRICS_TEXTFILE')) if os.getenv('METRICS_TEXTFILE') else None
+
+
+# What a process measured while running a task (e.g., decoding a file), see Measured.
+class TaskTiming:
+    # @param cpu_seconds the CPU time the process took for the task, or None if the task mostly waited for another
+    #   process (e.g., xmldig2csv)
+    # @param profile the profile of the task (see util.profiling), or None if it has not been profiled
+    # @param track the track of the thread (or coroutine) that ran the task, see util.profiling.get_track
+    def __init__(self, pid: int, t_start: float, t_end: float, cpu_seconds: float = None, profile: Profile = None,
+                 track: tuple[str, str] = None):
+        self.pid = pid
+        self.t_start = t_start
+        self.t_end = t_end
+        self.cpu_seconds = cpu_seconds
+        self.profile = profile
+        self.track = track
+
+
+# Calls a function (e.g., in a worker of a pool) and returns its result along with the TaskTiming of the call. Like a
+# functools.partial, it can be pickled if the function can, so it can be passed to the pool instead of the function.
+# @param profiler the profiler the call is profiled with (see util.profiling.profiling), e.g., that of the run
+class Measured:
+    def __init__(self, run: Callable, profiler: E_PROFILER = E_PROFILER.off):
+        self.run = run
+        self.profiler = profiler
+
+    def __call__(self, *args):
+        profile = Profile(self.profiler)
+        with profiling(profile):
+            t_start, cpu_start = time.time(), time.process_time()
+            result = self.run(*args)
+            timing = TaskTiming(os.getpid(), t_start, time.time(), time.process_time() - cpu_start, track=get_track())
+        timing.profile = profile if not profile.is_empty() else None
+        return result, timing
+
+
+# Like Measured, but for a coroutine function, e.g., one that runs on an event loop (see util.pipeline.EventLoopThread).
+# The CPU time is not measured, as the event loop runs other coroutines meanwhile. Only the functions that the
+# coroutine runs in threads are profiled, see util.profiling.coroutine_profiling.
+class MeasuredCoroutine(Measured):
+    async def __call__(self, *args):
+        profile = Profile(self.profiler)
+        track = get_coroutine_track()
+        with coroutine_profiling(profile, track):
+            t_start = time.time()
+            result = await self.run(*args)
+            timing = TaskTiming(os.getpid(), t_start, time.time(), track=track)
+        timing.profile = profile if not profile.is_empty() else None
+        return result, timing
+
+
+# Returns a / b, or None if b is zero.
+def _ratio(a: float, b: float):
+    return a / b if b > 0 else None
+
+
+# Returns the sum of the values that are not None, or None if all are.
+def _sum_known(values: Iterable[float]):
+    values = [v for v in values if v is not None]
+    return sum(values) if values else None
+
+
+# The metrics of a stage in a run: a record of each file the stage processed, and the files it skipped.
+# @param num_slots the number of workers (or event loop slots) of the stage, see utilization in summarize
+# @param profile the profile of the stage that the profiles of the files are added to, see RunMetrics.profile
+class StageMetrics:
+    def __init__(self, name: str, num_slots: int, profile: Profile):
+        self.name = name
+        self.num_slots = num_slots
+        self.profile = profile
+        self.files: list[dict] = list()
+        self.num_skipped = 0
+        # the time each file has been queued, by experiment and file name, see queued
+        self.__queued: dict[tuple[str, str], float] = dict()
+
+    # Records that a file has been queued for the stage, i.e., that it waits for a worker from now on. Files that are
+    # recorded without having been queued did not wait.
+    def queued(self, experiment: str, name: str):
+        self.__queued.setdefault((experiment, name), time.time())
+
+    # Records files that have been skipped as they have been processed before.
+    def skipped(self, n: int = 1):
+        self.num_skipped += n
+
+    # Records a file that the stage processed (or failed to process).
+    # @param timing what the process that ran the stage for the file measured
+    # @param rows the number of rows (i.e., lines of the trimmed CSV) decoded, or None if unknown
+    # @param commands the number of decoded commands of each type (by name), or None if unknown
+    # @param cache_hit whether the output has been taken from the cache, or None if there is no cache
+    # @param error why the stage failed for the file, or None
+    # @param num_slots the number of workers used for the file, e.g., all of them for an outlier of decode_all
+    def record(self, experiment: str, name: str, timing: TaskTiming, bytes_in: int, bytes_out: int,
+               rows: int = None, commands: Counter = None, cache_hit: bool = None, error: str = None,
+               num_slots: int = 1):
+        t_queued = min(self.__queued.pop((experiment, name), timing.t_start), timing.t_start)
+        if timing.profile is not None:
+            self.profile.add(timing.profile)
+        seconds = timing.t_end - timing.t_start
+        if self.profile.profiler == E_PROFILER.trace:
+            args = {'experiment': experiment, 'queue_wait_seconds': timing.t_start - t_queued, 'slots': num_slots,
+                    'bytes_in': bytes_in, 'bytes_out': bytes_out, 'rows': rows, 'cache_hit': cache_hit, 'error': error}
+            self.profile.spans.append(get_span(name, self.name, timing.pid, timing.track, timing.t_start, timing.t_end,
+                                               args))
+        self.files.append({
+            'stage': self.name,
+            'experiment': experiment,
+            'file': name,
+            'pid': timing.pid,
+            'queued': t_queued,
+            'start': timing.t_start,
+            'end': timing.t_end,
+            'seconds': seconds,
+            'cpu_seconds': timing.cpu_seconds,
+            'queue_wait_seconds': timing.t_start - t_queued,
+            'slots': num_slots,
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'input_bytes_per_second': _ratio(bytes_in, seconds),
+            'rows': rows,
+            'rows_per_second': _ratio(rows, seconds) if rows is not None else None,
+            'commands': dict(commands) if commands is not None else None,
+            'cache_hit': cache_hit,
+            'error': error,
+        })
+
+    # Returns the summary of the stage: the totals of the files it processed, and their rates over the time from
+    # queueing the first file to finishing the last one. The utilization is the fraction of that time the workers of
+    # the stage were busy; with a pool shared by several runs (e.g., the jobs of util.server), it is this run's share.
+    def summarize(self) -> dict:
+        files = self.files
+        seconds = max(f['end'] for f in files) - min(f['queued'] for f in files) if files else 0
+        busy_seconds = sum(f['seconds'] * f['slots'] for f in files)
+        # None if the stage does not measure them (e.g., the rows converted by xmldig2csv)
+        rows = _sum_known(f['rows'] for f in files)
+        cpu_seconds = _sum_known(f['cpu_seconds'] for f in files)
+        commands = Counter()
+        for f in files:
+            commands.update(f['commands'] or {})
+        cache_hits = sum(f['cache_hit'] is True for f in files)
+        cache_misses = sum(f['cache_hit'] is False for f in files)
+        slowest = sorted(files, key=lambda f: f['seconds'], reverse=True)[:NUM_SLOWEST_FILES]
+        return {
+            'files': len(files),
+            'failed': sum(f['error'] is not None for f in files),
+            'skipped': self.num_skipped,
+            'slots': self.num_slots,
+            'seconds': seconds,
+            'busy_seconds': busy_seconds,
+            'cpu_seconds': cpu_seconds,
+            'utilization': _ratio(busy_seconds, seconds * self.num_slots),
+            'bytes_in': sum(f['bytes_in'] for f in files),
+            'bytes_out': sum(f['bytes_out'] for f in files),
+            'input_bytes_per_second': _ratio(sum(f['bytes_in'] for f in files), seconds),
+            'output_bytes_per_second': _ratio(sum(f['bytes_out'] for f in files), seconds),
+            'rows': rows,
+            'rows_per_second': _ratio(rows, seconds) if rows is not None else None,
+            'commands': dict(sorted(commands.items())),
+            'commands_per_second': {cmd: _ratio(n, seconds) for cmd, n in sorted(commands.items())},
+            'queue_wait_seconds': sum(f['queue_wait_seconds'] for f in files),
+            'queue_wait_mean_seconds': _ratio(sum(f['queue_wait_seconds'] for f in files), len(files)),
+            'queue_wait_max_seconds': max((f['queue_wait_seconds'] for f in files), default=0),
+            'cache_hits': cache_hits,
+            'cache_misses': cache_misses,
+            'cache_hit_rate': _ratio(cache_hits, cache_hits + cache_misses),
+            'slowest_files': [{k: f[k] for k in ('experiment', 'file', 'pid', 'seconds', 'queue_wait_seconds',
+                                                 'input_bytes_per_second')} for f in slowest],
+        }
+
+
+# The metrics of a run (e.g., decoding an experiment) across its stages (see StageMetrics), written as a JSON summary
+# per run (see get_metrics_dir) and added up in a Prometheus textfile (see get_textfile_path) by write. If a profiler is
+# given, the files processed by each stage (see Measured) and the stages in the main process (see profile) are
+# profiled as well, and the profiles of each stage are merged and written next to the summary (see get_profile_dir).
+# @param name what the run processes, e.g., the name of the experiment
+class RunMetrics:
+    def __init__(self, name: str, num_workers: int, profiler: E_PROFILER = E_PROFILER.off):
+        self.name = name
+        self.num_workers = num_workers
+        self.profiler = profiler
+        self.t_start = time.time()
+        self.stages: dict[str, StageMetrics] = dict()
+        # the profile of each stage (or of the main process while running several stages, e.g., a pipeline)
+        self.profiles: dict[str, Profile] = dict()
+
+    # Returns the metrics of a stage, which are created on first use.
+    # @param num_slots see StageMetrics
+    def get_stage(self, name: str, num_slots: int) -> StageMetrics:
+        if name not in self.stages:
+            self.stages[name] = StageMetrics(name, num_slots, self.get_profile(name))
+        return self.stages[name]
+
+    # Returns the profile of a stage, which is created on first use.
+    def get_profile(self, name: str) -> Profile:
+        if name not in self.profiles:
+            self.profiles[name] = Profile(self.profiler)
+        return self.profiles[name]
+
+    # Profiles the calling thread (e.g., the main process running a stage) into the profile of a stage while the
+    # context is entered, see util.profiling.profiling; with the trace profiler, as a span of the stage.
+    @contextlib.contextmanager
+    def profile(self, name: str):
+        with profiling(self.get_profile(name)), span(name, "stage"):
+            yield
+
+    # Returns the summary of the run: that of each stage and the record of each file.
+    def summarize(self) -> dict:
+        t_end = time.time()
+        return {
+            'version': METRICS_VERSION,
+            'name': self.name,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'num_workers': self.num_workers,
+            'start': self.t_start,
+            'end': t_end,
+            'seconds': t_end - self.t_start,
+            'stages': {name: stage.summarize() for name, stage in self.stages.items()},
+            'files': [f for stage in self.stages.values() for f in stage.files],
+        }
+
+    # Returns the name of the files of the run in the metrics and profile directories, which runs of several processes
+    # (and the jobs of a decode server) write to.
+    def __get_file_name(self) -> str:
+        name = self.name.replace(os.sep, "_") or "."
+        started = time.strftime('%Y%m%d_%H%M%S', time.localtime(self.t_start))
+        return f"{started}-{os.getpid()}-{name}"
+
+    # Writes the profile of each stage that has been profiled to a directory of the run in the profile directory. With
+    # the trace profiler, the spans of all stages are written as a single trace, so that they are shown on a timeline.
+    def write_profiles(self):
+        profiles = {name: profile for name, profile in self.profiles.items() if not profile.is_empty()}
+        if not profiles:
+            return
+        if self.profiler == E_PROFILER.trace:
+            trace = Profile(self.profiler)
+            for profile in profiles.values():
+                trace.add(profile)
+            profiles = {TRACE_NAME: trace}
+        profile_dir = get_profile_dir() / self.__get_file_name()
+        for name, profile in profiles.items():
+            path = profile.write(profile_dir / name)
+            printf(f"profile of {name} written to {path}")
+
+    # Writes the summary of the run to the metrics directory and adds it to the Prometheus textfile, unless they are
+    # disabled, and writes the profiles of the run (see write_profiles). Returns the path of the summary, or None.
+    def write(self) -> Path:
+        self.write_profiles()
+        summary = self.summarize()
+        textfile_path = get_textfile_path()
+        if textfile_path is not None:
+            write_textfile(textfile_path, summary)
+        metrics_dir = get_metrics_dir()
+        if metrics_dir is None:
+            return None
+        path = metrics_dir / f"{self.__get_file_name()}.json"
+        with atomic_open(path) as f:
+            json.dump(summary, f, indent=1)
+        printf(f"metrics written to {path}")
+        return path
+
+
+# Formats the labels of a Prometheus metric.
+def __format_labels(labels: dict) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}" if labels else ""
+
+
+# Adds the summary of a run (see RunMetrics.summarize) to a Prometheus textfile, i.e., to the counters of all runs
+# written to it before and the gauges of the last run of each stage. The counters are kept in a hidden state file next
+# to the textfile, which is locked while the textfile is rewritten, so that several processes may write to it.
+def write_textfile(path: Path, summary: dict):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.parent / f".{path.name}.state", "a+") as state_file:
+        fcntl.flock(state_file, fcntl.LOCK_EX)
+        state_file.seek(0)
+        try:
+            state = json.loads(state_file.read() or "{}")
+        except ValueError:
+            # e.g., written by a process that crashed; the counters start over, which Prometheus handles as a reset
+            state = dict()
+        counters = state.setdefault('counters', dict())
+        gauges = state.setdefault('gauges', dict())
+        state['runs'] = state.get('runs', 0) + 1
+        for stage, stage_summary in summary['stages'].items():
+            for metric, key, _ in PROMETHEUS_COUNTERS:
+                if stage_summary[key] is not None:
+                    values = counters.setdefault(metric, dict())
+                    values[stage] = values.get(stage, 0) + stage_summary[key]
+            for cmd, n in stage_summary['commands'].items():
+                values = counters.setdefault('commands', dict()).setdefault(stage, dict())
+                values[cmd] = values.get(cmd, 0) + n
+            # a run in which the stage skipped all files does not replace the gauges of the last one that did not
+            if stage_summary['files'] > 0:
+                gauges[stage] = {key: stage_summary[key] for _, key, _ in PROMETHEUS_GAUGES}
+        state['last_run'] = summary['end']
+
+        lines = [f"# HELP {PROMETHEUS_PREFIX}runs_total Runs that wrote their metrics to this file.",
+                 f"# TYPE {PROMETHEUS_PREFIX}runs_total counter",
+                 f"{PROMETHEUS_PREFIX}runs_total {state['runs']}",
+                 f"# HELP {PROMETHEUS_PREFIX}last_run_timestamp_seconds When the last run finished.",
+                 f"# TYPE {PROMETHEUS_PREFIX}last_run_timestamp_seconds gauge",
+                 f"{PROMETHEUS_PREFIX}last_run_timestamp_seconds {state['last_run']:.3f}"]
+        for metric, _, help_text in PROMETHEUS_COUNTERS:
+            lines += [f"# HELP {PROMETHEUS_PREFIX}{metric}_total {help_text}",
+                      f"# TYPE {PROMETHEUS_PREFIX}{metric}_total counter"]
+            lines += [f"{PROMETHEUS_PREFIX}{metric}_total{__format_labels({'stage': stage})} {value}"
+                      for stage, value in sorted(counters.get(metric, dict()).items())]
+        lines += [f"# HELP {PROMETHEUS_PREFIX}commands_total Decoded commands of each type.",
+                  f"# TYPE {PROMETHEUS_PREFIX}commands_total counter"]
+        lines += [f"{PROMETHEUS_PREFIX}commands_total{__format_labels({'stage': stage, 'command': cmd})} {n}"
+                  for stage, values in sorted(counters.get('commands', dict()).items())
+                  for cmd, n in sorted(values.items())]
+        for metric, key, help_text in PROMETHEUS_GAUGES:
+            lines += [f"# HELP {PROMETHEUS_PREFIX}{metric} {help_text}",
+                      f"# TYPE {PROMETHEUS_PREFIX}{metric} gauge"]
+            lines += [f"{PROMETHEUS_PREFIX}{metric}{__format_labels({'stage': stage})} {values[key]}"
+                      for stage, values in sorted(gauges.items()) if values[key] is not None]
+        with atomic_open(path) as f:
+            f.write("\n".join(lines) + "\n")
+
+        state_file.seek(0)
+        state_file.truncate()
+        json.dump(state, state_file)
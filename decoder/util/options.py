@@ -0,0 +1,44 @@
+from enum import Enum
+
+# The options of the stages that the entry points (e.g., decode.py) parse. They are defined here rather than in the
+# stages so that parsing them (e.g., for --help or the client of the decode server) does not import the stages and
+# their dependencies (e.g., NumPy and asyncio).
+
+# The vectorized engine splits CSV files into chunks of this many bytes that are decoded in parallel. Only a few
+# chunks per worker are held in memory at any time, so this bounds the memory used independent of the file size.
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# The time (in seconds) after which a watched experiment without further files is considered complete, see
+# stages.s2_decode.decode_watched.
+SETTLE_TIME = 30
+
+
+# The available ways to read the XMLdig files.
+class E_XMLDIG_READER(Enum):
+    # converts each file to a trimmed CSV with the external xmldig2csv tool (see stages.s0_xmldigtocsv)
+    xmldig2csv = "xmldig2csv"
+    # runs xmldig2csv while decoding each file, with its output piped into the decoder (see
+    # stages.s0_xmldigtocsv.xmldigtocsv_pipe); the conversion stage is skipped and the trimmed CSVs are only written if
+    # requested
+    pipe = "pipe"
+
+
+# The available implementations of the decoding stage. Both produce the same decoded CSV files.
+class E_DECODE_ENGINE(Enum):
+    # matches the regexes of all DRAM commands against the lines of the CSV file (one pool task per command)
+    regex = "regex"
+    # parses chunks of the CSV file into NumPy arrays and matches all DRAM commands on a whole chunk at once
+    vectorized = "vectorized"
+
+
+# The available profilers of the tasks and stages of a run, see util.profiling.
+class E_PROFILER(Enum):
+    # records every call with cProfile; the profiles are merged and written as pstats files (*.pstats)
+    cprofile = "cprofile"
+    # samples the stack every few milliseconds; the samples are merged and written as collapsed stacks (*.collapsed),
+    # e.g., for flamegraph.pl or speedscope
+    sample = "sample"
+    # records a span for each stage, file and chunk, with the process and thread that processed it; the spans are
+    # merged and written as a Chrome trace (*.json), e.g., for Perfetto
+    trace = "trace"
+    off = "off"
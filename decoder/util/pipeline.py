@@ -0,0 +1,336 @@
+import asyncio
+import contextlib
+import multiprocessing
+import multiprocessing.pool
+import os
+import queue
+import signal
+import threading
+import time
+
+from collections import deque
+from multiprocessing import Pool
+from typing import Callable, Coroutine
+
+from util.py_helper import printf
+
+# The interval (in seconds) in which a throttled stage is checked again, see PipelineStage. A throttle may also be
+# based on a measurement up to this old (e.g., that of the size of the data directory, see util.retention.DiskBudget).
+THROTTLE_CHECK_INTERVAL = 5
+
+# The maximum time (in seconds) a pipeline that is being fed with further items waits for them at once, see
+# Pipeline.run.
+WATCH_INTERVAL = 1
+
+
+# Runs coroutines on an event loop in a thread of the main process, e.g., to wait for many external processes at once
+# without tying up a worker of a pool for each of them (see PipelineStage). When the context is left, the coroutines
+# that are still running are cancelled and awaited. An event loop may be shared by several pipelines running in
+# different threads (e.g., the jobs of util.server), which then share its slots.
+# @param max_running the maximum number of items of pipeline stages run on the event loop at once, like the number of
+#   workers of a pool
+class EventLoopThread:
+    def __init__(self, max_running: int):
+        assert max_running > 0, "an event loop must run at least one item"
+        self.max_running = max_running
+        # the number of items of pipeline stages running on the event loop, see reserve
+        self.num_running = 0
+        self.loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.loop.run_forever, name="event-loop", daemon=True)
+        self.__lock = threading.Lock()
+        # the queues to put a None into once a slot is released, see reserve
+        self.__waiting: list[queue.Queue] = list()
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *args):
+        asyncio.run_coroutine_threadsafe(self.__cancel_all(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.__thread.join()
+        self.loop.close()
+
+    @staticmethod
+    async def __cancel_all():
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Reserves a slot for an item and returns True if one is idle. Otherwise, returns False and puts a None into
+    # wake_up once a slot is released, so that a pipeline waiting for its results can try again.
+    def reserve(self, wake_up: queue.Queue) -> bool:
+        with self.__lock:
+            if self.num_running < self.max_running:
+                self.num_running += 1
+                return True
+            if wake_up not in self.__waiting:
+                self.__waiting.append(wake_up)
+            return False
+
+    def __release(self):
+        with self.__lock:
+            self.num_running -= 1
+            waiting, self.__waiting = self.__waiting, list()
+        for wake_up in waiting:
+            wake_up.put(None)
+
+    # Runs a coroutine on the event loop in a slot that has been reserved for it (see reserve) and releases the slot
+    # once it is done. Calls callback with its result or error_callback with the exception it raised, like
+    # Pool.apply_async (but in the thread of the event loop).
+    def submit(self, coroutine: Coroutine, callback: Callable, error_callback: Callable):
+        def done(future):
+            self.__release()
+            if future.cancelled():
+                error_callback(asyncio.CancelledError())
+            elif future.exception() is not None:
+                error_callback(future.exception())
+            else:
+                callback(future.result())
+
+        asyncio.run_coroutine_threadsafe(coroutine, self.loop).add_done_callback(done)
+
+
+# A stage of a pipeline (see Pipeline). Each item queued for the stage is a tuple of arguments that run (a picklable
+# function, e.g., a module-level function or a functools.partial of it) is called with in a worker. done is then called
+# with the result in the main process (e.g., to record it in the manifest) and returns the item for the next stage, or
+# None if the item does not continue (e.g., as the stage failed for it).
+# @param queue_size the maximum number of items that wait for this stage, including those that the previous stage is
+#   still producing (e.g., the trimmed CSVs not decoded yet); None for no limit
+# @param throttle returns why the stage must not start further items for now (e.g., as the disk budget is exceeded,
+#   see util.retention), or None if it may
+# @param loop if given, run is a coroutine function (or a functools.partial of it) that is run on this event loop
+#   rather than in a worker of the pool, e.g., as it mostly waits for an external process
+class PipelineStage:
+    def __init__(self, name: str, run: Callable, done: Callable, queue_size: int = None,
+                 throttle: Callable[[], str] = None, loop: EventLoopThread = None):
+        assert queue_size is None or queue_size > 0, "the queue of a pipeline stage must hold at least one item"
+        self.name = name
+        self.run = run
+        self.done = done
+        self.queue_size = queue_size
+        self.throttle = throttle
+        self.loop = loop
+        # why the stage has been throttled the last time it was checked, see throttle
+        self.throttled = None
+        self.queue: deque[tuple] = deque()
+        # the number of items that are being processed by this stage
+        self.num_running = 0
+        # the number of items that have been processed by this stage
+        self.num_done = 0
+        # the stage that the items are passed on to, and the number of stages before this one, see Pipeline.add
+        self.next: PipelineStage = None
+        self.depth = 0
+
+    def put(self, item: tuple):
+        self.queue.append(item)
+
+    # Returns whether the stage has items that are queued or being processed.
+    def is_busy(self) -> bool:
+        return bool(self.queue) or self.num_running > 0
+
+
+# Runs the items queued for chains of stages (e.g., converting and decoding the files of an experiment) through all
+# subsequent stages of their chain. Rather than each stage processing all items before the next stage starts, the
+# stages of different items run concurrently, e.g., one file is decoded while the next one is converted. All stages
+# share the workers of the pool: at most num_workers items are processed at once, and the items that are furthest along
+# are started first, so that the queues between the stages are drained before new items are produced for them (among
+# chains, those added first go first). The queues are bounded (see PipelineStage), so a fast stage cannot run
+# arbitrarily far ahead of a slow one. A throttled stage waits for the items being processed (e.g., as processing them
+# frees disk space). Stages on an event loop take a slot of the event loop rather than a worker of the pool (which may
+# be None if all stages are on an event loop). Pipelines running in different threads may share a pool and event loops
+# (e.g., the jobs of util.server); the bounds then apply to each pipeline on its own, and to all pipelines on an event
+# loop together.
+class Pipeline:
+    def __init__(self, pool: Pool, num_workers: int):
+        self.pool = pool
+        self.num_workers = num_workers
+        self.stages: list[PipelineStage] = list()
+        # the results of the workers and the event loops, passed from the result handler thread of the pool or the
+        # thread of the event loop as (stage, result, error), or None once a slot of an event loop is released that a
+        # stage has been waiting for
+        self.__results = queue.Queue()
+        # the number of busy workers of the pool
+        self.__num_busy_workers = 0
+        # whether a stage waits for a slot of its event loop, i.e., the event loop is busy with other pipelines
+        self.__waiting_for_loop = False
+        # the chain of each stage whose on_idle is to be called, and the function, see add
+        self.__on_idle: dict[PipelineStage, tuple[list[PipelineStage], Callable[[], None]]] = dict()
+
+    # Adds a chain of stages, in which each stage passes the items it is done with on to the next one.
+    # @param on_idle called (in the thread running the pipeline) whenever an item of the chain is done and none of its
+    #   items are left, e.g., to remove the chain and add another one
+    def add(self, stages: list[PipelineStage], on_idle: Callable[[], None] = None):
+        for depth, stage in enumerate(stages):
+            stage.next = stages[depth + 1] if depth + 1 < len(stages) else None
+            stage.depth = depth
+            if on_idle is not None:
+                self.__on_idle[stage] = (stages, on_idle)
+        self.stages += stages
+
+    # Removes a chain of stages that is not busy anymore (e.g., once all files of an experiment went through).
+    def remove(self, stages: list[PipelineStage]):
+        assert not any(stage.is_busy() for stage in stages), "cannot remove stages that are still busy"
+        self.stages = [stage for stage in self.stages if stage not in stages]
+        for stage in stages:
+            self.__on_idle.pop(stage, None)
+
+    # Returns whether the next item of a stage can be started, i.e., whether a worker (or a slot of its event loop,
+    # which is reserved then) is idle, there is room for its output in the queue of the next stage, and the stage is
+    # not throttled.
+    def __can_start(self, stage: PipelineStage) -> bool:
+        if not stage.queue:
+            return False
+        if stage.loop is None and self.__num_busy_workers >= self.num_workers:
+            return False
+        if stage.next is not None and stage.next.queue_size is not None \
+                and len(stage.next.queue) + stage.num_running >= stage.next.queue_size:
+            return False
+        if stage.throttle is not None:
+            throttled = stage.throttle()
+            if throttled is not None and stage.throttled is None:
+                printf(f"throttling {stage.name}: {throttled}")
+            elif throttled is None and stage.throttled is not None:
+                printf(f"resuming {stage.name}")
+            stage.throttled = throttled
+            if throttled is not None:
+                return False
+        if stage.loop is not None and not stage.loop.reserve(self.__results):
+            self.__waiting_for_loop = True
+            return False
+        return True
+
+    def __start(self, stage: PipelineStage):
+        callback = lambda result: self.__results.put((stage, result, None))
+        error_callback = lambda error: self.__results.put((stage, None, error))
+        if stage.loop is not None:
+            stage.loop.submit(stage.run(*stage.queue.popleft()), callback, error_callback)
+        else:
+            self.pool.apply_async(stage.run, stage.queue.popleft(), callback=callback, error_callback=error_callback)
+            self.__num_busy_workers += 1
+        stage.num_running += 1
+
+    def __finish(self, stage: PipelineStage, result, error):
+        stage.num_running -= 1
+        if stage.loop is None:
+            self.__num_busy_workers -= 1
+        if error is not None:
+            raise error
+        stage.num_done += 1
+        item = stage.done(result)
+        if item is not None and stage.next is not None:
+            stage.next.put(item)
+        if stage in self.__on_idle:
+            chain, on_idle = self.__on_idle[stage]
+            if not any(stage.is_busy() for stage in chain):
+                on_idle()
+
+    # Runs until all items went through. If a throttled stage waits with nothing else being processed, it would wait
+    # forever and an exception is raised instead, unless the stage is not throttled anymore when it is checked again
+    # after THROTTLE_CHECK_INTERVAL.
+    # @param watch waits at most the given time (in seconds) for further items and queues them (e.g., the files that
+    #   appear in a watched directory, possibly in chains added meanwhile); returns whether further items may come.
+    #   While it does, a throttled stage waits rather than raising an exception (e.g., until another process frees
+    #   disk space).
+    # Raises the first exception that a stage raises; the items that are still being processed are abandoned then.
+    def run(self, watch: Callable[[float], bool] = None):
+        # whether the throttled stages have been checked again with nothing being processed since an item was started
+        rechecked = False
+        while True:
+            # start as many items as there are idle workers, the furthest along first
+            self.__waiting_for_loop = False
+            for stage in sorted(self.stages, key=lambda stage: stage.depth, reverse=True):
+                while self.__can_start(stage):
+                    self.__start(stage)
+                    rechecked = False
+
+            if not any(stage.num_running > 0 for stage in self.stages) and not self.__waiting_for_loop:
+                if watch is not None:
+                    if not watch(WATCH_INTERVAL):
+                        watch = None
+                    continue
+                throttled = [stage for stage in self.stages if stage.queue and stage.throttled is not None]
+                if throttled and not rechecked:
+                    # the items processed last may have freed what the throttle has not measured yet
+                    rechecked = True
+                    time.sleep(THROTTLE_CHECK_INTERVAL)
+                    continue
+                if throttled:
+                    raise Exception(f"[-] {throttled[0].name} is throttled with no other work left: "
+                                    f"{throttled[0].throttled}")
+                # unless throttled, the stage with the last non-empty queue can always be started, i.e., all items went
+                # through
+                break
+
+            # a throttled stage is checked again from time to time, even if no item is done meanwhile, and further
+            # items are watched for
+            timeout = THROTTLE_CHECK_INTERVAL if any(stage.throttled is not None for stage in self.stages) else None
+            if watch is not None:
+                timeout = WATCH_INTERVAL
+            try:
+                result = self.__results.get(timeout=timeout)
+                if result is not None:
+                    self.__finish(*result)
+            except queue.Empty:
+                pass
+            if watch is not None and not watch(0):
+                watch = None
+
+
+# Returns a context of a pool or an event loop that is shared (e.g., by the jobs of util.server) and thus left running
+# when the context is left, or of a new one returned by create otherwise.
+def use_shared(shared, create: Callable):
+    return contextlib.nullcontext(shared) if shared is not None else create()
+
+
+# Runs the items queued for a chain of stages, see Pipeline.
+def run_pipeline(stages: list[PipelineStage], pool: Pool, num_workers: int) -> None:
+    pipeline = Pipeline(pool, num_workers)
+    pipeline.add(stages)
+    pipeline.run()
+
+
+# A pool of a process that runs until it is stopped by Ctrl+C or SIGTERM (e.g., decode_watched or the decode server).
+# These signals are often sent to the whole process group (e.g., by systemd with KillMode=control-group, or by
+# timeout), and a worker that dies of them may hold the lock of the task queue of the pool, on which the main process
+# would then hang forever when it terminates the pool. The workers thus ignore both, and are rather killed once the main
+# process terminates the pool (e.g., when its context is left), which it does only after it has taken that lock.
+class SignalSafePool(multiprocessing.pool.Pool):
+    def __init__(self, num_workers: int):
+        super().__init__(num_workers, _init_signal_safe_worker)
+
+    # Pool.terminate stops the workers by Process.terminate, i.e., by SIGTERM, which they ignore.
+    @staticmethod
+    def Process(ctx, *args, **kwargs):
+        process = ctx.Process(*args, **kwargs)
+        process.terminate = process.kill
+        return process
+
+
+# Within the context, the first SIGTERM is handled like Ctrl+C (i.e., raises KeyboardInterrupt), as a daemon is usually
+# stopped by SIGTERM (e.g., by systemd). Any further one is ignored, as SIGTERM may be sent several times (e.g., timeout
+# sends it to the main process and then to its whole process group), which must not interrupt stopping the workers.
+# Processes forked within the context (e.g., the workers of a pool) are stopped by SIGTERM as usual.
+@contextlib.contextmanager
+def sigterm_interrupts():
+    pid = os.getpid()
+
+    def handle_sigterm(signum, frame):
+        if os.getpid() != pid:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.raise_signal(signal.SIGTERM)
+            return
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        raise KeyboardInterrupt
+
+    sigterm_handler = signal.signal(signal.SIGTERM, handle_sigterm)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, sigterm_handler)
+
+
+def _init_signal_safe_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
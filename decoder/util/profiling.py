@@ -0,0 +1,318 @@
+import asyncio
+import contextlib
+import contextvars
+import cProfile
+import itertools
+import json
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+
+from collections import Counter
+from multiprocessing.pool import Pool
+from pathlib import Path
+from types import FrameType
+from typing import Callable, Iterable
+
+from util.manifest import atomic_open
+from util.options import E_PROFILER
+
+# The default interval (in seconds) in which the sample profiler takes a sample of the stack, see
+# get_sample_interval.
+SAMPLE_INTERVAL = 0.005
+
+# The extension of the profiles written by each profiler, see Profile.write.
+PROFILE_SUFFIXES = {E_PROFILER.cprofile: ".pstats", E_PROFILER.sample: ".collapsed", E_PROFILER.trace: ".json"}
+
+# The profile that is being recorded in each thread, and the cProfile.Profile that records it (if any), see profiling.
+_current = threading.local()
+
+# The profile of the coroutine (e.g., a conversion on an event loop) that runs in the current context and the track its
+# spans are shown on, see coroutine_profiling.
+_coroutine_profile: contextvars.ContextVar[tuple["Profile", tuple[str, str]]] = \
+    contextvars.ContextVar("coroutine_profile", default=None)
+
+# The numbers of the tracks of the coroutines of this process, see get_coroutine_track.
+_coroutine_tracks = itertools.count()
+
+
+# Returns the directory the profiles of each run are written to, set by the PROFILE_DIR env variable (default:
+# $DATA_DIR/profiles).
+def get_profile_dir() -> Path:
+    return Path(os.getenv('PROFILE_DIR') or os.path.join(os.getenv('DATA_DIR'), 'profiles'))
+
+
+# Returns the interval (in seconds) in which the sample profiler takes a sample of the stack, set by the
+# PROFILE_INTERVAL env variable (default: SAMPLE_INTERVAL).
+def get_sample_interval() -> float:
+    return float(os.getenv('PROFILE_INTERVAL', SAMPLE_INTERVAL))
+
+
+# A process that is forked (e.g., a worker of a pool started while a stage is being profiled) does not continue the
+# profile of the thread it has been forked from; it records profiles of its own tasks instead.
+def __reset_after_fork():
+    tracer = getattr(_current, 'tracer', None)
+    if tracer is not None:
+        tracer.disable()
+    _current.profile = None
+    _current.tracer = None
+
+
+os.register_at_fork(after_in_child=__reset_after_fork)
+
+
+# Samples the stack of a thread in an interval while the context is entered, in a thread of its own. The samples are
+# counted by their stack, collapsed into a line of the functions from the outermost to the innermost one (see
+# Profile.write). Unlike cProfile, this also shows where the thread waits (e.g., for a read from NFS), and it costs next
+# to nothing between the samples.
+# @param root the outermost frame of the stacks, e.g., that of the function being profiled rather than the frames that
+#   a worker has inherited from the main process
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float, root: FrameType = None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root = root
+        self.stacks = Counter()
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name="stack-sampler", daemon=True)
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.__stop.set()
+        self.__thread.join()
+
+    def __run(self):
+        thread_name = threading.current_thread().name
+        for thread in threading.enumerate():
+            if thread.ident == self.thread_id:
+                thread_name = thread.name
+        while not self.__stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = list()
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back if frame is not self.root else None
+            self.stacks[";".join([thread_name] + stack[::-1])] += 1
+
+
+# The profile of a task or of a stage (see profiling), which the profiles of several tasks (e.g., of the workers of a
+# pool) can be added to. It can be pickled, so that a worker can return it along with its result.
+class Profile:
+    def __init__(self, profiler: E_PROFILER):
+        self.profiler = profiler
+        # the statistics of each function in the format of pstats (with the cprofile profiler)
+        self.stats: dict[tuple, tuple] = dict()
+        # the number of samples of each collapsed stack (with the sample profiler)
+        self.stacks = Counter()
+        # the spans of the stages, files and chunks, see get_span (with the trace profiler)
+        self.spans: list[dict] = list()
+
+    # Returns a profile of the cprofile profiler with the statistics of each function (in the format of pstats).
+    @staticmethod
+    def from_stats(stats: dict) -> "Profile":
+        profile = Profile(E_PROFILER.cprofile)
+        profile.stats = stats
+        return profile
+
+    def is_empty(self) -> bool:
+        return not self.stats and not self.stacks and not self.spans
+
+    def add(self, other: "Profile"):
+        for func, stat in other.stats.items():
+            self.stats[func] = pstats.add_func_stats(self.stats.get(func, (0, 0, 0, 0, dict())), stat)
+        self.stacks.update(other.stacks)
+        self.spans += other.spans
+
+    # Writes the profile to a path without its extension (see PROFILE_SUFFIXES) and returns the path written. A pstats
+    # file can be read by pstats.Stats (e.g., python -m pstats) or snakeviz, the collapsed stacks (a line of the
+    # functions and the number of samples per stack) by flamegraph.pl or speedscope, and the Chrome trace (see
+    # get_trace_events) by Perfetto (ui.perfetto.dev) or chrome://tracing.
+    def write(self, path: Path) -> Path:
+        path = Path(f"{path}{PROFILE_SUFFIXES[self.profiler]}")
+        if self.profiler == E_PROFILER.cprofile:
+            with atomic_open(path, "wb") as f:
+                marshal.dump(self.stats, f)
+        elif self.profiler == E_PROFILER.trace:
+            with atomic_open(path) as f:
+                json.dump({'traceEvents': get_trace_events(self.spans), 'displayTimeUnit': "ms"}, f)
+        else:
+            with atomic_open(path) as f:
+                for stack, n in sorted(self.stacks.items()):
+                    f.write(f"{stack} {n}\n")
+        return path
+
+
+# Records the calling thread into a profile while the context is entered, unless it is off or the thread is being
+# profiled already (e.g., a file decoded by the main process while the whole stage is being profiled), as the profile
+# of the thread then includes it. The profiles of the tasks run in workers meanwhile on behalf of the thread (see
+# profiled_starmap) are added to the profile of the thread as well. With the trace profiler, only the spans of the
+# thread are recorded, see span.
+@contextlib.contextmanager
+def profiling(profile: Profile):
+    if profile.profiler == E_PROFILER.off or getattr(_current, 'profile', None) is not None:
+        yield
+        return
+    _current.profile = profile
+    try:
+        if profile.profiler == E_PROFILER.trace:
+            yield
+        elif profile.profiler == E_PROFILER.cprofile:
+            _current.tracer = tracer = cProfile.Profile()
+            tracer.enable()
+            try:
+                yield
+            finally:
+                tracer.disable()
+                _current.tracer = None
+                tracer.create_stats()
+                profile.add(Profile.from_stats(tracer.stats))
+        else:
+            # the caller of the context, as this runs in the __enter__ of contextlib.contextmanager
+            with StackSampler(threading.get_ident(), get_sample_interval(), sys._getframe(2)) as sampler:
+                yield
+            profile.stacks.update(sampler.stacks)
+    finally:
+        _current.profile = None
+
+
+# Calls a function (e.g., in a worker of a pool) while recording a profile of it, and returns its result along with
+# the profile. Like a functools.partial, it can be pickled if the function can.
+class Profiled:
+    def __init__(self, run: Callable, profiler: E_PROFILER):
+        self.run = run
+        self.profiler = profiler
+
+    def __call__(self, *args):
+        profile = Profile(self.profiler)
+        with profiling(profile):
+            result = self.run(*args)
+        return result, profile
+
+
+# Like Pool.starmap, but if the calling thread is being profiled (see profiling), the tasks are profiled in the workers
+# and their profiles are added to that of the thread, e.g., the chunks of a file that is decoded by all workers.
+def profiled_starmap(pool: Pool, run: Callable, args: Iterable[tuple]) -> list:
+    profile: Profile = getattr(_current, 'profile', None)
+    if profile is None:
+        return pool.starmap(run, args)
+    results = pool.starmap(Profiled(run, profile.profiler), args)
+    for _, task_profile in results:
+        profile.add(task_profile)
+    return [result for result, _ in results]
+
+
+# Records the functions that a coroutine (e.g., a conversion on an event loop, see util.metrics.MeasuredCoroutine)
+# runs in threads (see to_thread) into a profile while the context is entered. The coroutine itself is not profiled, as
+# the event loop runs other coroutines meanwhile; it mostly waits for another process (e.g., xmldig2csv) anyway. Its
+# spans (see span) are recorded, on a track of its own (see get_coroutine_track).
+@contextlib.contextmanager
+def coroutine_profiling(profile: Profile, track: tuple[str, str]):
+    token = _coroutine_profile.set((profile, track))
+    try:
+        yield
+    finally:
+        _coroutine_profile.reset(token)
+
+
+def __call_profiled(profile: Profile, run: Callable, *args):
+    with profiling(profile):
+        return run(*args)
+
+
+# Like asyncio.to_thread, but the function is profiled into the profile of the calling coroutine, if there is one (see
+# coroutine_profiling). The threads of a coroutine run one after another, so they can share its profile.
+async def to_thread(run: Callable, *args):
+    profile, _ = _coroutine_profile.get() or (None, None)
+    if profile is None or profile.profiler == E_PROFILER.off:
+        return await asyncio.to_thread(run, *args)
+    return await asyncio.to_thread(__call_profiled, profile, run, *args)
+
+
+# Returns the track that the spans of the calling thread are shown on in a trace (see get_trace_events): the name of
+# the thread and a key of the track that is unique in the process. The spans of a coroutine (and of the threads it
+# runs functions in) are shown on the track of the coroutine, see get_coroutine_track.
+def get_track() -> tuple[str, str]:
+    _, track = _coroutine_profile.get() or (None, None)
+    return track or (threading.current_thread().name, str(threading.get_native_id()))
+
+
+# Returns a new track for the spans of a coroutine, as the coroutines on an event loop overlap in its thread.
+def get_coroutine_track() -> tuple[str, str]:
+    return threading.current_thread().name, f"{threading.get_native_id()}:{next(_coroutine_tracks)}"
+
+
+# Returns a span of the trace profiler, e.g., of a file that a worker decoded.
+# @param cat the category of the span, e.g., the stage
+# @param pid the process the span has been recorded in
+# @param track the track the span is shown on, see get_track
+# @param args further details, shown along with the span
+def get_span(name: str, cat: str, pid: int, track: tuple[str, str], t_start: float, t_end: float, args: dict) -> dict:
+    return {'name': name, 'cat': cat, 'pid': pid, 'thread': track[0], 'track': track[1], 'start': t_start,
+            'end': t_end, 'args': args}
+
+
+# Records a span of the calling thread (or coroutine) while the context is entered, if it is being profiled with the
+# trace profiler (see profiling and coroutine_profiling), e.g., of a chunk of a file; the spans of the stages and the
+# files are recorded by util.metrics.
+# @param cat the category of the span, e.g., the stage
+# @param args further details, shown along with the span
+@contextlib.contextmanager
+def span(name: str, cat: str, **args):
+    profile = getattr(_current, 'profile', None)
+    if profile is None:
+        profile, _ = _coroutine_profile.get() or (None, None)
+    if profile is None or profile.profiler != E_PROFILER.trace:
+        yield
+        return
+    t_start = time.time()
+    try:
+        yield
+    finally:
+        profile.spans.append(get_span(name, cat, os.getpid(), get_track(), t_start, time.time(), args))
+
+
+# Returns the events of a Chrome trace (see the Trace Event Format) with a complete event per span, on a thread of its
+# process per track. The tracks of a thread (e.g., the coroutines on an event loop) are shown on as few threads as
+# possible: tracks that do not overlap share a thread. The main process is the one that writes the trace.
+def get_trace_events(spans: list[dict]) -> list[dict]:
+    events = list()
+    for pid in sorted({s['pid'] for s in spans}):
+        process_spans = [s for s in spans if s['pid'] == pid]
+        events.append({'name': "process_name", 'ph': "M", 'pid': pid,
+                       'args': {'name': "main" if pid == os.getpid() else "worker"}})
+        # the thread name and the time of the first and last span of each track
+        tracks: dict[str, tuple[str, float, float]] = dict()
+        for s in process_spans:
+            thread, t_start, t_end = tracks.get(s['track'], (s['thread'], s['start'], s['end']))
+            tracks[s['track']] = (thread, min(t_start, s['start']), max(t_end, s['end']))
+        # the lanes (i.e., Chrome threads) of each thread name, as the time the last track on each of them ends
+        lanes: dict[str, list[float]] = dict()
+        lane_of_track: dict[str, tuple[str, int]] = dict()
+        for track, (thread, t_start, t_end) in sorted(tracks.items(), key=lambda item: item[1][1]):
+            thread_lanes = lanes.setdefault(thread, list())
+            lane = next((i for i, t_free in enumerate(thread_lanes) if t_free <= t_start), len(thread_lanes))
+            if lane == len(thread_lanes):
+                thread_lanes.append(t_end)
+            thread_lanes[lane] = t_end
+            lane_of_track[track] = (thread, lane)
+        tids = dict()
+        for thread in sorted(lanes, key=lambda t: (t != "MainThread", t)):
+            for lane in range(len(lanes[thread])):
+                tids[(thread, lane)] = tid = len(tids)
+                name = thread if len(lanes[thread]) == 1 else f"{thread} #{lane + 1}"
+                events.append({'name': "thread_name", 'ph': "M", 'pid': pid, 'tid': tid, 'args': {'name': name}})
+                events.append({'name': "thread_sort_index", 'ph': "M", 'pid': pid, 'tid': tid,
+                               'args': {'sort_index': tid}})
+        # the enclosing spans first, so that spans starting at the same time are nested correctly
+        for s in sorted(process_spans, key=lambda s: (s['start'], -s['end'])):
+            events.append({'name': s['name'], 'cat': s['cat'], 'ph': "X", 'ts': s['start'] * 1e6,
+                           'dur': (s['end'] - s['start']) * 1e6, 'pid': pid, 'tid': tids[lane_of_track[s['track']]],
+                           'args': s['args']})
+    return events
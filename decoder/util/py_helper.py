@@ -1,13 +1,63 @@
 import datetime
 import os
-import inspect
 import os.path
+import sys
+import time
 
+from collections import Counter
 
-def get_caller_info():
-    # first get the full filename (including path and file extension)
-    caller_frame = inspect.stack()[1]
-    caller_filename_full = caller_frame.filename
+# The log levels, see LOG_LEVEL. A message is printed if its level is at least the log level.
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LOG_LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+
+# The tag that is printed before the messages of a level.
+LOG_LEVEL_TAGS = {DEBUG: "[DEBUG] ", INFO: "", WARNING: "[WARNING] ", ERROR: "[ERROR] "}
+
+
+# Returns the log level set by the LOG_LEVEL env variable (debug, info, warning or error; default: info). DEBUG=1 sets
+# it to debug, as before the log levels were introduced.
+def get_log_level() -> int:
+    if 'LOG_LEVEL' in os.environ:
+        level = os.getenv('LOG_LEVEL').lower()
+        if level not in LOG_LEVELS:
+            raise Exception(f"[-] The env variable LOG_LEVEL must be one of {', '.join(LOG_LEVELS)}, not {level}.")
+        return LOG_LEVELS[level]
+    if 'DEBUG' in os.environ and int(os.getenv('DEBUG')) == 1:
+        return DEBUG
+    return INFO
+
+
+# The log level, read once rather than for every message; the workers inherit it.
+_log_level = get_log_level()
+
+# The time each rate-limited message (by its format string) has last been printed, and how many times it has been
+# suppressed since then, see log.
+_rate_limits: dict[str, tuple[float, int]] = dict()
+
+# The counters of the current process, see count.
+_counters = Counter()
+
+
+def set_log_level(level: int):
+    global _log_level
+    _log_level = level
+
+
+# Returns whether messages of a level are printed, e.g., to skip computing the arguments of debug messages in a loop.
+def is_enabled(level: int) -> bool:
+    return level >= _log_level
+
+
+# Returns the file of the caller of the function that calls this one, e.g., the caller of printf.
+# @param depth the number of frames between that caller and the function that calls this one, plus one
+def get_caller_info(depth: int = 1):
+    # first get the full filename (including path and file extension); only the frame is looked up rather than the
+    # whole stack with the source lines of each frame (as by inspect.stack)
+    caller_filename_full = sys._getframe(depth + 1).f_code.co_filename
 
     # now get rid of the directory (via basename)
     # then split filename and extension (via splitext)
@@ -17,9 +67,62 @@ def get_caller_info():
     return caller_filename_full, caller_filename_only
 
 
+# Prints a message with the file it has been logged from and the current time.
+def __emit(level: int, filename: str, message: str):
+    now = str(datetime.datetime.now()).split(' ')[1]
+    print('\033[1;35m', f"[{os.path.basename(filename)}|{now}] ", '\033[0;0m', LOG_LEVEL_TAGS[level], message, sep='')
+
+
+# Logs a message if its level is enabled (see LOG_LEVEL). The message is a format string (see str.format) that is only
+# formatted with the arguments once the message is printed, so that a disabled message costs a single comparison, e.g.,
+#   log(DEBUG, "candidates {}: found {} to be correct", candidates, candidate)
+# rather than an f-string that is formatted for nothing.
+# @param rate_limit if given, the message (i.e., its format string) is printed at most once per that many seconds; the
+#   number of times it has been suppressed in between is printed along with it
+# @param depth the number of frames between the caller whose file is printed and this function
+def log(level: int, message: str, *args, rate_limit: float = None, depth: int = 1):
+    if level < _log_level:
+        return
+    suffix = ""
+    if rate_limit is not None:
+        now = time.monotonic()
+        last, suppressed = _rate_limits.get(message, (None, 0))
+        if last is not None and now - last < rate_limit:
+            _rate_limits[message] = (last, suppressed + 1)
+            return
+        _rate_limits[message] = (now, 0)
+        if suppressed > 0:
+            suffix = f" ({suppressed} similar message(s) suppressed)"
+    fn, _ = get_caller_info(depth)
+    __emit(level, fn, (message.format(*args) if args else message) + suffix)
+
+
+def log_debug(message: str, *args, rate_limit: float = None):
+    log(DEBUG, message, *args, rate_limit=rate_limit, depth=2)
+
+
+def log_warning(message: str, *args, rate_limit: float = None):
+    log(WARNING, message, *args, rate_limit=rate_limit, depth=2)
+
+
+# Counts an event, e.g., in a loop that would otherwise log a message per iteration; see log_counters.
+def count(name: str, n: int = 1):
+    _counters[name] += n
+
+
+# Logs the counters of this process (see count) in a single message, if its level is enabled, and resets them.
+def log_counters(level: int, title: str):
+    counters = dict(_counters)
+    _counters.clear()
+    if counters and level >= _log_level:
+        fn, _ = get_caller_info()
+        __emit(level, fn, f"{title}: " + ", ".join(f"{name}={n}" for name, n in sorted(counters.items())))
+
+
 def print_debug(*args):
-    if 'DEBUG' in os.environ and int(os.getenv('DEBUG')) == 1:
-        print("[DEBUG]", *args)
+    if DEBUG >= _log_level:
+        fn, _ = get_caller_info()
+        __emit(DEBUG, fn, ' '.join(str(arg) for arg in args))
 
 
 def checkenv(env_var: str, verbose: bool = False):
@@ -30,7 +133,6 @@ def checkenv(env_var: str, verbose: bool = False):
 
 
 def printf(*args):
-    fn, _ = get_caller_info()
-    fn = fn.split('/')[-1]
-    now = str(datetime.datetime.now()).split(' ')[1]
-    print('\033[1;35m', f"[{fn}|{now}] ", '\033[0;0m', *args, sep='')
+    if INFO >= _log_level:
+        fn, _ = get_caller_info()
+        __emit(INFO, fn, ''.join(str(arg) for arg in args))
@@ -0,0 +1,89 @@
+import os
+import shutil
+import time
+
+from enum import Enum
+from pathlib import Path
+
+
+# What happens to the intermediate outputs (i.e., the trimmed CSVs) of an experiment once they have been processed by
+# the next stage.
+class E_RETENTION(Enum):
+    # the trimmed CSVs are kept
+    keep = "keep"
+    # each trimmed CSV is removed as soon as it has been decoded (and the decoded output recorded in the manifest);
+    # the manifest records that it has been removed on purpose, so the XMLdig file is not converted again
+    decoded = "decoded"
+
+
+# Returns the total size of the files in a directory (recursively).
+def get_directory_size(path: Path) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                # removed while walking the directory
+                continue
+    return size
+
+
+# The disk budget of a data directory: a maximum size of the directory itself, and a minimum of free space on its file
+# system (the watermark). Stages that produce large intermediate outputs (i.e., xmldig2csv) are throttled while the
+# budget is exceeded, see util.pipeline.
+class DiskBudget:
+    # @param max_size the maximum size of the data directory in bytes, or None for no limit
+    # @param min_free the minimum free space on the file system of the data directory in bytes, or None for no limit
+    # @param refresh_interval the size of the data directory is measured at most once in this interval (in seconds), as
+    #   this walks the whole directory; in between, the last size measured plus the files added since is used
+    def __init__(self, data_dir: Path, max_size: int = None, min_free: int = None, refresh_interval: float = 0):
+        self.data_dir = Path(data_dir)
+        self.max_size = max_size
+        self.min_free = min_free
+        self.refresh_interval = refresh_interval
+        # the last size of the data directory measured, and when it was measured (see time.monotonic)
+        self.size = None
+        self.measured_at = None
+
+    # Returns the size of the data directory, measured again if the last size is older than the refresh interval.
+    def get_size(self) -> int:
+        now = time.monotonic()
+        if self.size is None or now - self.measured_at >= self.refresh_interval:
+            self.size = get_directory_size(self.data_dir)
+            self.measured_at = now
+        return self.size
+
+    # Accounts for a file of the given size (in bytes) written to the data directory, until its size is measured again.
+    # Removed files are only accounted for by the next measurement, i.e., the size is overestimated until then.
+    def add(self, size: int):
+        if self.size is not None:
+            self.size += size
+
+    # Returns why the budget is exceeded, or None if it is not.
+    def check(self) -> str:
+        if self.min_free is not None:
+            free = shutil.disk_usage(self.data_dir).free
+            if free < self.min_free:
+                return f"{free / 2 ** 20:.0f} MiB free on the file system of {self.data_dir}, " \
+                       f"expected at least {self.min_free / 2 ** 20:.0f} MiB"
+        if self.max_size is not None:
+            size = self.get_size()
+            if size >= self.max_size:
+                return f"{self.data_dir} takes {size / 2 ** 20:.0f} MiB, " \
+                       f"expected at most {self.max_size / 2 ** 20:.0f} MiB"
+        return None
+
+
+# Returns the disk budget of the data directory configured by the DATA_DIR_MAX_SIZE (the maximum size of DATA_DIR) and
+# DATA_DIR_MIN_FREE (the minimum free space on its file system) env variables, both in MiB, or None if neither is set.
+# Requires the DATA_DIR env variable.
+# @param refresh_interval see DiskBudget
+def get_disk_budget(refresh_interval: float = 0):
+    if 'DATA_DIR_MAX_SIZE' not in os.environ and 'DATA_DIR_MIN_FREE' not in os.environ:
+        return None
+    max_size = int(os.getenv('DATA_DIR_MAX_SIZE')) * 2 ** 20 if 'DATA_DIR_MAX_SIZE' in os.environ else None
+    min_free = int(os.getenv('DATA_DIR_MIN_FREE')) * 2 ** 20 if 'DATA_DIR_MIN_FREE' in os.environ else None
+    data_dir = Path(os.getenv('DATA_DIR'))
+    data_dir.mkdir(parents=True, exist_ok=True)
+    return DiskBudget(data_dir, max_size, min_free, refresh_interval)
@@ -0,0 +1,228 @@
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import traceback
+
+from typing import Callable, Iterator
+
+from util.py_helper import printf
+
+# The status of a job of the decode server.
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+# Returns the path of the socket of the decode server, set by the DECODE_SOCKET env variable (default: in
+# XDG_RUNTIME_DIR or /tmp). A socket cannot be on a network file system like the scope share, so it is not in DATA_DIR.
+def get_socket_path() -> str:
+    if 'DECODE_SOCKET' in os.environ:
+        return os.getenv('DECODE_SOCKET')
+    return os.path.join(os.getenv('XDG_RUNTIME_DIR', '/tmp'), f"decode-{os.getuid()}.sock")
+
+
+# A job of the decode server, e.g., decoding an experiment.
+class _Job:
+    def __init__(self, job_id: int, name: str, run: Callable[[], None]):
+        self.id = job_id
+        self.name = name
+        self.run = run
+        self.status = STATUS_QUEUED
+        self.error = None
+        self.t_submitted = time.time()
+        self.t_started = None
+        self.t_finished = None
+
+    def is_finished(self) -> bool:
+        return self.status in (STATUS_DONE, STATUS_FAILED)
+
+    # Returns the job as it is sent to the clients.
+    def describe(self) -> dict:
+        job = {'job': self.id, 'name': self.name, 'status': self.status}
+        if self.t_started is not None:
+            job['seconds'] = round((self.t_finished or time.time()) - self.t_started, 3)
+        if self.error is not None:
+            job['error'] = self.error
+        return job
+
+
+# A long-running server that runs jobs (e.g., decoding the experiments of XMLDIG_DIR) submitted by clients on a Unix
+# domain socket, so that the interpreter, the imported modules and the compiled command tables, and the pool of
+# workers are set up once rather than for each job. At most max_jobs jobs run at once, each in a thread of the server;
+# the jobs share whatever create_jobs passes to them (e.g., the pool).
+# The clients send a request (a JSON object) per connection and receive JSON lines until the server closes it:
+#   {"command": "submit", ..., "wait": true}: queues the jobs that create_jobs returns for the request (or raises a
+#     ValueError for). Replies with each job as queued and, if wait, again as it finishes. A job with the name of a job
+#     that is queued or running is not queued again, but that job is replied instead.
+#   {"command": "status"}: replies with the jobs that are queued or running and the number of those finished.
+#   {"command": "shutdown"}: stops accepting jobs, waits for those queued or running, replies and stops the server.
+# Invalid requests are replied with {"error": ...}.
+# @param create_jobs returns the name and the function to run of each job of a submit request
+class DecodeServer:
+    def __init__(self, socket_path: str, create_jobs: Callable[[dict], list[tuple[str, Callable[[], None]]]],
+                 max_jobs: int):
+        assert max_jobs > 0, "the server must run at least one job at once"
+        self.socket_path = socket_path
+        self.create_jobs = create_jobs
+        self.max_jobs = max_jobs
+        self.__jobs: dict[int, _Job] = dict()
+        # the jobs that are queued or running by name
+        self.__active: dict[str, _Job] = dict()
+        self.__queue: queue.Queue[_Job] = queue.Queue()
+        # guards the jobs, and is notified whenever a job finishes
+        self.__changed = threading.Condition()
+        self.__shutting_down = False
+        self.__stopped = threading.Event()
+
+    # Binds the socket, unless another server is listening on it already.
+    def __bind(self) -> socket.socket:
+        if os.path.exists(self.socket_path):
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                    s.connect(self.socket_path)
+                raise Exception(f"[-] a decode server is already listening on {self.socket_path}")
+            except ConnectionRefusedError:
+                # left behind by a server that has been killed
+                os.unlink(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        listener.listen()
+        return listener
+
+    # Serves until shut down by a client or interrupted (e.g., by Ctrl+C); the jobs that are still running are
+    # abandoned then.
+    def serve(self):
+        listener = self.__bind()
+        try:
+            for i in range(self.max_jobs):
+                threading.Thread(target=self.__run_jobs, name=f"job-{i}", daemon=True).start()
+            threading.Thread(target=self.__accept, args=(listener,), name="accept", daemon=True).start()
+            printf(f"decode server listening on {self.socket_path} (running at most {self.max_jobs} job(s) at once)")
+            self.__stopped.wait()
+            printf("decode server stopped")
+        except KeyboardInterrupt:
+            printf("decode server interrupted")
+        finally:
+            listener.close()
+            os.unlink(self.socket_path)
+
+    def __accept(self, listener: socket.socket):
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=self.__handle, args=(conn,), name="client", daemon=True).start()
+
+    def __run_jobs(self):
+        while True:
+            job = self.__queue.get()
+            with self.__changed:
+                job.status = STATUS_RUNNING
+                job.t_started = time.time()
+            printf(f"job {job.id} ({job.name}) started")
+            try:
+                job.run()
+                status, error = STATUS_DONE, None
+            except Exception as e:
+                printf(f"job {job.id} ({job.name}) failed:\n{traceback.format_exc()}")
+                status, error = STATUS_FAILED, str(e) or type(e).__name__
+            with self.__changed:
+                job.status, job.error = status, error
+                job.t_finished = time.time()
+                del self.__active[job.name]
+                self.__changed.notify_all()
+            printf(f"job {job.id} ({job.name}) {status} in {job.t_finished - job.t_started:.3f} seconds")
+
+    # Handles the request of a client.
+    def __handle(self, conn: socket.socket):
+        try:
+            with conn, conn.makefile("rw") as f:
+                def reply(message: dict):
+                    f.write(json.dumps(message) + "\n")
+                    f.flush()
+
+                try:
+                    request = json.loads(f.readline())
+                    command = request.get('command')
+                    if command == "submit":
+                        self.__submit(request, reply)
+                    elif command == "status":
+                        self.__status(reply)
+                    elif command == "shutdown":
+                        self.__shutdown(reply)
+                    else:
+                        reply({'error': f"unknown command: {command}"})
+                except (BrokenPipeError, ConnectionResetError):
+                    raise
+                except Exception as e:
+                    # e.g., invalid JSON or invalid arguments of the jobs
+                    reply({'error': str(e)})
+        except (BrokenPipeError, ConnectionResetError):
+            # e.g., the client has been interrupted while waiting for its jobs; they keep running
+            pass
+
+    def __submit(self, request: dict, reply: Callable[[dict], None]):
+        # validates the request before any job is queued
+        jobs = self.create_jobs(request)
+        submitted = list()
+        with self.__changed:
+            if self.__shutting_down:
+                raise ValueError("the decode server is shutting down")
+            for name, run in jobs:
+                if name not in self.__active:
+                    job = _Job(len(self.__jobs) + 1, name, run)
+                    self.__jobs[job.id] = job
+                    self.__active[name] = job
+                    self.__queue.put(job)
+                submitted.append(self.__active[name])
+            replies = [job.describe() for job in submitted]
+        for message in replies:
+            reply(message)
+        if not request.get('wait', True):
+            return
+
+        # reply with each job as it finishes
+        pending = list(submitted)
+        while pending:
+            with self.__changed:
+                self.__changed.wait_for(lambda: any(job.is_finished() for job in pending))
+                finished = [job for job in pending if job.is_finished()]
+                replies = [job.describe() for job in finished]
+            pending = [job for job in pending if job not in finished]
+            for message in replies:
+                reply(message)
+
+    def __status(self, reply: Callable[[dict], None]):
+        with self.__changed:
+            jobs = [job for job in self.__jobs.values() if not job.is_finished()]
+            status = {
+                'jobs': [job.describe() for job in jobs],
+                STATUS_DONE: sum(job.status == STATUS_DONE for job in self.__jobs.values()),
+                STATUS_FAILED: sum(job.status == STATUS_FAILED for job in self.__jobs.values()),
+                'shutting_down': self.__shutting_down,
+            }
+        reply(status)
+
+    def __shutdown(self, reply: Callable[[dict], None]):
+        with self.__changed:
+            self.__shutting_down = True
+            self.__changed.wait_for(lambda: not self.__active)
+        reply({'status': "stopped"})
+        self.__stopped.set()
+
+
+# Sends a request to the decode server (see DecodeServer) and yields its replies.
+def request_server(socket_path: str, request: dict) -> Iterator[dict]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise Exception(f"[-] no decode server is listening on {socket_path}, see decode.py serve")
+        with s.makefile("rw") as f:
+            f.write(json.dumps(request) + "\n")
+            f.flush()
+            for line in f:
+                yield json.loads(line)
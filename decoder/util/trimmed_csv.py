@@ -0,0 +1,199 @@
+import mmap
+
+import numpy as np
+
+from pathlib import Path
+
+# ASCII codes of the characters we need to look at when scanning the raw CSV bytes.
+_NEWLINE = ord('\n')
+_COMMA = ord(',')
+_ZERO = ord('0')
+_NINE = ord('9')
+
+# Value stored in a bit column for cells that are neither exactly '0' nor exactly '1'.
+BIT_INVALID = 2
+
+# Value stored in an integer column for cells that are missing in a (malformed) line.
+INT_MISSING = -1
+
+# The file is scanned in blocks of (roughly) this many bytes so that the temporary arrays stay small.
+DEFAULT_BLOCK_SIZE = 64 * 1024 * 1024
+
+
+# A trimmed CSV file (as written by xmldig2csv) whose signal columns are parsed into NumPy arrays.
+# The file is memory-mapped and scanned block by block; only the requested columns are kept.
+# Row r of every array corresponds to the r-th loaded line; if the whole file is loaded, that is line r+1 of the file
+# (line 0 is the header).
+# @param data the content of the file if it is not to be read from path (e.g., the header and the lines of a stream
+#   that have arrived so far)
+# @param truncated whether more lines follow data, i.e., the last line in data is not the last line of the file
+class TrimmedCsv:
+    def __init__(self, path: Path, data: bytes = None, truncated: bool = False):
+        self.path = Path(path)
+        self.truncated = truncated
+        if data is not None:
+            self.data = data
+        else:
+            size = self.path.stat().st_size
+            assert size > 0, "ERROR: empty CSV file found!"
+            with self.path.open("rb") as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header_end = self.data.find(b'\n')
+        header_end = len(self.data) if header_end < 0 else header_end + 1
+        # keep the raw column names (incl. the newline of the last one) as DramCommand works with these
+        self.column_names: list[str] = self.data[:header_end].decode().split(',')
+        self.__stripped_names = [n.strip() for n in self.column_names]
+        self.__header_end = header_end
+        self.__load_end = header_end
+        self.num_rows = 0
+        self.line_starts = np.zeros(0, dtype=np.int64)
+        self.complete = np.zeros(0, dtype=bool)
+        self.bits: dict[str, np.ndarray] = dict()
+        self.ints: dict[str, np.ndarray] = dict()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Returns the index of a column, ignoring surrounding whitespace (like get_value_by_name in s2_decode).
+    def index(self, name: str) -> int:
+        return self.__stripped_names.index(name.strip())
+
+    # Returns the raw fields of a loaded row, exactly like csvlines[line_no].split(',') would.
+    def fields(self, row: int) -> list[str]:
+        start = int(self.line_starts[row])
+        end = int(self.line_starts[row + 1]) if row + 1 < self.num_rows else self.__load_end
+        return self.data[start:end].decode().split(',')
+
+    # Returns a single raw field of a loaded row, like fields(row)[col] but without splitting the rest of the line.
+    def cell(self, row: int, col: int) -> str:
+        start = int(self.line_starts[row])
+        end = int(self.line_starts[row + 1]) if row + 1 < self.num_rows else self.__load_end
+        return self.data[start:end].split(b',', col + 1)[col].decode()
+
+    # Returns the size of the file in bytes.
+    def size(self) -> int:
+        return len(self.data)
+
+    # Returns the offset of the first line starting at or after pos.
+    def align(self, pos: int) -> int:
+        if pos <= self.__header_end:
+            return self.__header_end
+        if pos >= len(self.data):
+            return len(self.data)
+        end = self.data.find(b'\n', pos - 1)
+        return len(self.data) if end < 0 else end + 1
+
+    # Splits the data lines of the file into newline-aligned byte ranges [begin, end) of roughly chunk_size bytes.
+    def split(self, chunk_size: int) -> list[tuple[int, int]]:
+        chunks = list()
+        begin = self.__header_end
+        while begin < len(self.data):
+            end = self.align(begin + max(chunk_size, 1))
+            chunks.append((begin, end))
+            begin = end
+        return chunks
+
+    # Parses the given columns of all lines starting within data[begin:end] (by default, all data lines) in a single
+    # pass. begin and end must be line boundaries, see align().
+    # @param bit_columns columns holding 0/1 values; any other content is stored as BIT_INVALID
+    # @param int_columns columns holding integers (e.g., cycle_cnt)
+    def load(self, bit_columns: list[str], int_columns: list[str], begin: int = None, end: int = None,
+             block_size: int = DEFAULT_BLOCK_SIZE):
+        bit_idx = {name: self.index(name) for name in bit_columns}
+        int_idx = {name: self.index(name) for name in int_columns}
+        parts = list()
+        pos = self.__header_end if begin is None else begin
+        load_end = len(self.data) if end is None else end
+        while pos < load_end:
+            end = self.data.rfind(b'\n', pos, min(pos + block_size, load_end)) + 1
+            if end <= pos:
+                # a single line longer than block_size
+                end = self.data.find(b'\n', pos + block_size, load_end) + 1
+                end = load_end if end <= 0 else end
+            parts.append(self.__parse_block(pos, end, bit_idx, int_idx))
+            pos = end
+
+        self.__load_end = load_end
+        self.line_starts = np.concatenate([p[0] for p in parts] or [np.zeros(0, dtype=np.int64)])
+        self.complete = np.concatenate([p[1] for p in parts] or [np.zeros(0, dtype=bool)])
+        self.num_rows = len(self.line_starts)
+        self.bits = {name: np.concatenate([p[2][name] for p in parts] or [np.zeros(0, dtype=np.uint8)])
+                     for name in bit_columns}
+        self.ints = {name: np.concatenate([p[3][name] for p in parts] or [np.zeros(0, dtype=np.int64)])
+                     for name in int_columns}
+        return self
+
+    # Returns whether the last loaded row is the last line of the file.
+    def loaded_until_eof(self) -> bool:
+        return self.__load_end >= len(self.data) and not self.truncated
+
+    # Parses the complete lines within data[begin:end].
+    def __parse_block(self, begin: int, end: int, bit_idx: dict, int_idx: dict):
+        buf = np.frombuffer(self.data, dtype=np.uint8, count=end - begin, offset=begin)
+        line_ends = np.flatnonzero(buf == _NEWLINE)
+        # like readlines(), we also return the last line if it is not terminated by a newline
+        if len(line_ends) == 0 or line_ends[-1] != len(buf) - 1:
+            line_ends = np.append(line_ends, len(buf))
+        line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+        # a cell of the last column ends after the newline, as in str.split(',') on a line returned by readlines()
+        line_ends_incl = np.minimum(line_ends + 1, len(buf))
+
+        commas = np.flatnonzero(buf == _COMMA)
+        first_comma = np.searchsorted(commas, line_starts)
+        num_commas = np.searchsorted(commas, line_ends) - first_comma
+        num_cols = len(self.column_names)
+        # a regex built by DramCommand.get_regexes cannot match lines that lack some of the separators
+        complete = num_commas >= num_cols - 1
+
+        def cell_bounds(col: int):
+            if col == 0:
+                starts = line_starts
+            else:
+                i = np.minimum(first_comma + col - 1, max(len(commas) - 1, 0))
+                starts = np.where(num_commas >= col, commas[i] + 1 if len(commas) else 0, -1)
+            i = np.minimum(first_comma + col, max(len(commas) - 1, 0))
+            ends = np.where(num_commas > col, commas[i] if len(commas) else 0, line_ends_incl)
+            ends = np.where(starts < 0, -1, ends)
+            return starts, ends
+
+        bits = dict()
+        for name, col in bit_idx.items():
+            starts, ends = cell_bounds(col)
+            single = (ends - starts) == 1
+            value = buf[np.clip(starts, 0, max(len(buf) - 1, 0))].astype(np.int16) - _ZERO
+            bits[name] = np.where(single & (value >= 0) & (value <= 1), value, BIT_INVALID).astype(np.uint8)
+
+        ints = dict()
+        for name, col in int_idx.items():
+            starts, ends = cell_bounds(col)
+            ints[name] = self.__parse_ints(buf, begin, starts, ends)
+
+        return line_starts + begin, complete, bits, ints
+
+    # Parses decimal integers in buf[starts[i]:ends[i]] digit by digit over all rows at once.
+    # Cells with other characters (signs, whitespace) are handed to int() instead; INT_MISSING if that fails too.
+    def __parse_ints(self, buf: np.ndarray, begin: int, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        lengths = np.where(starts < 0, 0, ends - starts)
+        values = np.zeros(len(starts), dtype=np.int64)
+        non_digit = np.zeros(len(starts), dtype=bool)
+        for k in range(int(lengths.max()) if len(lengths) else 0):
+            has_digit = lengths > k
+            ch = buf[np.where(has_digit, starts + k, 0)]
+            is_digit = (ch >= _ZERO) & (ch <= _NINE)
+            non_digit |= has_digit & ~is_digit
+            values = np.where(has_digit & is_digit, values * 10 + (ch.astype(np.int64) - _ZERO), values)
+        non_digit |= (lengths == 0)
+        for i in np.flatnonzero(non_digit & (starts >= 0)):
+            try:
+                values[i] = int(self.data[begin + starts[i]:begin + ends[i]].decode())
+            except ValueError:
+                values[i] = INT_MISSING
+        values[starts < 0] = INT_MISSING
+        return values
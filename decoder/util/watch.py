@@ -0,0 +1,243 @@
+import ctypes
+import os
+import select
+import struct
+import time
+
+from pathlib import Path
+
+# The interval (in seconds) in which PollingWatcher scans the watched directories.
+POLL_INTERVAL = 2
+
+# The file systems on which inotify does not see the changes made by other hosts (e.g., the scope writing to a
+# mounted share), so the watched directories are polled instead.
+NETWORK_FILE_SYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "fuse.sshfs", "afs", "ceph", "glusterfs"}
+
+# The inotify constants, see inotify(7).
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+# Returns the file system type of the mount that a path is on (e.g., ext4 or cifs), or None if it is unknown.
+def get_file_system_type(path: Path) -> str:
+    path = os.path.realpath(path)
+    fs_type, mount_point_length = None, -1
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # spaces in mount points are escaped as \040
+                mount_point = fields[1].replace("\\040", " ")
+                if (path == mount_point or path.startswith(mount_point.rstrip("/") + "/")) \
+                        and len(mount_point) > mount_point_length:
+                    fs_type, mount_point_length = fields[2], len(mount_point)
+    except OSError:
+        return None
+    return fs_type
+
+
+# Returns the libc functions of inotify, or None if they are not available (e.g., not on Linux).
+def __get_inotify():
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc if hasattr(libc, "inotify_init1") else None
+    except OSError:
+        return None
+
+
+_libc = __get_inotify()
+
+
+# Watches a directory and its subdirectories (one level deep, e.g., the experiments in XMLDIG_DIR) for files with a
+# given suffix that are complete, and returns the paths of such files from wait() as they appear. A file that is written
+# again is returned again. The directories are scanned periodically, and a file is complete once its size and
+# modification time did not change between two scans.
+class PollingWatcher:
+    def __init__(self, root: Path, suffix: str, interval: float = POLL_INTERVAL):
+        self.root = Path(root)
+        self.suffix = suffix
+        self.interval = interval
+        # the time of the next scan
+        self._next_scan = time.monotonic()
+        # the size and modification time of each file at the last scan, and at the time it was returned
+        self.__scanned: dict[Path, tuple[int, int]] = dict()
+        self.__returned: dict[Path, tuple[int, int]] = dict()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Returns the watched directories.
+    def _get_dirs(self) -> list[Path]:
+        try:
+            return [self.root] + sorted(Path(entry.path) for entry in os.scandir(self.root)
+                                        if entry.is_dir() and not entry.name.startswith("."))
+        except FileNotFoundError:
+            return list()
+
+    # Returns whether a file is one of the watched files (rather than, e.g., a temporary file).
+    def _is_watched(self, path: Path) -> bool:
+        return path.name.endswith(self.suffix) and not path.name.startswith(".")
+
+    # Returns the size and modification time of the given files (those that still exist).
+    @staticmethod
+    def _stat(paths) -> dict[Path, tuple[int, int]]:
+        files = dict()
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            files[Path(path)] = (st.st_size, st.st_mtime_ns)
+        return files
+
+    # Returns the watched files in the given directories.
+    def _list(self, dirs: list[Path]) -> list[Path]:
+        paths = list()
+        for directory in dirs:
+            try:
+                paths += [Path(directory) / name for name in os.listdir(directory)]
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+        return [path for path in paths if self._is_watched(path)]
+
+    # Returns the scanned files that did not change since the last scan and have not been returned with the same size
+    # and modification time before.
+    # @param scanned the size and modification time of each file, see _stat
+    def _get_complete_files(self, scanned: dict[Path, tuple[int, int]]) -> list[Path]:
+        complete = [path for path, info in scanned.items()
+                    if self.__scanned.get(path) == info and self.__returned.get(path) != info]
+        self.__scanned.update(scanned)
+        for path in complete:
+            self.__returned[path] = scanned[path]
+        return sorted(complete)
+
+    # Records that a file has been returned (e.g., as inotify reported it), so that a scan does not return it again.
+    def _set_returned(self, path: Path):
+        for path, info in self._stat([path]).items():
+            self.__scanned[path] = self.__returned[path] = info
+
+    # Waits at most timeout seconds for complete files and returns them.
+    def wait(self, timeout: float) -> list[Path]:
+        delay = self._next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return list()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_scan = time.monotonic() + self.interval
+        return self._get_complete_files(self._stat(self._list(self._get_dirs())))
+
+
+# Watches like PollingWatcher, but is notified by inotify as soon as a file is closed after writing (or moved into a
+# watched directory). Only the files that were there before their directory has been watched (e.g., when the watcher is
+# started) are polled until they are complete.
+class InotifyWatcher(PollingWatcher):
+    def __init__(self, root: Path, suffix: str, interval: float = POLL_INTERVAL):
+        super().__init__(root, suffix, interval)
+        self.__fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # the watched directory of each watch descriptor
+        self.__dirs: dict[int, Path] = dict()
+        # the files that have not been reported by inotify, as they were there before their directory has been watched
+        self.__unreported: set[Path] = set()
+        self.__add_watch(self.root)
+        for directory in self._get_dirs()[1:]:
+            self.__add_watch(directory)
+
+    def close(self):
+        if self.__fd >= 0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+    def __add_watch(self, directory: Path):
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_ONLYDIR | (IN_CREATE if directory == self.root else 0)
+        wd = _libc.inotify_add_watch(self.__fd, os.fsencode(directory), mask)
+        if wd < 0:
+            # e.g., removed meanwhile
+            return
+        self.__dirs[wd] = directory
+        self.__poll(self._list([directory]))
+
+    # Polls files until they are complete, e.g., as their events may have been missed.
+    def __poll(self, paths: list[Path]):
+        self.__unreported.update(paths)
+        # the first scan, see _get_complete_files
+        self._get_complete_files(self._stat(paths))
+
+    # Reads the pending events and returns the files that are complete.
+    def __read_events(self) -> list[Path]:
+        complete = list()
+        while True:
+            try:
+                buffer = os.read(self.__fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            except InterruptedError:
+                continue
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+                name = buffer[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0")
+                offset += INOTIFY_EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # events have been lost
+                    self.__poll(self._list(list(self.__dirs.values())))
+                elif mask & IN_IGNORED:
+                    # the directory has been removed
+                    self.__dirs.pop(wd, None)
+                elif wd in self.__dirs:
+                    path = self.__dirs[wd] / os.fsdecode(name)
+                    if mask & IN_ISDIR:
+                        if self.__dirs[wd] == self.root and not path.name.startswith("."):
+                            self.__add_watch(path)
+                    elif self._is_watched(path):
+                        complete.append(path)
+                        self.__unreported.discard(path)
+                        self._set_returned(path)
+        return complete
+
+    def wait(self, timeout: float) -> list[Path]:
+        deadline = time.monotonic() + timeout
+        while True:
+            complete = self.__read_events()
+            if self.__unreported and time.monotonic() >= self._next_scan:
+                self._next_scan = time.monotonic() + self.interval
+                scanned = self._stat(self.__unreported)
+                polled = self._get_complete_files(scanned)
+                # the files that are complete or have been removed are not polled anymore
+                self.__unreported.intersection_update(path for path in scanned if path not in polled)
+                complete += polled
+            if complete:
+                return complete
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return list()
+            if self.__unreported:
+                remaining = min(remaining, max(self._next_scan - time.monotonic(), 0))
+            select.select([self.__fd], [], [], remaining)
+
+
+# Returns a watcher (see PollingWatcher) for a directory, which uses inotify unless it is not available or the
+# directory is on a network file system (see NETWORK_FILE_SYSTEMS).
+# @param poll whether to poll even if inotify is available
+def get_watcher(root: Path, suffix: str, poll: bool = False) -> PollingWatcher:
+    if poll or _libc is None or get_file_system_type(root) in NETWORK_FILE_SYSTEMS:
+        return PollingWatcher(root, suffix)
+    return InotifyWatcher(root, suffix)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# Measures the startup time of the entry points of the decoder, as thousands of short decoder processes are launched per
+# campaign. Each mode is started several times in a fresh interpreter; the wall time until it exits and the time spent
+# importing modules (by python -X importtime) are reported, along with the modules that take the longest to import.
+# Usage: bench_startup.py [--repeat N] [--top N] [--python PYTHON] [mode ...]
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+
+DECODER_DIR = Path(__file__).resolve().parent.parent / "decoder"
+
+# The modes that are measured by default: the command line (relative to DECODER_DIR) of each. The modes exit right
+# after parsing their arguments, so only their startup is measured.
+MODES = {
+   "decode --help": ["decode.py", "--help"],
+   "client --help": ["decode.py", "client", "--help"],
+   "gc --help": ["decode.py", "gc", "--help"],
+   "configure --help": ["configure.py", "--help"],
+   "acquire --help": ["acquire.py", "--help"],
+   # what a decoding process imports before it decodes, see decode.decode_experiment
+   "decode stages": ["-c", "import stages.s0_xmldigtocsv, stages.s2_decode, stages.s3_analyze"],
+   # loading the command tables, see util.dram_command.get_command_table
+   "command tables": ["-c", "from util.dram_command import E_DRAM_TYPE, get_command_table; "
+                            "[get_command_table(t) for t in E_DRAM_TYPE]"],
+}
+
+
+# Parses the output of python -X importtime and returns the total import time and the cumulative import time of each
+# module imported directly (i.e., not by another module), both in microseconds.
+def parse_importtime(stderr: str) -> tuple[int, dict[str, int]]:
+   modules = dict()
+   for line in stderr.splitlines():
+      if not line.startswith("import time:") or "|" not in line:
+         continue
+      _, cumulative, name = line[len("import time:"):].split("|")
+      if cumulative.strip().isdigit() and not name.startswith("  "):
+         modules[name.strip()] = int(cumulative)
+   return sum(modules.values()), modules
+
+
+# Runs a mode once and returns its wall time (in seconds), its total import time (in microseconds) and the cumulative
+# import time of each module imported directly.
+def run_mode(python: str, args: list[str]) -> tuple[float, int, dict[str, int]]:
+   t_start = time.perf_counter()
+   # the modules of the decoder are found in the working directory by -c as well
+   result = subprocess.run([python, "-X", "importtime"] + args, cwd=DECODER_DIR, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.PIPE, text=True)
+   wall_time = time.perf_counter() - t_start
+   if result.returncode != 0:
+      # e.g., a dependency that is not installed; its traceback follows the import times
+      lines = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+      raise Exception(f"{' '.join(args)} failed with exit code {result.returncode}:\n" + "\n".join(lines))
+   return (wall_time,) + parse_importtime(result.stderr)
+
+
+def main():
+   parser = argparse.ArgumentParser(description="Measures the startup time of the entry points of the decoder.",
+                                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+   parser.add_argument("modes", nargs="*", default=list(MODES), help=f"the modes to measure, of: {', '.join(MODES)}")
+   parser.add_argument("--repeat", type=int, default=10, help="the number of runs of each mode")
+   parser.add_argument("--top", type=int, default=5, help="the number of slowest imports listed for each mode")
+   parser.add_argument("--python", default=sys.executable, help="the interpreter to run the modes with")
+   config = parser.parse_args()
+   for mode in config.modes:
+      if mode not in MODES:
+         parser.error(f"unknown mode: {mode}")
+
+   # the command tables are cached after the first run (see util.dram_command.load_command_table), like in a campaign
+   print(f"{'mode':<18} {'wall (ms)':>10} {'min (ms)':>10} {'imports (ms)':>13}")
+   for mode in config.modes:
+      runs = [run_mode(config.python, MODES[mode]) for _ in range(config.repeat + 1)][1:]
+      wall_times = [wall_time for wall_time, _, _ in runs]
+      import_times = [import_time for _, import_time, _ in runs]
+      print(f"{mode:<18} {statistics.median(wall_times) * 1000:>10.1f} {min(wall_times) * 1000:>10.1f} "
+            f"{statistics.median(import_times) / 1000:>13.1f}")
+      modules = runs[-1][2]
+      for name in sorted(modules, key=modules.get, reverse=True)[:config.top]:
+         print(f"   {name:<40} {modules[name] / 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+   main()
@@ -8,6 +8,9 @@ from pathlib import Path
 import sys
 from typing import Optional
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "decoder"))
+from util.codec import open_file, strip_codec_suffix
+
 
 """
 Checks the distribution of all bg,bk,row bits in ACTs.
@@ -32,7 +35,7 @@ def addr_bits_to_str(addr_bits: tuple) -> str:
 
 # Returns a list of all ACT commands, as tuples of (bg, bk, row).
 def get_acts_from_trace(trace_file: Path) -> list[tuple[str, str, str]]:
-    with trace_file.open("r") as f:
+    with open_file(trace_file, "r") as f:
         reader = csv.DictReader(f)
 
         acts = []
@@ -114,6 +117,9 @@ if __name__ == "__main__":
             continue
         print(f"Processing iteration '{iter_dir.name}'...")
         for trace_file in iter_dir.iterdir():
+            # skip the temporary files of outputs that are still being written, and the binary outputs
+            if trace_file.name.startswith(".") or not strip_codec_suffix(trace_file.name).endswith(".csv"):
+                continue
             acts = get_acts_from_trace(trace_file)
             print(f"  Loaded {len(acts)} from '{trace_file.name}'.")
             if not(acts):
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# Checks that the regex and the vectorized engine of the decoder (see stages.s2_decode) decode the trimmed CSVs in
+# golden/ to exactly the decoded CSVs stored next to them, the vectorized engine also with chunks of a few rows or less,
+# so that chunk boundaries split the two cycles of commands. The trimmed CSVs are excerpts of traces: the cycles of the
+# DDR5 one jump back halfway through, and the DDR4 one has no trailing newline.
+# Usage: check_engines.py [--update]
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "decoder"))
+from stages.s2_decode import decode_all
+from util.dram_command import E_DRAM_TYPE
+from util.options import E_DECODE_ENGINE
+from util.py_helper import WARNING, set_log_level
+
+GOLDEN_DIR = Path(__file__).resolve().parent / "golden"
+
+# The chunk sizes (in bytes) the vectorized engine is checked with: less than a row, a few rows, and the whole file.
+CHUNK_SIZES = [64, 300, 100000]
+
+# The files are decoded by this many workers, i.e., their chunks are decoded in parallel as well.
+NUM_WORKERS = 2
+
+
+# Decodes a trimmed CSV in a DATA_DIR of its own and returns the decoded CSV.
+def decode(dram_type: E_DRAM_TYPE, trimmed_csv: Path, engine: E_DECODE_ENGINE, chunk_size: int) -> bytes:
+   with tempfile.TemporaryDirectory() as data_dir:
+      os.environ['DATA_DIR'] = data_dir
+      in_dir = Path(data_dir) / "trimmedcsv" / "golden"
+      in_dir.mkdir(parents=True)
+      shutil.copy(trimmed_csv, in_dir / trimmed_csv.name)
+      decode_all(dram_type, "golden", NUM_WORKERS, engine, chunk_size)
+      return (Path(data_dir) / "decoded" / "golden" / trimmed_csv.name).read_bytes()
+
+
+def main():
+   parser = argparse.ArgumentParser(description="Checks that both decode engines produce the golden decoded CSVs.")
+   parser.add_argument("--update",
+                       action="store_true",
+                       help="rewrite the golden decoded CSVs with the output of the regex engine instead (e.g., after "
+                            "the output format changed on purpose)")
+   config = vars(parser.parse_args())
+   # the decoded outputs must not be taken from a cache
+   os.environ.pop('DECODE_CACHE_DIR', None)
+   set_log_level(WARNING)
+
+   num_failed = 0
+   for dram_type in E_DRAM_TYPE:
+      trimmed_csv = GOLDEN_DIR / f"{dram_type.name}.csv"
+      golden_csv = GOLDEN_DIR / f"{dram_type.name}.decoded.csv"
+      if config['update']:
+         golden_csv.write_bytes(decode(dram_type, trimmed_csv, E_DECODE_ENGINE.regex, CHUNK_SIZES[-1]))
+         print(f"[+] updated {golden_csv.name}")
+         continue
+      golden = golden_csv.read_bytes()
+      runs = [(E_DECODE_ENGINE.regex, CHUNK_SIZES[-1])] + [(E_DECODE_ENGINE.vectorized, size) for size in CHUNK_SIZES]
+      for engine, chunk_size in runs:
+         same = decode(dram_type, trimmed_csv, engine, chunk_size) == golden
+         print(f"[{'+' if same else '-'}] {dram_type.value}, {engine.value} engine, chunks of {chunk_size} bytes: "
+               f"{'same as' if same else 'differs from'} {golden_csv.name}")
+         num_failed += not same
+   sys.exit(1 if num_failed else 0)
+
+
+if __name__ == "__main__":
+   main()
@@ -5,8 +5,7 @@ export XMLDIG_DIR="$1"
 export DATA_DIR="${XMLDIG_DIR}/data"
 PYTHON_BIN_DIR="../decoder/venv/bin"
 
-for f in `find ${XMLDIG_DIR} -mindepth 1 -maxdepth 1 -type d -not -path './data' -exec basename {} \;`; do 
-	"$PYTHON_BIN_DIR/python3" ../decoder/decode.py --ddr4 -e "$f"
-done
+# all experiments (i.e., subdirectories other than DATA_DIR) are decoded on the same workers
+"$PYTHON_BIN_DIR/python3" ../decoder/decode.py --ddr4 -e '*'
 
 
@@ -1,21 +1,24 @@
 #!/usr/bin/env python3
 
-from glob import glob
+# Decodes the experiments in a folder of the scope share as the scope saves their files, see decode.py --watch.
+
+import os
 import sys
 import subprocess
 
 watch_dir = sys.argv[1]
-print(f"[>] watching dir: {watch_dir}")
-
-decoded_dirs = set()
+folder = f"/mnt/scope-data/{watch_dir}".rstrip("/")
+print(f"[>] watching dir: {folder}")
 
-while True:
-   for f in glob(f"/mnt/scope-data/{watch_dir}/it=*"):
-      # folder has been decoded before
-      if f in decoded_dirs:
-         continue
-      # decode folder
-      rc = subprocess.call(f"./decode_parallel.sh {f}", shell=True)
-      decoded_dirs.add(f)
-   sleep(30)
+# the same environment as decode_parallel.sh
+env = dict(os.environ)
+env["XMLDIG2CSV_PATH"] = os.path.expanduser("~/git/xmldig2csv-converter/xmldig2csv")
+env["XMLDIG_DIR"] = folder
+env["DATA_DIR"] = f"{folder}/data"
 
+try:
+   rc = subprocess.call(["../decoder/venv/bin/python3", "../decoder/decode.py", "--ddr4", "--watch"], env=env)
+except KeyboardInterrupt:
+   # the decoder has been interrupted as well and stops on its own
+   rc = 130
+sys.exit(rc)
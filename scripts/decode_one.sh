@@ -6,8 +6,8 @@ export XMLDIG2CSV_PATH="$HOME/git/xmldig2csv-converter/xmldig2csv"
 export XMLDIG_DIR="$(realpath "$1")"
 export DATA_DIR="${XMLDIG_DIR}/data"
 
-# enable to see print_debug messages
-#export DEBUG="1"
+# enable to see debug messages (debug, info, warning or error; DEBUG="1" works as well)
+#export LOG_LEVEL="debug"
 
 cd "$HOME/git/teledyne-scope/decoder"
 source ../decoder/venv/bin/activate
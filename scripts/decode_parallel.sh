@@ -16,6 +16,23 @@ PYTHON_BIN_DIR="../decoder/venv/bin"
 # find "${XMLDIG_DIR}" -maxdepth 1 -iname "it=*" -type d \
 # 	| parallel --jobs 64 NUM_WORKERS=6 "$PYTHON_BIN_DIR/python3" ../decoder/decode.py -e {}
 
-find "${XMLDIG_DIR}" -maxdepth 1 -iname "it=*" -type d | \
-	rev | cut -d/ -f1 | rev | \
-	parallel --jobs 16 NUM_WORKERS=6 "$PYTHON_BIN_DIR/python3 ../decoder/decode.py --ddr4 -e {}"
+# find "${XMLDIG_DIR}" -maxdepth 1 -iname "it=*" -type d | \
+# 	rev | cut -d/ -f1 | rev | \
+# 	parallel --jobs 16 NUM_WORKERS=6 "$PYTHON_BIN_DIR/python3 ../decoder/decode.py --ddr4 -e {}"
+
+# decode all iterations (i.e., the experiments named it=*, like above) with a single decode server, i.e., with one pool
+# of workers rather than an interpreter and a pool for each iteration
+export DECODE_SOCKET="${XDG_RUNTIME_DIR:-/tmp}/decode-$(basename "${XMLDIG_DIR}").sock"
+export NUM_WORKERS="${NUM_WORKERS:-96}"
+"$PYTHON_BIN_DIR/python3" ../decoder/decode.py serve --max-jobs 16 &
+SERVER_PID=$!
+trap 'kill $SERVER_PID 2>/dev/null' EXIT
+until [ -S "${DECODE_SOCKET}" ]; do
+	kill -0 $SERVER_PID 2>/dev/null || exit 1
+	sleep 0.1
+done
+"$PYTHON_BIN_DIR/python3" ../decoder/decode.py client submit -e 'it=*' --ddr4
+RC=$?
+"$PYTHON_BIN_DIR/python3" ../decoder/decode.py client shutdown
+wait $SERVER_PID
+exit $RC
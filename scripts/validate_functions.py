@@ -6,6 +6,10 @@ import os
 import sys
 
 from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "decoder"))
+from util.codec import open_file
 
 NUM='*'
 
@@ -47,12 +51,14 @@ checked_clusters = set()
 num_observable = 0
 bgbk2cluster = dict()
 print("[+] parsing decoded command data..")
-for f_decoded in glob.iglob(f"/mnt/scope-data/20230110_035437_ee-tik-cn115_DIMM=522_verify_dram_functions/data/decoded/it={NUM}/trace--00000.csv"):
+for f_decoded in glob.iglob(f"/mnt/scope-data/20230110_035437_ee-tik-cn115_DIMM=522_verify_dram_functions/data/decoded/it={NUM}/trace--00000.csv*"):
 #for f_decoded in glob.glob("/mnt/scope-data/20230110_035437_ee-tik-cn115_DIMM=522_verify_dram_functions/data/decoded/it=*/trace--00000.csv"):
     print(f"    {f_decoded}")
     it = int(f_decoded.split('/')[-2].split('=')[1])
-    cmd = f"grep 'act' {f_decoded} | cut -d, -f3-5 | sort -nr | uniq -c | sort -t, -k1,2 -n | tail -n 5"
-    proc = subprocess.run(cmd, shell=True, check=True, executable='/bin/bash', stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    # the decoded CSV may be compressed, so it is decompressed into the pipe rather than read by grep
+    cmd = "grep 'act' | cut -d, -f3-5 | sort -nr | uniq -c | sort -t, -k1,2 -n | tail -n 5"
+    with open_file(f_decoded) as f:
+        proc = subprocess.run(cmd, shell=True, check=True, executable='/bin/bash', input=f.read(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
     #print(proc.stdout)
     any_match = False
     for line in proc.stdout.split('\n'):
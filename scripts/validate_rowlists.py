@@ -7,6 +7,10 @@ import re
 import statistics
 
 from collections import OrderedDict, defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "decoder"))
+from util.codec import open_file, strip_codec_suffix
 
 def main():
     path_decoded_dir = os.sys.argv[1]
@@ -28,11 +32,14 @@ def main():
     # counts for each iteration how often each <bg,bk> has been activated
     itid2bgbk = defaultdict(OrderedDict)
 
-    for csv in glob.glob(os.path.join(path_decoded_dir, "**/*.csv")):
+    for csv in glob.glob(os.path.join(path_decoded_dir, "**/*.csv*")):
+        # the decoded CSVs may be compressed (e.g., *.csv.gz)
+        if not strip_codec_suffix(csv).endswith(".csv"):
+            continue
         iteration_no = re.match(rx_it, csv).groups()[0]
         d = itid2bgbkrow[iteration_no]
         e = itid2bgbk[iteration_no]
-        with open(csv) as f:
+        with open_file(csv) as f:
             for l in f.readlines():
                 if 'act' in l:
                     key = ','.join(l.split(",")[2:5])